@@ -5,8 +5,9 @@ import os
 import streamlit as st
 from typing import Dict, Any, Optional, List
 from auth import FirebaseAuth, FirebaseUserDict
-from database import ChatDatabase
-from services import AIService, ConversationService
+from database import open_chat_storage
+from database.maintenance import start_maintenance
+from services import AIService, ConversationService, LocalRouter
 from ui import (
     render_sidebar,
     render_navbar,
@@ -18,6 +19,14 @@ from utils import (
     set_page_config,
 )
 
+
+@st.cache_resource
+def get_ai_service() -> AIService:
+    """One AIService per process, its chain is compiled once for all sessions
+    and script reruns."""
+    return AIService(speculative_rag=True, local_router=LocalRouter.load())
+
+
 set_page_config()
 
 env_vars = load_env_vars()
@@ -26,9 +35,10 @@ os.environ["OPENAI_API_KEY"] = env_vars["OPENAI_API_KEY"]
 
 init_session_state()
 
-db = ChatDatabase()
+db = open_chat_storage()
+start_maintenance(db)
 firebase_auth = FirebaseAuth()  
-ai_service = AIService()
+ai_service = get_ai_service()
 conversation_service = ConversationService(db, firebase_auth)
 
 
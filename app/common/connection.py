@@ -0,0 +1,223 @@
+# Import the SQLite fix before sqlite3, connections are opened here
+from sqlite_fix import *
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionManager:
+    """
+    Process-wide SQLite connections to one database file.
+
+    Each thread gets its own connection, opened on first use with the
+    manager's pragmas, so no connection is shared between threads. The
+    `setup` callable (table creation, migrations) runs once per process, on
+    the first connection.
+
+    SQLite allows a single writer per file. Writes go through `write()`,
+    which holds a process-wide lock for the whole transaction, so concurrent
+    sessions queue up instead of failing with "database is locked" when a
+    read transaction is upgraded.
+
+    `write_behind()` queues a write for the manager's writer thread instead,
+    the caller continues before the transaction is committed.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        pragmas: Optional[Dict[str, Any]] = None,
+        setup: Optional[Callable[[sqlite3.Connection], None]] = None,
+        row_factory: Optional[Callable] = None,
+    ):
+        self.db_path = db_path
+        self.pragmas = pragmas or {}
+        self.setup = setup
+        self.row_factory = row_factory
+        self.local = threading.local()
+        self.write_lock = threading.RLock()
+        self.setup_lock = threading.Lock()
+        self.is_set_up = False
+        # (work, future) pairs queued by write_behind()
+        self.pending: queue.Queue = queue.Queue()
+        self.writer: Optional[threading.Thread] = None
+        self.writer_lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        """The calling thread's connection."""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path)
+            if self.row_factory is not None:
+                connection.row_factory = self.row_factory
+            for pragma, value in self.pragmas.items():
+                connection.execute(f"PRAGMA {pragma} = {value}")
+            self.local.connection = connection
+        if not self.is_set_up:
+            with self.setup_lock, self.write_lock:
+                if not self.is_set_up:
+                    if self.setup is not None:
+                        self.setup(connection)
+                    self.is_set_up = True
+        return connection
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """
+        Serialized write transaction, committed on exit and rolled back on
+        error. Nested writes join the outer transaction.
+        """
+        with self.write_lock:
+            connection = self.connection()
+            depth = getattr(self.local, "write_depth", 0)
+            self.local.write_depth = depth + 1
+            try:
+                yield connection
+                if depth == 0:
+                    connection.commit()
+            except BaseException:
+                if depth == 0:
+                    connection.rollback()
+                raise
+            finally:
+                self.local.write_depth = depth
+
+    def write_behind(self, work: Callable[[sqlite3.Connection], Any]) -> Future:
+        """
+        Queue `work` to run in a write transaction on the writer thread and
+        return at once. The future resolves to its result once committed.
+
+        Work queued while the writer is busy is committed together in one
+        transaction, each in its own savepoint so a failing one is rolled
+        back alone. Queued work runs in order, but reads and `write()` don't
+        wait for it, call `flush()` first when they must see it.
+        """
+        future: Future = Future()
+        self.pending.put((work, future))
+        with self.writer_lock:
+            if self.writer is None:
+                self.writer = threading.Thread(
+                    target=self._write_pending, name="sqlite-writer", daemon=True
+                )
+                self.writer.start()
+        return future
+
+    def flush(self) -> None:
+        """Wait until the work queued by `write_behind()` is committed."""
+        self.pending.join()
+
+    def _write_pending(self) -> None:
+        while True:
+            batch = [self.pending.get()]
+            while True:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            outcomes: List[Tuple[Future, Any, Optional[BaseException]]] = []
+            try:
+                with self.write() as connection:
+                    if not connection.in_transaction:
+                        # Releasing the outermost savepoint would commit
+                        connection.execute("BEGIN IMMEDIATE")
+                    for work, future in batch:
+                        connection.execute("SAVEPOINT write_behind")
+                        try:
+                            result = work(connection)
+                            connection.execute("RELEASE write_behind")
+                            outcomes.append((future, result, None))
+                        except Exception as error:
+                            connection.execute("ROLLBACK TO write_behind")
+                            connection.execute("RELEASE write_behind")
+                            logger.exception("Write-behind work failed")
+                            outcomes.append((future, None, error))
+            except Exception as error:
+                logger.exception("Write-behind transaction failed")
+                outcomes = [(future, None, error) for _, future in batch]
+
+            for future, result, error in outcomes:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            for _ in batch:
+                self.pending.task_done()
+
+    def close(self) -> None:
+        """Close the calling thread's connection, the next use reopens it."""
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+
+def run_migrations(
+    connection: sqlite3.Connection,
+    migrations: List[Callable[[sqlite3.Cursor], None]],
+) -> None:
+    """
+    Apply the schema migrations a database file hasn't run yet.
+
+    `PRAGMA user_version` holds the number of migrations applied. Each one
+    runs in its own transaction with foreign keys off, so tables can be
+    rebuilt.
+    """
+    current = connection.execute("PRAGMA user_version").fetchone()[0]
+    if current >= len(migrations):
+        return
+
+    connection.commit()
+    foreign_keys = connection.execute("PRAGMA foreign_keys").fetchone()[0]
+    connection.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for version, migration in enumerate(migrations, start=1):
+            cursor = connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            # Another process may have migrated while we waited
+            current = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if current >= version:
+                connection.commit()
+                continue
+            try:
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {version}")
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+    finally:
+        connection.execute(f"PRAGMA foreign_keys = {foreign_keys}")
+
+
+_managers: Dict[str, ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def connection_manager(
+    db_path: str,
+    pragmas: Optional[Dict[str, Any]] = None,
+    setup: Optional[Callable[[sqlite3.Connection], None]] = None,
+    row_factory: Optional[Callable] = None,
+) -> ConnectionManager:
+    """
+    The process-wide manager of a database file, created on first use.
+
+    Later calls for the same file get the same manager, their arguments are
+    ignored.
+    """
+    key = os.path.abspath(db_path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = ConnectionManager(db_path, pragmas, setup, row_factory)
+            _managers[key] = manager
+    return manager
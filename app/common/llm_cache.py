@@ -0,0 +1,196 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import warnings
+from typing import Dict, Optional, Tuple
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+from .connection import connection_manager
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    Persistent LLM response cache for deterministic (temperature=0) chains.
+
+    LangChain calls the cache with the rendered prompt, which is the prompt
+    template filled with its variables, and the llm string, which holds the
+    model name and its parameters. Entries are keyed on a hash of both.
+    Expired entries are misses and dropped with the eviction, the least
+    recently used entries are evicted once the cache grows past
+    `max_entries`.
+
+    Connections are per thread through the file's ConnectionManager, in WAL
+    mode, so lookups don't wait for each other or for writes. Hits are
+    counted in memory and written every `touch_every` hits by the manager's
+    writer thread, a lookup never writes.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "data/llm_cache.db",
+        ttl_seconds: Optional[float] = 7 * 24 * 60 * 60,
+        max_entries: int = 10_000,
+        evict_every: int = 100,
+        touch_every: int = 50,
+    ):
+        self.manager = connection_manager(
+            db_path,
+            pragmas={"journal_mode": "WAL", "synchronous": "NORMAL"},
+            setup=SQLiteLLMCache._create_tables,
+        )
+        self.lock = threading.Lock()
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.touch_every = touch_every
+        self.hits = 0
+        self.misses = 0
+        self._updates = 0
+        # key -> (last access time, hits since the last write)
+        self._touched: Dict[str, Tuple[float, int]] = {}
+
+    @staticmethod
+    def _create_tables(connection: sqlite3.Connection):
+        with connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    llm_string TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    hit_count INTEGER NOT NULL DEFAULT 0
+                )
+            """
+            )
+            connection.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed_at ON llm_cache (accessed_at)
+            """
+            )
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        row = (
+            self.manager.connection()
+            .execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,))
+            .fetchone()
+        )
+
+        with self.lock:
+            if row is None or self._expired(row[1], now):
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            _, hits = self._touched.get(key, (now, 0))
+            self._touched[key] = (now, hits + 1)
+            if len(self._touched) >= self.touch_every:
+                self._write_touched()
+        with warnings.catch_warnings():
+            # Serialized generations are read back with langchain's beta loads
+            warnings.filterwarnings("ignore", message="The function `loads` is in beta")
+            return loads(row[0])
+
+    def _write_touched(self) -> None:
+        """Queue the access times and hit counts gathered since the last write,
+        the caller holds the lock."""
+        touched = [
+            (accessed_at, hits, key)
+            for key, (accessed_at, hits) in self._touched.items()
+        ]
+        self._touched = {}
+        self.manager.write_behind(
+            lambda connection: connection.executemany(
+                """
+                UPDATE llm_cache SET accessed_at = ?, hit_count = hit_count + ?
+                WHERE key = ?
+                """,
+                touched,
+            )
+        )
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        response = dumps(list(return_val))
+        with self.manager.write() as connection:
+            connection.execute(
+                """
+                INSERT INTO llm_cache (key, llm_string, response, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    response = excluded.response,
+                    created_at = excluded.created_at,
+                    accessed_at = excluded.accessed_at
+                """,
+                (key, llm_string, response, now, now),
+            )
+        with self.lock:
+            self._updates += 1
+            evict = self._updates % self.evict_every == 0
+            if evict and self._touched:
+                self._write_touched()
+        if evict:
+            # After the queued access times, so recently hit entries are kept
+            self.manager.flush()
+            self._evict(now)
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then the least recently used over max_entries."""
+        with self.manager.write() as connection:
+            if self.ttl_seconds is not None:
+                connection.execute(
+                    "DELETE FROM llm_cache WHERE created_at < ?",
+                    (now - self.ttl_seconds,),
+                )
+            connection.execute(
+                """
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY accessed_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def clear(self, **kwargs) -> None:
+        with self.lock:
+            self._touched = {}
+        self.manager.flush()
+        with self.manager.write() as connection:
+            connection.execute("DELETE FROM llm_cache")
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters of this process and the number of stored entries."""
+        entries = (
+            self.manager.connection()
+            .execute("SELECT COUNT(*) FROM llm_cache")
+            .fetchone()[0]
+        )
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+_shared_cache: Optional[SQLiteLLMCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_llm_cache() -> SQLiteLLMCache:
+    """Process-wide cache instance used by AIService and load_openai_llm."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = SQLiteLLMCache()
+    return _shared_cache
@@ -1,5 +1,6 @@
 from typing import List, Literal, Optional
 from pydantic import BaseModel, Field, validator
+from pydantic.json_schema import SkipJsonSchema
 
 
 class TradingStrategyDefinition(BaseModel):
@@ -68,6 +69,9 @@ class TradingStrategyDefinition(BaseModel):
         description="Search queries for the strategy"
     )
     source_urls: Optional[List[str]] = Field(description="Source URLs for the strategy")
+    # discord_strategies row the strategy was loaded from, kept out of the
+    # stored strategy JSON and of the format instructions
+    id: SkipJsonSchema[Optional[int]] = Field(default=None, exclude=True)
 
     # Add validators for list fields to handle string-to-list conversion
     @validator(
@@ -167,7 +171,9 @@ class TradingStrategyDefinition(BaseModel):
         markdown = ""
 
         if self.strategy_name:
-            markdown += f"#### {self.strategy_name}Strategy type: ({self.strategy_type})\n\n"
+            markdown += (
+                f"#### {self.strategy_name}Strategy type: ({self.strategy_type})\n\n"
+            )
 
         if self.trading_idea:
             markdown += f"#### Trading Idea\n{self.trading_idea}\n\n"
@@ -242,4 +248,3 @@ class TradingStrategyDefinition(BaseModel):
             markdown += "\n"
 
         return markdown
-
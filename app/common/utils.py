@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from pydantic import SecretStr
 import tiktoken
 from langchain_ollama import OllamaLLM
@@ -6,6 +7,8 @@ from typing import List, Tuple
 from langchain_openai import ChatOpenAI
 from langchain_core.documents import Document
 
+from .llm_cache import shared_llm_cache
+
 
 def check_langsmith():
     lang_chain = os.getenv("LANGCHAIN_API_KEY")
@@ -17,6 +20,7 @@ def check_langsmith():
 
 def load_openai_llm(
     model_name: str = "gpt-4o-mini-2024-07-18",
+    cache: bool = True,
 ):
     env_key = os.getenv("OPENAI_API_KEY")
     if env_key:
@@ -28,6 +32,7 @@ def load_openai_llm(
         api_key=secret_key,  # Convert string to SecretStr
         temperature=0.0,
         streaming=True,
+        cache=shared_llm_cache() if cache else None,
     )
 
 
@@ -77,8 +82,25 @@ def take_top_k(ranked_docs: List[Tuple[Document, float]], k: int = 5) -> List[in
     return [doc.metadata.get("id", -1) for doc, score in ranked_docs[:k]]
 
 
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = "cl100k_base") -> tiktoken.Encoding:
+    """Returns the tiktoken encoding, loaded once per process."""
+    return tiktoken.get_encoding(encoding_name)
+
+
 def num_tokens_from_string(string: str, encoding_name: str = "cl100k_base") -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.get_encoding(encoding_name)
+    encoding = get_encoding(encoding_name)
     num_tokens = len(encoding.encode(string))
     return num_tokens
+
+
+def truncate_to_tokens(
+    string: str, max_tokens: int, encoding_name: str = "cl100k_base"
+) -> str:
+    """Returns the text string cut to at most max_tokens tokens."""
+    encoding = get_encoding(encoding_name)
+    tokens = encoding.encode(string)
+    if len(tokens) <= max_tokens:
+        return string
+    return encoding.decode(tokens[:max_tokens])
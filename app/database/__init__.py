@@ -1,12 +1,35 @@
 """
-Database package for handling SQLite and ChromaDB operations.
+Database package for handling SQLite, PostgreSQL and ChromaDB operations.
 """
 
 # Import the SQLite fix before any other imports
 from sqlite_fix import *
 
-__all__ = ["VectorDB", "Database", "ChatDatabase"]
+import os
+
+__all__ = [
+    "VectorDB",
+    "Database",
+    "ChatStorage",
+    "ChatDatabase",
+    "PostgresChatDatabase",
+    "open_chat_storage",
+]
 
 from .vector_db import VectorDB
 from .database import Database
+from .chat_storage import ChatStorage
 from .chat_database import ChatDatabase
+from .postgres_chat_database import PostgresChatDatabase
+
+
+def open_chat_storage() -> ChatStorage:
+    """
+    The chat storage of the app: the PostgreSQL database at
+    CHAT_DATABASE_URL when it's set, so instances share their chats, the
+    local SQLite file otherwise.
+    """
+    url = os.getenv("CHAT_DATABASE_URL")
+    if url:
+        return PostgresChatDatabase(url)
+    return ChatDatabase()
@@ -1,304 +1,799 @@
-import sqlite3
 import json
-from datetime import datetime
-from typing import Dict, List, Optional, Any, Union
+import sqlite3
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
+from common import TradingStrategyDefinition
+from common.connection import connection_manager, run_migrations
 from shared.types import ChatMessage, ContextDict
 
-
-class ChatDatabase:
-    def __init__(self, db_path: str = "data/frontend.db"):
-        """Initialize database connection and create tables if they don't exist."""
-        self.connection = sqlite3.connect(db_path, check_same_thread=False)
-        self.connection.row_factory = sqlite3.Row
-        self._create_tables()
-
-    def _create_tables(self):
-        """Create necessary tables if they don't exist."""
-        cursor = self.connection.cursor()
-
-        # Create users table
-        cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS users (
-            id TEXT PRIMARY KEY,
-            email TEXT UNIQUE,
-            name TEXT,
-            login_type TEXT DEFAULT 'anonymous',
-            auth_provider TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_login TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
+from .chat_storage import (
+    ChatStorage,
+    ConversationSummaryCache,
+    Cursor,
+    _search_terms,
+)
+from .codec import decode_json, encode_json, encode_json_column
+from .database import Database
+
+_summary_cache = ConversationSummaryCache()
+
+# Hot tables holding a conversation's rows, in foreign key order, with the
+# condition selecting them and their columns stored through the codec layer
+ARCHIVED_TABLES: List[Tuple[str, str, Tuple[str, ...]]] = [
+    ("user_strategy_versions", "conversation_id = ?", ("strategy",)),
+    ("qa_turns", "conversation_id = ?", ()),
+    ("messages", "conversation_id = ?", ("context", "rendered")),
+    ("message_contexts", "conversation_id = ?", ()),
+    (
+        "message_traces",
+        "message_id IN (SELECT id FROM messages WHERE conversation_id = ?)",
+        (),
+    ),
+]
+
+
+class ChatDatabase(ChatStorage):
+    """
+    Chat storage in a SQLite file, for a single app instance.
+
+    Connections are shared per thread through the file's ConnectionManager,
+    and conversation summary pages are cached, as this process is the only
+    one writing to the file.
+
+    Conversations left untouched are archived by `archive_conversations`,
+    their rows moved out of the hot tables into one compressed blob, and
+    restored when they're read again.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "data/frontend.db",
+        strategy_db_path: str = "data/messages.db",
+    ):
         """
-        )
+        Use the process-wide connections to the database, migrating it on
+        first use.
 
-        # Create conversations table
-        cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS conversations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            name TEXT NOT NULL,
-            context TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
+        RAG strategies of a context are stored as `discord_strategies` IDs and
+        loaded from the database at `strategy_db_path`.
         """
+        self.db_path = db_path
+        self.strategy_db_path = strategy_db_path
+        self.summary_cache = _summary_cache
+        self.cache_key = db_path
+        self.manager = connection_manager(
+            db_path,
+            pragmas=CONNECTION_PRAGMAS,
+            setup=_migrate,
+            row_factory=sqlite3.Row,
         )
 
-        # Create messages table
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The calling thread's connection."""
+        return self.manager.connection()
+
+    def _cursor(self) -> Cursor:
+        return self.manager.connection().cursor()
+
+    @contextmanager
+    def _write(self) -> Iterator[Cursor]:
+        with self.manager.write() as connection:
+            yield connection.cursor()
+
+    def _write_behind(self, work: Callable[[Cursor], Any]) -> Future:
+        return self.manager.write_behind(lambda connection: work(connection.cursor()))
+
+    def _flush(self) -> None:
+        self.manager.flush()
+
+    def _load_rag_strategies(
+        self, ids: List[int]
+    ) -> Dict[int, TradingStrategyDefinition]:
+        if not ids:
+            return {}
+        strategies = {}
+        for row in Database(self.strategy_db_path).list_strategies_by_ids(ids):
+            row["strategy"].id = row["id"]
+            strategies[row["id"]] = row["strategy"]
+        return strategies
+
+    def search_messages(
+        self, user_id: str, query: str, offset: int = 0, limit: int = 20
+    ) -> List[Dict[str, Any]]:
+        terms = _search_terms(query)
+        if not terms:
+            return []
+        self._flush()
+        # Quoted terms, so words like AND or NEAR aren't operators
+        match = " ".join(f'"{term}"' for term in terms) + "*"
+        cursor = self._cursor()
         cursor.execute(
             """
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            conversation_id INTEGER,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            context TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (conversation_id) REFERENCES conversations (id)
-        )
-        """
+        SELECT message_search.rowid AS message_id, message_search.conversation_id,
+               c.name AS conversation_name, message_search.role,
+               message_search.created_at, message_search.strategy_name,
+               snippet(message_search, 0, '**', '**', '…', 12) AS snippet
+        FROM message_search
+        JOIN conversations c ON c.id = message_search.conversation_id
+        WHERE message_search MATCH ? AND c.user_id = ?
+        ORDER BY bm25(message_search, 1.0, 4.0), message_search.rowid DESC
+        LIMIT ? OFFSET ?
+        """,
+            (match, user_id, limit, offset),
         )
+        return [dict(row) for row in cursor.fetchall()]
 
-        self.connection.commit()
-
-    # User methods
-    def create_user(
+    def get_messages(
         self,
-        id: str,
-        email: Optional[str] = None,
-        name: Optional[str] = None,
-        login_type: str = "anonymous",
-        auth_provider: Optional[str] = None,
+        conversation_id: int,
+        before_id: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> List[ChatMessage]:
+        self.restore_conversation(conversation_id)
+        return super().get_messages(conversation_id, before_id, limit)
+
+    def get_conversation_context(self, conversation_id: int) -> Optional[ContextDict]:
+        self.restore_conversation(conversation_id)
+        return super().get_conversation_context(conversation_id)
+
+    # Archive methods
+    def archive_conversations(
+        self, older_than_days: int, limit: Optional[int] = None
     ) -> int:
-        """Create a new user and return their ID."""
-        cursor = self.connection.cursor()
-        now = datetime.now().isoformat()
+        """
+        Move the rows of conversations not updated for `older_than_days` out
+        of the hot tables and return how many were archived.
 
-        cursor.execute(
-            """
-        INSERT INTO users (id, email, name, login_type, auth_provider, created_at, last_login)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-            (id, email, name, login_type, auth_provider, now, now),
-        )
+        Each conversation is archived in its own transaction. Its row stays in
+        `conversations`, so it's still listed, and its messages stay
+        searchable.
+        """
+        self._flush()
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+        cursor = self._cursor()
+        query = """
+        SELECT id FROM conversations
+        WHERE archived_at IS NULL AND updated_at < ?
+          AND EXISTS (SELECT 1 FROM messages WHERE conversation_id = conversations.id)
+        ORDER BY updated_at
+        """
+        params: List[Any] = [cutoff]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        cursor.execute(query, params)
+        conversation_ids = [row["id"] for row in cursor.fetchall()]
 
-        self.connection.commit()
-        user_id = cursor.lastrowid
-        if user_id is None:
-            raise ValueError("Failed to create user: no ID returned")
-        return user_id
-
-    def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
-        """Get a user by their email."""
-        cursor = self.connection.cursor()
-        cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-        user = cursor.fetchone()
-
-        if user:
-            return dict(user)
-        return None
-
-    def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """Get a user by their ID."""
-        cursor = self.connection.cursor()
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-
-        if user:
-            return dict(user)
-        return None
-
-    def update_user_last_login(self, user_id: int) -> None:
-        """Update a user's last login timestamp."""
-        cursor = self.connection.cursor()
-        now = datetime.now().isoformat()
+        for conversation_id in conversation_ids:
+            with self._write() as cursor:
+                self._archive_conversation(cursor, conversation_id, cutoff)
+        return len(conversation_ids)
 
+    def _archive_conversation(
+        self, cursor: Cursor, conversation_id: int, cutoff: str
+    ) -> None:
+        # Written since it was selected
         cursor.execute(
-            """
-        UPDATE users SET last_login = ? WHERE id = ?
-        """,
-            (now, user_id),
+            "SELECT updated_at FROM conversations WHERE id = ? AND archived_at IS NULL",
+            (conversation_id,),
         )
+        row = cursor.fetchone()
+        if row is None or row["updated_at"] >= cutoff:
+            return
 
-        self.connection.commit()
+        archive: Dict[str, List[Dict[str, Any]]] = {}
+        for table, condition, encoded in ARCHIVED_TABLES:
+            cursor.execute(
+                f"SELECT * FROM {table} WHERE {condition}", (conversation_id,)
+            )
+            rows = [dict(row) for row in cursor.fetchall()]
+            for row in rows:
+                for column in encoded:
+                    row[column] = decode_json(row[column])
+            archive[table] = rows
 
-    # Conversation methods
-    def create_conversation(
-        self, user_id: str, name: str, context: Optional[Dict] = None
-    ) -> int:
-        """Create a new conversation and return its ID."""
-        cursor = self.connection.cursor()
         now = datetime.now().isoformat()
-        context_json = json.dumps(context) if context else None
-
+        # Marked first, the search index keeps the rows of archived messages
         cursor.execute(
-            """
-        INSERT INTO conversations (user_id, name, context, created_at, updated_at)
-        VALUES (?, ?, ?, ?, ?)
-        """,
-            (user_id, name, context_json, now, now),
+            "UPDATE conversations SET archived_at = ? WHERE id = ?",
+            (now, conversation_id),
         )
-
-        self.connection.commit()
-        conv_id = cursor.lastrowid
-        if conv_id is None:
-            raise ValueError("Failed to create conversation: no ID returned")
-        return conv_id
-
-    def get_conversation(self, conversation_id: int) -> Optional[Dict[str, Any]]:
-        """Get a conversation by its ID."""
-        cursor = self.connection.cursor()
-        cursor.execute("SELECT * FROM conversations WHERE id = ?", (conversation_id,))
-        conversation = cursor.fetchone()
-
-        if conversation:
-            result = dict(conversation)
-            if result.get("context"):
-                result["context"] = json.loads(result["context"])
-            return result
-        return None
-
-    def get_user_conversations(self, user_id: str) -> List[Dict[str, Any]]:
-        """Get all conversations for a user."""
-        cursor = self.connection.cursor()
         cursor.execute(
             """
-        SELECT * FROM conversations 
-        WHERE user_id = ? 
-        ORDER BY updated_at DESC
+        INSERT INTO conversation_archive (conversation_id, archived_at, data)
+        VALUES (?, ?, ?)
         """,
-            (user_id,),
-        )
-
-        conversations = []
-        for conversation in cursor.fetchall():
-            conv_dict = dict(conversation)
-            if conv_dict.get("context"):
-                conv_dict["context"] = json.loads(conv_dict["context"])
-            conversations.append(conv_dict)
-
-        return conversations
-
-    def update_conversation(
-        self,
-        conversation_id: int,
-        name: Optional[str] = None,
-        context: Optional[ContextDict] = None,
-    ) -> None:
-        """Update a conversation's name and/or context."""
-        cursor = self.connection.cursor()
-        now = datetime.now().isoformat()
-        updates = []
-        params = []
-
-        if name is not None:
-            updates.append("name = ?")
-            params.append(name)
-
-        if context is not None:
-            updates.append("context = ?")
-            params.append(json.dumps(context.model_dump()))
-
-        if not updates:
-            return
-
-        updates.append("updated_at = ?")
-        params.append(now)
-        params.append(conversation_id)
-
-        query = f"UPDATE conversations SET {', '.join(updates)} WHERE id = ?"
-        cursor.execute(query, params)
-
-        self.connection.commit()
-
-    def update_conversation_context(
-        self, conversation_id: int, context: ContextDict
-    ) -> None:
-        """Update only the context of a conversation."""
-        name = (
-            context.user_strategy.strategy_name
-            if context.user_strategy
-            else None
+            (conversation_id, now, encode_json(json.dumps(archive))),
         )
-        self.update_conversation(
-            conversation_id=conversation_id, name=name, context=context
-        )
-
-    def delete_conversation(self, conversation_id: int) -> None:
-        """Delete a conversation and all its messages."""
-        cursor = self.connection.cursor()
-
-        # Delete all messages in the conversation
+        # Traces and contexts are deleted by the foreign key cascades
         cursor.execute(
             "DELETE FROM messages WHERE conversation_id = ?", (conversation_id,)
         )
-
-        # Delete the conversation
-        cursor.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
-
-        self.connection.commit()
-
-    # Message methods
-    def add_message(self, chat_message: ChatMessage) -> int:
-        """Add a message to a conversation and return its ID."""
-        cursor = self.connection.cursor()
-        now = chat_message.created_at
-        context_json = (
-            json.dumps(chat_message.context.model_dump())
-            if chat_message.context
-            else None
+        cursor.execute(
+            "DELETE FROM qa_turns WHERE conversation_id = ?", (conversation_id,)
         )
-
         cursor.execute(
-            """
-        INSERT INTO messages (conversation_id, role, content, context, created_at)
-        VALUES (?, ?, ?, ?, ?)
-        """,
-            (
-                chat_message.conversation_id,
-                chat_message.role,
-                chat_message.content,
-                context_json,
-                chat_message.created_at,
-            ),
+            "DELETE FROM user_strategy_versions WHERE conversation_id = ?",
+            (conversation_id,),
         )
 
-        # Update the conversation's updated_at timestamp
+    def restore_conversation(self, conversation_id: int) -> bool:
+        """
+        Move an archived conversation's rows back into the hot tables.
+        Returns whether it was archived.
+        """
+        cursor = self._cursor()
         cursor.execute(
-            """
-        UPDATE conversations SET updated_at = ? WHERE id = ?
-        """,
-            (now, chat_message.conversation_id),
+            "SELECT archived_at FROM conversations WHERE id = ?", (conversation_id,)
         )
+        row = cursor.fetchone()
+        if row is None or row["archived_at"] is None:
+            return False
+
+        with self._write() as cursor:
+            cursor.execute(
+                "SELECT data FROM conversation_archive WHERE conversation_id = ?",
+                (conversation_id,),
+            )
+            row = cursor.fetchone()
+            # Restored by another thread meanwhile
+            if row is None:
+                return False
+            archive = json.loads(decode_json(row["data"]))
+            for table, _, encoded in ARCHIVED_TABLES:
+                rows = archive.get(table, [])
+                if not rows:
+                    continue
+                columns = list(rows[0])
+                # Rows written after it was archived win
+                cursor.executemany(
+                    f"""
+                INSERT OR IGNORE INTO {table} ({", ".join(columns)})
+                VALUES ({", ".join("?" * len(columns))})
+                """,
+                    [
+                        [
+                            (
+                                encode_json(row[column])
+                                if column in encoded
+                                else row[column]
+                            )
+                            for column in columns
+                        ]
+                        for row in rows
+                    ],
+                )
+            cursor.execute(
+                "DELETE FROM conversation_archive WHERE conversation_id = ?",
+                (conversation_id,),
+            )
+            # Read again, it isn't archived by the next maintenance run
+            cursor.execute(
+                """
+            UPDATE conversations SET archived_at = NULL, updated_at = ?
+            WHERE id = ?
+            """,
+                (datetime.now().isoformat(), conversation_id),
+            )
+        self._invalidate_summaries(conversation_id)
+        return True
+
+    def vacuum(self, max_pages: Optional[int] = None, full: bool = False) -> int:
+        """
+        Return free pages to the file system, all of them or up to
+        `max_pages`, and return how many were freed.
 
-        self.connection.commit()
-        msg_id = cursor.lastrowid
-        if msg_id is None:
-            raise ValueError("Failed to add message: no ID returned")
-        return msg_id
-
-    def get_messages(self, conversation_id: int) -> List[ChatMessage]:
-        """Get all messages for a conversation."""
-        cursor = self.connection.cursor()
+        Files created before incremental auto-vacuum was enabled free nothing
+        until rebuilt, with `full`, by one VACUUM. It rewrites the whole file
+        and blocks writes while it runs.
+        """
+        self._flush()
+        with self.manager.write() as connection:
+            free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0]
+            if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                if not full:
+                    return 0
+                connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                connection.execute("VACUUM")
+            else:
+                pages = "" if max_pages is None else f"({int(max_pages)})"
+                # Frees one page per step, fetching runs it to completion
+                connection.execute(f"PRAGMA incremental_vacuum{pages}").fetchall()
+            return (
+                free_pages - connection.execute("PRAGMA freelist_count").fetchone()[0]
+            )
+
+    def close(self) -> None:
+        """Close the calling thread's connection."""
+        self.manager.close()
+
+
+# Applied to every connection
+CONNECTION_PRAGMAS = {
+    "journal_mode": "WAL",
+    # Durable at WAL checkpoints, a power loss can only drop the last commits
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    # Free pages are returned by `ChatDatabase.vacuum`, only effective on
+    # files created with it or rebuilt since
+    "auto_vacuum": "INCREMENTAL",
+    # 16 MiB page cache, 256 MiB memory-mapped reads
+    "cache_size": -16_000,
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+
+def _create_base_schema(cursor: sqlite3.Cursor) -> None:
+    """
+    Version 1, the tables as created before versioned migrations.
+
+    Databases created by earlier releases are at user_version 0 with some or
+    all of these already in place, so every statement is idempotent.
+    """
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        email TEXT UNIQUE,
+        name TEXT,
+        login_type TEXT DEFAULT 'anonymous',
+        auth_provider TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_login TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS conversations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        name TEXT NOT NULL,
+        context TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        conversation_id INTEGER,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        context TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+    )
+    """
+    )
+    # Rendered markdown of a message (RenderedMessage JSON) and whether the
+    # turn was cancelled, added as columns before migrations were versioned
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(messages)")]
+    if "rendered" not in columns:
+        cursor.execute("ALTER TABLE messages ADD COLUMN rendered TEXT")
+    if "status" not in columns:
         cursor.execute(
-            """
-        SELECT * FROM messages 
-        WHERE conversation_id = ? 
-        ORDER BY created_at ASC
-        """,
-            (conversation_id,),
+            "ALTER TABLE messages ADD COLUMN status TEXT NOT NULL DEFAULT 'complete'"
         )
+    # One row per TraceSpan of a turn
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS message_traces (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        name TEXT NOT NULL,
+        model TEXT,
+        start_offset REAL NOT NULL,
+        duration REAL NOT NULL,
+        time_to_first_token REAL,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        cached INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (message_id) REFERENCES messages (id)
+    )
+    """
+    )
+
+
+def _add_cascades_and_indexes(cursor: sqlite3.Cursor) -> None:
+    """
+    Version 2, rebuild messages and message_traces so deleting a conversation
+    cascades to them, and index the lookups by conversation, user and message.
+
+    Rows whose parent was already deleted are unreachable and not copied.
+    """
+    cursor.execute(
+        """
+    CREATE TABLE messages_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        conversation_id INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        context TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        rendered TEXT,
+        status TEXT NOT NULL DEFAULT 'complete',
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+            ON DELETE CASCADE
+    )
+    """
+    )
+    cursor.execute(
+        """
+    INSERT INTO messages_new (
+        id, conversation_id, role, content, context, created_at, rendered, status
+    )
+    SELECT id, conversation_id, role, content, context, created_at, rendered, status
+    FROM messages
+    WHERE conversation_id IN (SELECT id FROM conversations)
+    """
+    )
+    cursor.execute("DROP TABLE messages")
+    cursor.execute("ALTER TABLE messages_new RENAME TO messages")
+
+    cursor.execute(
+        """
+    CREATE TABLE message_traces_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        name TEXT NOT NULL,
+        model TEXT,
+        start_offset REAL NOT NULL,
+        duration REAL NOT NULL,
+        time_to_first_token REAL,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        cached INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE
+    )
+    """
+    )
+    cursor.execute(
+        """
+    INSERT INTO message_traces_new
+    SELECT * FROM message_traces
+    WHERE message_id IN (SELECT id FROM messages)
+    """
+    )
+    cursor.execute("DROP TABLE message_traces")
+    cursor.execute("ALTER TABLE message_traces_new RENAME TO message_traces")
+
+    # Messages are paged by ID, which follows created_at within a conversation
+    cursor.execute(
+        """
+    CREATE INDEX IF NOT EXISTS idx_messages_conversation_id
+    ON messages (conversation_id, id)
+    """
+    )
+    cursor.execute(
+        """
+    CREATE INDEX IF NOT EXISTS idx_conversations_user_updated
+    ON conversations (user_id, updated_at DESC, id DESC)
+    """
+    )
+    cursor.execute(
+        """
+    CREATE INDEX IF NOT EXISTS idx_message_traces_message_id
+    ON message_traces (message_id)
+    """
+    )
+    cursor.execute(
+        """
+    CREATE INDEX IF NOT EXISTS idx_message_traces_kind_name
+    ON message_traces (kind, name)
+    """
+    )
 
-        messages = []
-        for message in cursor.fetchall():
-            messages.append(ChatMessage.from_dict(message))
 
-        return messages
+def _normalize_contexts(cursor: sqlite3.Cursor) -> None:
+    """
+    Version 3, tables storing a message's ContextDict as parts instead of a
+    JSON copy of the whole context per message and per conversation.
 
-    def close(self):
-        """Close the database connection."""
-        if self.connection:
-            self.connection.close()
+    Messages stored before keep their `context` JSON and are read from it.
+    """
+    # QA turns of a conversation, `turn_index` counts all its turns
+    cursor.execute(
+        """
+    CREATE TABLE qa_turns (
+        conversation_id INTEGER NOT NULL,
+        turn_index INTEGER NOT NULL,
+        question TEXT NOT NULL,
+        answer TEXT,
+        PRIMARY KEY (conversation_id, turn_index),
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+            ON DELETE CASCADE
+    )
+    """
+    )
+    # UserStrategy JSON, one row each time it changed
+    cursor.execute(
+        """
+    CREATE TABLE user_strategy_versions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        conversation_id INTEGER NOT NULL,
+        strategy TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+            ON DELETE CASCADE
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE INDEX idx_user_strategy_versions_conversation
+    ON user_strategy_versions (conversation_id, id)
+    """
+    )
+    # The context of a message: QA turns [qa_start, qa_end) of its
+    # conversation, a user strategy version, discord_strategies IDs in rank
+    # order (JSON list) and the small per-turn parts
+    cursor.execute(
+        """
+    CREATE TABLE message_contexts (
+        message_id INTEGER PRIMARY KEY,
+        conversation_id INTEGER NOT NULL,
+        user_strategy_id INTEGER,
+        rag_strategy_ids TEXT NOT NULL DEFAULT '[]',
+        qa_start INTEGER NOT NULL,
+        qa_end INTEGER NOT NULL,
+        route TEXT,
+        evaluation TEXT,
+        summary TEXT,
+        FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE,
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+            ON DELETE CASCADE,
+        FOREIGN KEY (user_strategy_id) REFERENCES user_strategy_versions (id)
+            ON DELETE CASCADE
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE INDEX idx_message_contexts_conversation
+    ON message_contexts (conversation_id, message_id)
+    """
+    )
+
+
+def _encode_json_columns(cursor: sqlite3.Cursor) -> None:
+    """Version 4, store the large JSON columns through the codec layer."""
+    encode_json_column(cursor, "messages", "context")
+    encode_json_column(cursor, "messages", "rendered")
+    encode_json_column(cursor, "conversations", "context")
+    encode_json_column(cursor, "user_strategy_versions", "strategy")
+
+
+def _add_message_search(cursor: sqlite3.Cursor) -> None:
+    """
+    Version 5, an FTS5 index of the messages' content and the name of the
+    user strategy in their context, kept in sync by triggers.
+
+    The names are also kept as plain text on `user_strategy_versions`, the
+    strategy JSON being compressed.
+    """
+    cursor.execute("ALTER TABLE user_strategy_versions ADD COLUMN name TEXT")
+    versions = cursor.execute(
+        "SELECT id, strategy FROM user_strategy_versions"
+    ).fetchall()
+    cursor.executemany(
+        "UPDATE user_strategy_versions SET name = ? WHERE id = ?",
+        [
+            (json.loads(decode_json(row[1])).get("strategy_name"), row[0])
+            for row in versions
+        ],
+    )
+
+    # Rows are keyed by message ID
+    cursor.execute(
+        """
+    CREATE VIRTUAL TABLE message_search USING fts5(
+        content, strategy_name, tokenize = 'porter unicode61'
+    )
+    """
+    )
+    cursor.execute(
+        """
+    INSERT INTO message_search (rowid, content, strategy_name)
+    SELECT m.id, m.content, usv.name
+    FROM messages m
+    LEFT JOIN message_contexts mc ON mc.message_id = m.id
+    LEFT JOIN user_strategy_versions usv ON usv.id = mc.user_strategy_id
+    """
+    )
+    # Messages stored before contexts were normalized
+    legacy = cursor.execute(
+        """
+    SELECT id, context FROM messages
+    WHERE context IS NOT NULL
+      AND id NOT IN (SELECT message_id FROM message_contexts)
+    """
+    ).fetchall()
+    names = []
+    for row in legacy:
+        user_strategy = json.loads(decode_json(row[1])).get("user_strategy")
+        if user_strategy and user_strategy.get("strategy_name"):
+            names.append((user_strategy["strategy_name"], row[0]))
+    cursor.executemany(
+        "UPDATE message_search SET strategy_name = ? WHERE rowid = ?", names
+    )
+
+    cursor.execute(
+        """
+    CREATE TRIGGER message_search_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO message_search (rowid, content) VALUES (new.id, new.content);
+    END
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TRIGGER message_search_update AFTER UPDATE OF content ON messages BEGIN
+        UPDATE message_search SET content = new.content WHERE rowid = new.id;
+    END
+    """
+    )
+    # Also run for the messages deleted by the conversation cascade
+    cursor.execute(
+        """
+    CREATE TRIGGER message_search_delete AFTER DELETE ON messages BEGIN
+        DELETE FROM message_search WHERE rowid = old.id;
+    END
+    """
+    )
+    # A message's context is stored right after the message
+    cursor.execute(
+        """
+    CREATE TRIGGER message_search_context AFTER INSERT ON message_contexts BEGIN
+        UPDATE message_search SET strategy_name = (
+            SELECT name FROM user_strategy_versions WHERE id = new.user_strategy_id
+        )
+        WHERE rowid = new.message_id;
+    END
+    """
+    )
+
+
+def _add_conversation_archive(cursor: sqlite3.Cursor) -> None:
+    """
+    Version 6, archived conversations: their hot rows as one compressed JSON
+    document per conversation.
+
+    The search index is rebuilt to hold what results show, so the messages
+    of archived conversations stay searchable. Its rows are kept when
+    archived messages are deleted, and dropped with their conversation.
+    """
+    cursor.execute("ALTER TABLE conversations ADD COLUMN archived_at TEXT")
+    cursor.execute(
+        """
+    CREATE TABLE conversation_archive (
+        conversation_id INTEGER PRIMARY KEY,
+        archived_at TEXT NOT NULL,
+        data BLOB NOT NULL,
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+            ON DELETE CASCADE
+    )
+    """
+    )
+
+    # FTS5 tables can't gain columns, the index of version 5 is copied into
+    # a new one, with its strategy names. The update and context triggers
+    # stay, they refer to the table by name.
+    cursor.execute("DROP TRIGGER message_search_insert")
+    cursor.execute("DROP TRIGGER message_search_delete")
+    cursor.execute(
+        """
+    CREATE TEMP TABLE message_search_v5 AS
+    SELECT rowid AS message_id, content, strategy_name FROM message_search
+    """
+    )
+    cursor.execute("DROP TABLE message_search")
+    cursor.execute(
+        """
+    CREATE VIRTUAL TABLE message_search USING fts5(
+        content, strategy_name,
+        conversation_id UNINDEXED, role UNINDEXED, created_at UNINDEXED,
+        tokenize = 'porter unicode61'
+    )
+    """
+    )
+    cursor.execute(
+        """
+    INSERT INTO message_search (
+        rowid, content, strategy_name, conversation_id, role, created_at
+    )
+    SELECT s.message_id, s.content, s.strategy_name,
+           m.conversation_id, m.role, m.created_at
+    FROM message_search_v5 s
+    JOIN messages m ON m.id = s.message_id
+    """
+    )
+    cursor.execute("DROP TABLE message_search_v5")
+
+    # Restoring an archived message replaces its kept row. The strategy name
+    # is kept, messages stored before contexts were normalized have no
+    # context row to set it again.
+    cursor.execute(
+        """
+    CREATE TRIGGER message_search_insert AFTER INSERT ON messages BEGIN
+        INSERT OR REPLACE INTO message_search (
+            rowid, content, strategy_name, conversation_id, role, created_at
+        )
+        VALUES (
+            new.id,
+            new.content,
+            (SELECT strategy_name FROM message_search WHERE rowid = new.id),
+            new.conversation_id,
+            new.role,
+            new.created_at
+        );
+    END
+    """
+    )
+    # Also run for the messages deleted by the conversation cascade
+    cursor.execute(
+        """
+    CREATE TRIGGER message_search_delete AFTER DELETE ON messages
+    WHEN NOT EXISTS (
+        SELECT 1 FROM conversations
+        WHERE id = old.conversation_id AND archived_at IS NOT NULL
+    )
+    BEGIN
+        DELETE FROM message_search WHERE rowid = old.id;
+    END
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TRIGGER message_search_archived_delete AFTER DELETE ON conversations
+    WHEN old.archived_at IS NOT NULL
+    BEGIN
+        DELETE FROM message_search WHERE conversation_id = old.id;
+    END
+    """
+    )
+
+
+def _add_conversation_memory(cursor: sqlite3.Cursor) -> None:
+    """
+    Version 7, the running summary of a conversation's older QA turns,
+    stored after its latest turn.
+    """
+    cursor.execute(
+        """
+    CREATE TABLE conversation_memory (
+        conversation_id INTEGER PRIMARY KEY,
+        summary TEXT NOT NULL,
+        qa_offset INTEGER NOT NULL,
+        updated_at TEXT NOT NULL,
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+            ON DELETE CASCADE
+    )
+    """
+    )
+
+
+# Schema migrations in order, a database at user_version N has run the first N
+MIGRATIONS: List[Callable[[sqlite3.Cursor], None]] = [
+    _create_base_schema,
+    _add_cascades_and_indexes,
+    _normalize_contexts,
+    _encode_json_columns,
+    _add_message_search,
+    _add_conversation_archive,
+    _add_conversation_memory,
+]
+
+
+def _migrate(connection: sqlite3.Connection) -> None:
+    run_migrations(connection, MIGRATIONS)
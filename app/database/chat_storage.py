@@ -0,0 +1,966 @@
+"""
+Storage of the chat UI, independent of the database it runs on.
+
+ChatDatabase stores it in a SQLite file, PostgresChatDatabase in a
+PostgreSQL database shared by several app instances.
+"""
+
+import json
+import re
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from datetime import datetime
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from common import TradingStrategyDefinition
+from shared.trace import TurnTrace
+from shared.types import (
+    ChatMessage,
+    ContextDict,
+    EvaluationContext,
+    QaContext,
+    RouteContext,
+    UserStrategy,
+)
+
+from .codec import decode_json, encode_json
+
+# sqlite3.Cursor or a backend's cursor behaving like one
+Cursor = Any
+
+
+class ConversationSummaryCache:
+    """
+    Process-wide cache of the conversation summary pages of each user.
+
+    Shared by every storage of the process, so a write through one connection
+    (e.g. a generation job storing its answer) invalidates the pages read
+    through another. Only valid when this process is the database's single
+    writer.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (storage key, user_id) -> {(before, limit): page}
+        self.pages: Dict[Tuple[str, str], Dict[Any, List[Dict[str, Any]]]] = {}
+
+    def get(
+        self, key: str, user_id: str, page_key: Any
+    ) -> Optional[List[Dict[str, Any]]]:
+        with self.lock:
+            page = self.pages.get((key, str(user_id)), {}).get(page_key)
+        return [dict(row) for row in page] if page is not None else None
+
+    def set(
+        self, key: str, user_id: str, page_key: Any, page: List[Dict[str, Any]]
+    ) -> None:
+        with self.lock:
+            self.pages.setdefault((key, str(user_id)), {})[page_key] = page
+
+    def invalidate(self, key: str, user_id: Optional[str]) -> None:
+        # conversations.user_id reads back numeric IDs as ints in SQLite, the
+        # column having INTEGER affinity
+        with self.lock:
+            self.pages.pop((key, str(user_id)), None)
+
+
+class UnitOfWork:
+    """
+    Writes of a chat turn committed in one transaction: its messages with
+    their contexts and traces, and the update of their conversations.
+
+    Committing with `write_behind` queues the transaction on the database's
+    writer thread and returns before it's written. Messages get their IDs
+    when the transaction runs.
+    """
+
+    def __init__(self, db: "ChatStorage"):
+        self.db = db
+        self.messages: List[Tuple[ChatMessage, Optional[TurnTrace]]] = []
+        # conversation_id -> new name
+        self.names: Dict[int, str] = {}
+
+    def add_message(
+        self, chat_message: ChatMessage, trace: Optional[TurnTrace] = None
+    ) -> None:
+        self.messages.append((chat_message, trace))
+
+    def update_conversation_context(
+        self, conversation_id: int, context: ContextDict
+    ) -> None:
+        """Name the conversation after the context's user strategy."""
+        if context.user_strategy is not None:
+            self.names[conversation_id] = context.user_strategy.strategy_name
+
+    def commit(self, write_behind: bool = False) -> Optional[Future]:
+        """
+        Write everything added, in order. With `write_behind`, return the
+        future of the message IDs instead of waiting for the commit.
+        """
+        return self.db._commit(self, write_behind)
+
+
+class ChatStorage(ABC):
+    """
+    Users, conversations, messages and traces of the chat UI.
+
+    The queries are shared by every backend and written in the SQL both
+    SQLite and PostgreSQL accept, with `?` placeholders. A backend provides
+    the cursors they run on:
+
+    - `_cursor()`, for reads outside a transaction;
+    - `_write()`, a write transaction;
+    - `_write_behind(work)`, the same queued to run after the call returns;
+    - `_flush()`, waiting for the queued writes;
+
+    and what its SQL dialect doesn't share, `search_messages` and where the
+    RAG strategies of contexts are read from, `_load_rag_strategies`.
+
+    Cursors follow sqlite3's: `execute` and `executemany` with `?`
+    placeholders, rows readable by column name.
+    """
+
+    # Pages of `get_conversation_summaries`, when it's safe to cache them
+    summary_cache: Optional[ConversationSummaryCache] = None
+    cache_key = ""
+
+    @abstractmethod
+    def _cursor(self) -> Cursor: ...
+
+    @abstractmethod
+    def _write(self) -> ContextManager[Cursor]: ...
+
+    @abstractmethod
+    def _write_behind(self, work: Callable[[Cursor], Any]) -> Future: ...
+
+    @abstractmethod
+    def _flush(self) -> None: ...
+
+    def close(self) -> None:
+        """Release the connections of the calling thread."""
+
+    # User methods
+    def create_user(
+        self,
+        id: str,
+        email: Optional[str] = None,
+        name: Optional[str] = None,
+        login_type: str = "anonymous",
+        auth_provider: Optional[str] = None,
+    ) -> str:
+        """Create a new user and return their ID."""
+        now = datetime.now().isoformat()
+
+        with self._write() as cursor:
+            cursor.execute(
+                """
+            INSERT INTO users (id, email, name, login_type, auth_provider, created_at, last_login)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+                (id, email, name, login_type, auth_provider, now, now),
+            )
+        return id
+
+    def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Get a user by their email."""
+        cursor = self._cursor()
+        cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
+        user = cursor.fetchone()
+
+        if user:
+            return dict(user)
+        return None
+
+    def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get a user by their ID."""
+        cursor = self._cursor()
+        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+        user = cursor.fetchone()
+
+        if user:
+            return dict(user)
+        return None
+
+    def update_user_last_login(self, user_id: int) -> None:
+        """Update a user's last login timestamp."""
+        now = datetime.now().isoformat()
+
+        with self._write() as cursor:
+            cursor.execute(
+                """
+            UPDATE users SET last_login = ? WHERE id = ?
+            """,
+                (now, user_id),
+            )
+
+    # Conversation methods
+    def create_conversation(
+        self, user_id: str, name: str, context: Optional[Dict] = None
+    ) -> int:
+        """Create a new conversation and return its ID."""
+        now = datetime.now().isoformat()
+        context_json = encode_json(json.dumps(context)) if context else None
+
+        with self._write() as cursor:
+            cursor.execute(
+                """
+            INSERT INTO conversations (user_id, name, context, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            RETURNING id
+            """,
+                (user_id, name, context_json, now, now),
+            )
+            conv_id = cursor.fetchone()["id"]
+        self._invalidate_user_summaries(user_id)
+        return conv_id
+
+    def get_conversation(self, conversation_id: int) -> Optional[Dict[str, Any]]:
+        """Get a conversation by its ID."""
+        cursor = self._cursor()
+        cursor.execute("SELECT * FROM conversations WHERE id = ?", (conversation_id,))
+        conversation = cursor.fetchone()
+
+        if conversation:
+            result = dict(conversation)
+            if result.get("context"):
+                result["context"] = json.loads(decode_json(result["context"]))
+            return result
+        return None
+
+    def get_user_conversations(self, user_id: str) -> List[Dict[str, Any]]:
+        """Get all conversations for a user."""
+        cursor = self._cursor()
+        cursor.execute(
+            """
+        SELECT * FROM conversations 
+        WHERE user_id = ? 
+        ORDER BY updated_at DESC
+        """,
+            (user_id,),
+        )
+
+        conversations = []
+        for conversation in cursor.fetchall():
+            conv_dict = dict(conversation)
+            if conv_dict.get("context"):
+                conv_dict["context"] = json.loads(decode_json(conv_dict["context"]))
+            conversations.append(conv_dict)
+
+        return conversations
+
+    def get_conversation_summaries(
+        self,
+        user_id: str,
+        before: Optional[Tuple[str, int]] = None,
+        limit: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Get the ID, name and updated_at of a user's conversations, most
+        recently updated first.
+
+        With `limit`, only the first `limit` conversations after the
+        `(updated_at, id)` of `before` are returned. Pass those of the last
+        loaded conversation as `before` to page further. Pages are cached
+        until one of the user's conversations is written.
+        """
+        page_key = (before, limit)
+        if self.summary_cache is not None:
+            cached = self.summary_cache.get(self.cache_key, user_id, page_key)
+            if cached is not None:
+                return cached
+
+        cursor = self._cursor()
+        query = "SELECT id, name, updated_at FROM conversations WHERE user_id = ?"
+        params: List[Any] = [user_id]
+        if before is not None:
+            query += " AND (updated_at < ? OR (updated_at = ? AND id < ?))"
+            params.extend([before[0], before[0], before[1]])
+        query += " ORDER BY updated_at DESC, id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        cursor.execute(query, params)
+
+        conversations = [dict(row) for row in cursor.fetchall()]
+        if self.summary_cache is not None:
+            self.summary_cache.set(self.cache_key, user_id, page_key, conversations)
+        return [dict(row) for row in conversations]
+
+    def update_conversation(
+        self,
+        conversation_id: int,
+        name: Optional[str] = None,
+    ) -> None:
+        """Update a conversation's name."""
+        now = datetime.now().isoformat()
+        updates = []
+        params = []
+
+        if name is not None:
+            updates.append("name = ?")
+            params.append(name)
+
+        if not updates:
+            return
+
+        updates.append("updated_at = ?")
+        params.append(now)
+        params.append(conversation_id)
+
+        query = f"UPDATE conversations SET {', '.join(updates)} WHERE id = ?"
+        with self._write() as cursor:
+            cursor.execute(query, params)
+        self._invalidate_summaries(conversation_id)
+
+    def update_conversation_context(
+        self, conversation_id: int, context: ContextDict
+    ) -> None:
+        """
+        Name the conversation after the context's user strategy.
+
+        The context itself is stored with the message that produced it, see
+        `get_conversation_context`.
+        """
+        name = context.user_strategy.strategy_name if context.user_strategy else None
+        self.update_conversation(conversation_id=conversation_id, name=name)
+
+    def get_conversation_context(self, conversation_id: int) -> Optional[ContextDict]:
+        """The context of the conversation's latest message that has one."""
+        self._flush()
+        cursor = self._cursor()
+        cursor.execute(
+            """
+        SELECT * FROM message_contexts WHERE conversation_id = ?
+        ORDER BY message_id DESC LIMIT 1
+        """,
+            (conversation_id,),
+        )
+        row = cursor.fetchone()
+        if row is not None:
+            context = self._load_contexts(conversation_id, [row])[row["message_id"]]
+        else:
+            # Conversations last written before contexts were normalized
+            conversation = self.get_conversation(conversation_id)
+            if not conversation or not conversation.get("context"):
+                return None
+            context = ContextDict(**conversation["context"])
+
+        # Summarized after its latest message was stored
+        cursor = self._cursor()
+        cursor.execute(
+            "SELECT summary, qa_offset FROM conversation_memory WHERE conversation_id = ?",
+            (conversation_id,),
+        )
+        memory = cursor.fetchone()
+        if memory is not None:
+            context.fold_summary(memory["summary"], memory["qa_offset"])
+        return context
+
+    def save_conversation_memory(
+        self, conversation_id: int, summary: str, qa_offset: int
+    ) -> None:
+        """
+        Store the running summary of the conversation's QA turns before the
+        `qa_offset`th, unless one covering more turns is already stored.
+        """
+        with self._write() as cursor:
+            cursor.execute(
+                """
+            INSERT INTO conversation_memory (
+                conversation_id, summary, qa_offset, updated_at
+            )
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (conversation_id) DO UPDATE SET
+                summary = excluded.summary,
+                qa_offset = excluded.qa_offset,
+                updated_at = excluded.updated_at
+            WHERE excluded.qa_offset > conversation_memory.qa_offset
+            """,
+                (conversation_id, summary, qa_offset, datetime.now().isoformat()),
+            )
+
+    def delete_conversation(self, conversation_id: int) -> None:
+        """Delete a conversation and all its messages."""
+        self._flush()
+        user_id = self._conversation_user_id(conversation_id)
+        # Messages, their traces and contexts, and the memory are deleted by
+        # the foreign key cascades
+        with self._write() as cursor:
+            cursor.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+        self._invalidate_user_summaries(user_id)
+
+    # Message methods
+    def add_message(self, chat_message: ChatMessage) -> int:
+        """Add a message to a conversation and return its ID."""
+        unit = self.unit_of_work()
+        unit.add_message(chat_message)
+        unit.commit()
+        return chat_message.id
+
+    def unit_of_work(self) -> "UnitOfWork":
+        """Writes committed together in one transaction, see UnitOfWork."""
+        return UnitOfWork(self)
+
+    def _commit(self, unit: "UnitOfWork", write_behind: bool) -> Optional[Future]:
+        # Rendered outside the transaction, it's the slow part
+        rendered = [
+            encode_json(message.render().model_dump_json())
+            for message, _ in unit.messages
+        ]
+        conversation_ids = {m.conversation_id for m, _ in unit.messages}
+        conversation_ids.update(unit.names)
+
+        def write(cursor: Cursor) -> List[int]:
+            updated_at: Dict[int, str] = {}
+            try:
+                for (message, trace), rendered_json in zip(unit.messages, rendered):
+                    message.id = self._insert_message(cursor, message, rendered_json)
+                    if trace is not None:
+                        self._insert_trace(cursor, message.id, trace)
+                    updated_at[message.conversation_id] = message.created_at
+            except BaseException:
+                for message, _ in unit.messages:
+                    message.id = None
+                raise
+            now = datetime.now().isoformat()
+            cursor.executemany(
+                """
+            UPDATE conversations SET updated_at = ?, name = COALESCE(?, name)
+            WHERE id = ?
+            """,
+                [
+                    (
+                        updated_at.get(conversation_id, now),
+                        unit.names.get(conversation_id),
+                        conversation_id,
+                    )
+                    for conversation_id in conversation_ids
+                ],
+            )
+            return [message.id for message, _ in unit.messages]
+
+        def invalidate_summaries(*_: Any) -> None:
+            for conversation_id in conversation_ids:
+                self._invalidate_summaries(conversation_id)
+
+        if write_behind:
+            future = self._write_behind(write)
+            future.add_done_callback(invalidate_summaries)
+            return future
+
+        # After the turns queued before this one
+        self._flush()
+        with self._write() as cursor:
+            write(cursor)
+        invalidate_summaries()
+        return None
+
+    def _insert_message(
+        self, cursor: Cursor, chat_message: ChatMessage, rendered: bytes
+    ) -> int:
+        cursor.execute(
+            """
+        INSERT INTO messages (
+            conversation_id, role, content, created_at, rendered, status
+        )
+        VALUES (?, ?, ?, ?, ?, ?)
+        RETURNING id
+        """,
+            (
+                chat_message.conversation_id,
+                chat_message.role,
+                chat_message.content,
+                chat_message.created_at,
+                rendered,
+                chat_message.status,
+            ),
+        )
+        msg_id = cursor.fetchone()["id"]
+        if chat_message.context is not None:
+            self._store_context(
+                cursor, msg_id, chat_message.conversation_id, chat_message.context
+            )
+        return msg_id
+
+    def get_messages(
+        self,
+        conversation_id: int,
+        before_id: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> List[ChatMessage]:
+        """
+        Get the messages of a conversation, oldest first.
+
+        With `limit`, only the newest `limit` messages with an ID below
+        `before_id` are returned. Pass the ID of the oldest loaded message as
+        `before_id` to page further back.
+        """
+        self._flush()
+        cursor = self._cursor()
+        query = """
+        SELECT m.*, mc.message_id AS context_id FROM messages m
+        LEFT JOIN message_contexts mc ON mc.message_id = m.id
+        WHERE m.conversation_id = ?
+        """
+        params: List[Any] = [conversation_id]
+        if before_id is not None:
+            query += " AND m.id < ?"
+            params.append(before_id)
+        query += " ORDER BY m.id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        cursor.execute(query, params)
+
+        rows = list(reversed(cursor.fetchall()))
+
+        # Contexts are only loaded when one of them is accessed, then for all
+        # messages of the page at once
+        context_ids = [row["id"] for row in rows if row["context_id"] is not None]
+        contexts: Dict[int, ContextDict] = {}
+
+        def load_context(message_id: int) -> Optional[ContextDict]:
+            if not contexts:
+                contexts.update(
+                    self._load_message_contexts(conversation_id, context_ids)
+                )
+            return contexts.get(message_id)
+
+        messages = []
+        missing = []
+        for row in rows:
+            message = dict(row)
+            raw_context = message["context"]
+            message["context"] = None
+            message["rendered"] = decode_json(message["rendered"])
+            chat_message = ChatMessage.from_dict(message)
+            if row["context_id"] is not None:
+                chat_message.lazy_context(partial(load_context, row["id"]))
+            elif raw_context is not None:
+                # Stored before contexts were normalized
+                chat_message.lazy_context(partial(_parse_context, raw_context))
+            if chat_message.rendered is None:
+                missing.append(chat_message)
+            messages.append(chat_message)
+
+        # Messages stored before rendered markdown was kept, render them once
+        if missing:
+            with self._write() as cursor:
+                cursor.executemany(
+                    "UPDATE messages SET rendered = ? WHERE id = ?",
+                    [
+                        (encode_json(m.render().model_dump_json()), m.id)
+                        for m in missing
+                    ],
+                )
+
+        return messages
+
+    @abstractmethod
+    def search_messages(
+        self, user_id: str, query: str, offset: int = 0, limit: int = 20
+    ) -> List[Dict[str, Any]]:
+        """
+        Full-text search of a user's messages and the names of the strategies
+        discussed in them, best match first.
+
+        Every word of `query` must match, the last one as a prefix so results
+        follow typing. Returns the `limit` results after the first `offset`,
+        each with message_id, conversation_id, conversation_name, role,
+        created_at, strategy_name and a snippet of the content with the
+        matches in bold.
+        """
+
+    # Context methods
+    def _store_context(
+        self,
+        cursor: Cursor,
+        message_id: int,
+        conversation_id: int,
+        context: ContextDict,
+    ) -> None:
+        """
+        Store the context of a message as its parts, inside the message's
+        write transaction.
+
+        QA turns are stored once per conversation, keyed by their index among
+        all turns, and the message keeps the range it saw. A user strategy is
+        stored as a new version only when it changed since the last one. RAG
+        strategies are kept as `discord_strategies` IDs in rank order.
+        """
+        user_strategy_id = None
+        if context.user_strategy is not None:
+            strategy_json = context.user_strategy.model_dump_json()
+            cursor.execute(
+                """
+            SELECT id, strategy FROM user_strategy_versions
+            WHERE conversation_id = ? ORDER BY id DESC LIMIT 1
+            """,
+                (conversation_id,),
+            )
+            latest = cursor.fetchone()
+            if latest is not None and decode_json(latest["strategy"]) == strategy_json:
+                user_strategy_id = latest["id"]
+            else:
+                cursor.execute(
+                    """
+                INSERT INTO user_strategy_versions (
+                    conversation_id, strategy, name, created_at
+                )
+                VALUES (?, ?, ?, ?)
+                RETURNING id
+                """,
+                    (
+                        conversation_id,
+                        encode_json(strategy_json),
+                        context.user_strategy.strategy_name,
+                        datetime.now().isoformat(),
+                    ),
+                )
+                user_strategy_id = cursor.fetchone()["id"]
+
+        cursor.executemany(
+            """
+        INSERT INTO qa_turns (conversation_id, turn_index, question, answer)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+        """,
+            [
+                (conversation_id, context.qa_offset + i, qa.question, qa.answer)
+                for i, qa in enumerate(context.conversations)
+            ],
+        )
+
+        cursor.execute(
+            """
+        INSERT INTO message_contexts (
+            message_id, conversation_id, user_strategy_id, rag_strategy_ids,
+            qa_start, qa_end, route, evaluation, summary
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            (
+                message_id,
+                conversation_id,
+                user_strategy_id,
+                json.dumps([s.id for s in context.rag_strategies if s.id is not None]),
+                context.qa_offset,
+                context.qa_offset + len(context.conversations),
+                context.route.model_dump_json() if context.route else None,
+                context.evaluation.model_dump_json() if context.evaluation else None,
+                context.summary,
+            ),
+        )
+        self._store_rag_strategies(cursor, context.rag_strategies)
+        # The conversation's context is now that of its latest message
+        cursor.execute(
+            """
+        UPDATE conversations SET context = NULL
+        WHERE id = ? AND context IS NOT NULL
+        """,
+            (conversation_id,),
+        )
+
+    def _load_message_contexts(
+        self, conversation_id: int, message_ids: List[int]
+    ) -> Dict[int, ContextDict]:
+        """Rebuild the stored contexts of messages of a conversation."""
+        if not message_ids:
+            return {}
+        placeholders = ",".join("?" * len(message_ids))
+        cursor = self._cursor()
+        cursor.execute(
+            f"SELECT * FROM message_contexts WHERE message_id IN ({placeholders})",
+            message_ids,
+        )
+        return self._load_contexts(conversation_id, cursor.fetchall())
+
+    def _load_contexts(
+        self, conversation_id: int, rows: List[Any]
+    ) -> Dict[int, ContextDict]:
+        """
+        Build ContextDicts from `message_contexts` rows, reading the QA turns,
+        user strategy versions and RAG strategies they refer to in one query
+        each.
+        """
+        if not rows:
+            return {}
+        cursor = self._cursor()
+
+        cursor.execute(
+            """
+        SELECT turn_index, question, answer FROM qa_turns
+        WHERE conversation_id = ? AND turn_index >= ? AND turn_index < ?
+        """,
+            (
+                conversation_id,
+                min(row["qa_start"] for row in rows),
+                max(row["qa_end"] for row in rows),
+            ),
+        )
+        turns = {
+            turn["turn_index"]: QaContext(
+                question=turn["question"], answer=turn["answer"]
+            )
+            for turn in cursor.fetchall()
+        }
+
+        version_ids = {row["user_strategy_id"] for row in rows} - {None}
+        versions: Dict[int, UserStrategy] = {}
+        if version_ids:
+            placeholders = ",".join("?" * len(version_ids))
+            cursor.execute(
+                f"""
+            SELECT id, strategy FROM user_strategy_versions
+            WHERE id IN ({placeholders})
+            """,
+                list(version_ids),
+            )
+            versions = {
+                version["id"]: UserStrategy.model_validate_json(
+                    decode_json(version["strategy"])
+                )
+                for version in cursor.fetchall()
+            }
+
+        rag_ids = {
+            row["message_id"]: json.loads(row["rag_strategy_ids"]) for row in rows
+        }
+        strategies = self._load_rag_strategies(
+            sorted({id for ids in rag_ids.values() for id in ids})
+        )
+
+        contexts = {}
+        for row in rows:
+            contexts[row["message_id"]] = ContextDict(
+                user_strategy=versions.get(row["user_strategy_id"]),
+                rag_strategies=[
+                    strategies[id]
+                    for id in rag_ids[row["message_id"]]
+                    if id in strategies
+                ],
+                route=(
+                    RouteContext.model_validate_json(row["route"])
+                    if row["route"]
+                    else None
+                ),
+                conversations=[
+                    turns[index]
+                    for index in range(row["qa_start"], row["qa_end"])
+                    if index in turns
+                ],
+                evaluation=(
+                    EvaluationContext.model_validate_json(row["evaluation"])
+                    if row["evaluation"]
+                    else None
+                ),
+                summary=row["summary"],
+                qa_offset=row["qa_start"],
+            )
+        return contexts
+
+    @abstractmethod
+    def _load_rag_strategies(
+        self, ids: List[int]
+    ) -> Dict[int, TradingStrategyDefinition]:
+        """The RAG strategies with these `discord_strategies` IDs, by ID."""
+
+    def _store_rag_strategies(
+        self, cursor: Cursor, strategies: List[TradingStrategyDefinition]
+    ) -> None:
+        """
+        Keep the RAG strategies of a context being stored, inside its write
+        transaction, for backends that can't read them where they were
+        retrieved from. Nothing to do by default.
+        """
+
+    # Trace methods
+    def add_message_trace(self, message_id: int, trace: TurnTrace) -> None:
+        """Store the spans of the turn that produced a message."""
+        with self._write() as cursor:
+            self._insert_trace(cursor, message_id, trace)
+
+    def _insert_trace(self, cursor: Cursor, message_id: int, trace: TurnTrace) -> None:
+        now = datetime.now().isoformat()
+        rows = [
+            (
+                message_id,
+                span.kind,
+                span.name,
+                span.model,
+                span.start_offset,
+                span.duration,
+                span.time_to_first_token,
+                span.prompt_tokens,
+                span.completion_tokens,
+                span.cached,
+                now,
+            )
+            for span in trace.spans
+        ]
+        cursor.executemany(
+            """
+        INSERT INTO message_traces (
+            message_id, kind, name, model, start_offset, duration,
+            time_to_first_token, prompt_tokens, completion_tokens, cached, created_at
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            rows,
+        )
+
+    def get_trace_percentiles(
+        self, kind: str = "stage", since: Optional[str] = None
+    ) -> Dict[str, Dict[str, float]]:
+        """
+        p50/p95 duration and time to first token per span name of a kind.
+
+        LLM spans are grouped per chain and model, cached calls are left out.
+        `since` is an ISO timestamp to only look at recent turns.
+        """
+        cursor = self._cursor()
+        query = """
+        SELECT name, model, duration, time_to_first_token,
+               prompt_tokens, completion_tokens
+        FROM message_traces
+        WHERE kind = ? AND NOT cached
+        """
+        params: List[Any] = [kind]
+        if since is not None:
+            query += " AND created_at >= ?"
+            params.append(since)
+        cursor.execute(query, params)
+
+        groups: Dict[str, List[Any]] = {}
+        for row in cursor.fetchall():
+            name = f"{row['name']}/{row['model']}" if row["model"] else row["name"]
+            groups.setdefault(name, []).append(row)
+
+        stats = {}
+        for name, rows in groups.items():
+            durations = sorted(row["duration"] for row in rows)
+            ttfts = sorted(
+                row["time_to_first_token"]
+                for row in rows
+                if row["time_to_first_token"] is not None
+            )
+            stats[name] = {
+                "count": len(rows),
+                "p50": _percentile(durations, 50),
+                "p95": _percentile(durations, 95),
+                "ttft_p50": _percentile(ttfts, 50),
+                "ttft_p95": _percentile(ttfts, 95),
+                "avg_prompt_tokens": sum(row["prompt_tokens"] or 0 for row in rows)
+                / len(rows),
+                "avg_completion_tokens": sum(
+                    row["completion_tokens"] or 0 for row in rows
+                )
+                / len(rows),
+            }
+        return stats
+
+    def get_routing_examples(self) -> List[Tuple[str, str, bool]]:
+        """
+        Routed user messages for training the local router.
+
+        Returns (message, message type, previous turn asked follow-up
+        questions) for every user message answered with an LLM-routed
+        assistant message.
+        """
+        cursor = self._cursor()
+        cursor.execute(
+            """
+        SELECT m.conversation_id, m.role, m.content, m.context,
+               mc.message_id AS context_id, mc.route, usv.strategy
+        FROM messages m
+        LEFT JOIN message_contexts mc ON mc.message_id = m.id
+        LEFT JOIN user_strategy_versions usv ON usv.id = mc.user_strategy_id
+        WHERE m.role IN ('user', 'assistant')
+        ORDER BY m.conversation_id, m.created_at ASC
+        """
+        )
+
+        examples = []
+        last_context: Dict[int, Dict[str, Any]] = {}
+        pending: Dict[int, Tuple[str, bool]] = {}
+        for row in cursor.fetchall():
+            conversation_id = row["conversation_id"]
+            if row["role"] == "user":
+                previous = last_context.get(conversation_id) or {}
+                followups = (previous.get("user_strategy") or {}).get(
+                    "followup_questions"
+                )
+                pending[conversation_id] = (row["content"], bool(followups))
+                continue
+
+            if row["context_id"] is not None:
+                context = {
+                    "route": json.loads(row["route"]) if row["route"] else None,
+                    "user_strategy": (
+                        json.loads(decode_json(row["strategy"]))
+                        if row["strategy"]
+                        else None
+                    ),
+                }
+            elif row["context"]:
+                # Stored before contexts were normalized
+                context = json.loads(decode_json(row["context"]))
+            else:
+                continue
+            last_context[conversation_id] = context
+            route = context.get("route") or {}
+            question = pending.pop(conversation_id, None)
+            if (
+                question
+                and route.get("message_type")
+                and route.get("confidence") is None
+            ):
+                examples.append((question[0], route["message_type"], question[1]))
+
+        return examples
+
+    def _conversation_user_id(self, conversation_id: int) -> Optional[str]:
+        cursor = self._cursor()
+        cursor.execute(
+            "SELECT user_id FROM conversations WHERE id = ?", (conversation_id,)
+        )
+        row = cursor.fetchone()
+        return row["user_id"] if row is not None else None
+
+    def _invalidate_summaries(self, conversation_id: int) -> None:
+        """Drop the cached summary pages of the conversation's user."""
+        user_id = self._conversation_user_id(conversation_id)
+        if user_id is not None:
+            self._invalidate_user_summaries(user_id)
+
+    def _invalidate_user_summaries(self, user_id: Optional[str]) -> None:
+        if self.summary_cache is not None:
+            self.summary_cache.invalidate(self.cache_key, user_id)
+
+
+def _search_terms(query: str) -> List[str]:
+    """The words of a search query, lowercased, operators and quotes left out."""
+    return re.findall(r"\w+", query.lower())
+
+
+def _parse_context(raw_context: Union[str, bytes]) -> ContextDict:
+    return ContextDict.model_validate_json(decode_json(raw_context))
+
+
+def _percentile(values: List[float], percentile: float) -> Optional[float]:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * percentile // 100))
+    return values[int(rank) - 1]
@@ -0,0 +1,142 @@
+"""
+Compressed storage of large JSON columns.
+
+Encoded values are BLOBs: one tag byte naming the codec, then the payload.
+Values written before encoding are TEXT and decode as they are, so columns
+can hold both while they're migrated.
+"""
+
+import sqlite3
+import zlib
+from typing import Dict, Optional, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Values shorter than this are stored uncompressed, behind the raw tag
+MIN_COMPRESS_SIZE = 256
+
+
+class Codec:
+    """Compression of an encoded value's payload, identified by its tag."""
+
+    tag: int
+    name: str
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class RawCodec(Codec):
+    tag = 0
+    name = "raw"
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+
+class ZlibCodec(Codec):
+    tag = 1
+    name = "zlib"
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class ZstdCodec(Codec):
+    tag = 2
+    name = "zstd"
+
+    def __init__(self, level: int = 3):
+        if zstandard is None:
+            raise ImportError("zstandard is required to read or write zstd values")
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self.decompressor.decompress(data)
+
+
+_codecs: Dict[int, Codec] = {RawCodec.tag: RawCodec(), ZlibCodec.tag: ZlibCodec()}
+if zstandard is not None:
+    _codecs[ZstdCodec.tag] = ZstdCodec()
+
+
+def register_codec(codec: Codec) -> None:
+    """Make a codec available for encoding and decoding by its tag."""
+    _codecs[codec.tag] = codec
+
+
+def default_codec() -> Codec:
+    """zstd when installed, zlib otherwise."""
+    return _codecs.get(ZstdCodec.tag) or _codecs[ZlibCodec.tag]
+
+
+def encode_json(text: Optional[str], codec: Optional[Codec] = None) -> Optional[bytes]:
+    """Encode a JSON string for storage."""
+    if text is None:
+        return None
+    data = text.encode("utf-8")
+    if len(data) < MIN_COMPRESS_SIZE:
+        codec = _codecs[RawCodec.tag]
+    else:
+        codec = codec or default_codec()
+    return bytes([codec.tag]) + codec.compress(data)
+
+
+def decode_json(value: Union[str, bytes, None]) -> Optional[str]:
+    """The JSON string of a stored value, encoded or not."""
+    if value is None or isinstance(value, str):
+        return value
+    tag = value[0]
+    if tag not in _codecs:
+        if tag == ZstdCodec.tag:
+            raise ImportError("zstandard is required to read zstd values")
+        raise ValueError(f"Unknown codec tag {tag}")
+    return _codecs[tag].decompress(value[1:]).decode("utf-8")
+
+
+def encode_json_column(
+    cursor: sqlite3.Cursor, table: str, column: str, batch_size: int = 500
+) -> int:
+    """
+    Migration step encoding the TEXT values of a column in place, in rowid
+    batches. Returns the number of rows rewritten.
+    """
+    rewritten = 0
+    last_rowid = -1
+    while True:
+        cursor.execute(
+            f"""
+        SELECT rowid, {column} FROM {table}
+        WHERE rowid > ? AND typeof({column}) = 'text'
+        ORDER BY rowid LIMIT ?
+        """,
+            (last_rowid, batch_size),
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return rewritten
+        cursor.executemany(
+            f"UPDATE {table} SET {column} = ? WHERE rowid = ?",
+            [(encode_json(row[1]), row[0]) for row in rows],
+        )
+        rewritten += len(rows)
+        last_rowid = rows[-1][0]
@@ -1,18 +1,35 @@
 from common import MessageType, StrategyType, TradingStrategyDefinition
+from common.connection import connection_manager, run_migrations
 import sqlite3
 import json
-from typing import List, Optional, Dict, Any, Union, TypedDict, cast
+from typing import Any, Callable, Dict, Iterable, List, Optional, TypedDict, Union, cast
 from datetime import datetime, timezone
 
+from .codec import decode_json, encode_json, encode_json_column
+
 
 class Database:
     def __init__(self, db_path: str = "data/messages.db"):
-        self.conn = sqlite3.connect(db_path)
-        self._create_tables()
+        self.manager = connection_manager(
+            db_path,
+            pragmas={"journal_mode": "WAL", "synchronous": "NORMAL"},
+            setup=Database._setup,
+        )
 
-    def _create_tables(self):
-        with self.conn:
-            self.conn.execute(
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The calling thread's connection."""
+        return self.manager.connection()
+
+    @staticmethod
+    def _setup(conn: sqlite3.Connection):
+        Database._create_tables(conn)
+        run_migrations(conn, MIGRATIONS)
+
+    @staticmethod
+    def _create_tables(conn: sqlite3.Connection):
+        with conn:
+            conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS discord_md_raw (
                     id TEXT PRIMARY KEY,
@@ -33,7 +50,7 @@ class Database:
                 )
             """
             )
-            self.conn.execute(
+            conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS discord_strategies (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -47,59 +64,58 @@ class Database:
                 )
             """
             )
-            self.conn.execute(
+            conn.execute(
                 """
                 CREATE INDEX IF NOT EXISTS idx_timestamp ON discord_md_raw (timestamp)
             """
             )
-            self.conn.execute(
+            conn.execute(
                 """
                 CREATE INDEX IF NOT EXISTS idx_channel ON discord_md_raw (channel_id)
             """
             )
-            self.conn.execute(
+            conn.execute(
                 """
                 CREATE INDEX IF NOT EXISTS idx_flags ON discord_md_raw (flags)
             """
             )
-            self.conn.execute(
+            conn.execute(
                 """
                 CREATE INDEX IF NOT EXISTS idx_thread_message ON discord_md_raw (thread_message)
             """
             )
-            self.conn.execute(
+            conn.execute(
                 """
                 CREATE INDEX IF NOT EXISTS idx_has_thread ON discord_md_raw (has_thread)
             """
             )
 
     def insert_message(self, message: MessageType):
-        with self.conn:
-            self.conn.execute(
+        self.insert_messages([message])
+
+    def insert_messages(self, messages: Iterable[MessageType]) -> int:
+        """
+        Insert a page of messages in one transaction, skipping the ones
+        already stored. Returns the number of new rows.
+        """
+        # Serialized before taking the write lock
+        rows = [_message_row(message) for message in messages]
+        if not rows:
+            return 0
+        with self.manager.write() as conn:
+            cursor = conn.executemany(
                 """
-                INSERT OR IGNORE INTO discord_md_raw (
+                INSERT INTO discord_md_raw (
                     id, channel_id, timestamp, content,
                     author_id, author_username, author_global_name,
                     attachments_json, reactions_json, raw_json,
                     flags, message_reference_json, thread_json
                 ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO NOTHING
             """,
-                (
-                    message["id"],
-                    message["channel_id"],
-                    message["timestamp"],
-                    message["content"],
-                    message["author"]["id"],
-                    message["author"]["username"],
-                    message["author"].get("global_name"),
-                    json.dumps(message.get("attachments", [])),
-                    json.dumps(message.get("reactions", [])),
-                    json.dumps(message),
-                    message.get("flags", 0),
-                    json.dumps(message.get("message_reference")),
-                    json.dumps(message.get("thread")),
-                ),
+                rows,
             )
+            return cursor.rowcount
 
     def message_count(self):
         with self.conn:
@@ -130,7 +146,7 @@ class Database:
             messages: List[MessageType] = []
             for row in cursor.fetchall():
                 # Convert the JSON string back to a MessageType dict
-                message_dict = json.loads(row[0])
+                message_dict = json.loads(decode_json(row[0]))
                 messages.append(message_dict)
 
             return messages
@@ -141,8 +157,8 @@ class Database:
         Returns the ID of the newly inserted strategy.
         """
         current_time = datetime.now(timezone.utc).isoformat()
-        with self.conn:
-            cursor = self.conn.execute(
+        with self.manager.write() as conn:
+            cursor = conn.execute(
                 """
                 INSERT INTO discord_strategies (
                     message_id, timestamp, flags, reactions, content, strategy_json, created_at
@@ -154,7 +170,7 @@ class Database:
                     strategy["flags"],
                     strategy["reactions"],
                     strategy["content"],
-                    strategy["strategy"].model_dump_json(),
+                    encode_json(strategy["strategy"].model_dump_json()),
                     current_time,
                 ),
             )
@@ -185,7 +201,9 @@ class Database:
             "flags": row[3],
             "reactions": row[4],
             "content": row[5],
-            "strategy": TradingStrategyDefinition(**json.loads(row[6])),
+            "strategy": TradingStrategyDefinition.model_validate_json(
+                decode_json(row[6])
+            ),
         }
 
     def list_strategies(self, limit: int = 100, offset: int = 0) -> List[StrategyType]:
@@ -212,7 +230,9 @@ class Database:
                     "flags": row[3],
                     "reactions": row[4],
                     "content": row[5],
-                    "strategy": TradingStrategyDefinition(**json.loads(row[6])),
+                    "strategy": TradingStrategyDefinition.model_validate_json(
+                        decode_json(row[6])
+                    ),
                 }
             )
 
@@ -249,7 +269,9 @@ class Database:
                 "flags": row[3],
                 "reactions": row[4],
                 "content": row[5],
-                "strategy": TradingStrategyDefinition(**json.loads(row[6])),
+                "strategy": TradingStrategyDefinition.model_validate_json(
+                    decode_json(row[6])
+                ),
             }
             for row in cursor
         ]
@@ -298,7 +320,9 @@ class Database:
             "flags": row[3],
             "reactions": row[4],
             "content": row[5],
-            "strategy": TradingStrategyDefinition(**json.loads(row[6])),
+            "strategy": TradingStrategyDefinition.model_validate_json(
+                decode_json(row[6])
+            ),
         }
 
     def strategy_count(self) -> int:
@@ -318,11 +342,41 @@ class Database:
         Returns:
             True if strategy was deleted, False otherwise
         """
-        with self.conn:
-            cursor = self.conn.execute(
+        with self.manager.write() as conn:
+            cursor = conn.execute(
                 "DELETE FROM discord_strategies WHERE id = ?", (strategy_id,)
             )
             return cursor.rowcount > 0
 
     def close(self):
-        self.conn.close()
+        self.manager.close()
+
+
+def _message_row(message: MessageType) -> tuple:
+    """The discord_md_raw values of a message, in column order."""
+    return (
+        message["id"],
+        message["channel_id"],
+        message["timestamp"],
+        message["content"],
+        message["author"]["id"],
+        message["author"]["username"],
+        message["author"].get("global_name"),
+        json.dumps(message.get("attachments", [])),
+        json.dumps(message.get("reactions", [])),
+        encode_json(json.dumps(message)),
+        message.get("flags", 0),
+        json.dumps(message.get("message_reference")),
+        json.dumps(message.get("thread")),
+    )
+
+
+def _encode_json_columns(cursor: sqlite3.Cursor) -> None:
+    """Version 1, store the raw messages and strategies through the codec layer."""
+    encode_json_column(cursor, "discord_md_raw", "raw_json")
+    encode_json_column(cursor, "discord_strategies", "strategy_json")
+
+
+# Migrations run after the tables are created, a database at user_version N
+# has run the first N
+MIGRATIONS: List[Callable[[sqlite3.Cursor], None]] = [_encode_json_columns]
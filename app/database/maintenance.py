@@ -0,0 +1,106 @@
+"""
+Periodic maintenance of the SQLite chat database.
+
+Conversations left untouched for ARCHIVE_AFTER_DAYS are archived, then free
+pages are returned to the file system by an incremental vacuum. The app runs
+it on a background thread once a day at MAINTENANCE_HOUR, it can also be run
+from the repository root:
+    PYTHONPATH=app python -m database.maintenance
+
+Files created before incremental auto-vacuum was enabled are only rebuilt
+from the command line, with --full-vacuum, as it blocks writes while it runs.
+"""
+
+import argparse
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from .chat_database import ChatDatabase
+from .chat_storage import ChatStorage
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = 90
+# Local hour the background thread runs at, off-peak
+MAINTENANCE_HOUR = 4
+
+
+def run_maintenance(
+    db: ChatDatabase,
+    archive_after_days: int = ARCHIVE_AFTER_DAYS,
+    full_vacuum: bool = False,
+) -> Dict[str, int]:
+    """Archive stale conversations then vacuum, returning what was done."""
+    archived = db.archive_conversations(archive_after_days)
+    freed_pages = db.vacuum(full=full_vacuum)
+    logger.info("Archived %d conversations, freed %d pages", archived, freed_pages)
+    return {"archived": archived, "freed_pages": freed_pages}
+
+
+_maintenance_thread: Optional[threading.Thread] = None
+_maintenance_lock = threading.Lock()
+
+
+def start_maintenance(db: ChatStorage, hour: int = MAINTENANCE_HOUR) -> None:
+    """
+    Run the maintenance of `db` every day at `hour` on a daemon thread,
+    started once per process. PostgreSQL storage is left to autovacuum.
+    """
+    global _maintenance_thread
+    if not isinstance(db, ChatDatabase):
+        return
+    with _maintenance_lock:
+        if _maintenance_thread is not None:
+            return
+        _maintenance_thread = threading.Thread(
+            target=_maintenance_loop,
+            args=(db.cache_key, hour),
+            name="chat-maintenance",
+            daemon=True,
+        )
+        _maintenance_thread.start()
+
+
+def _seconds_until(hour: int) -> float:
+    now = datetime.now()
+    next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+def _maintenance_loop(db_path: str, hour: int) -> None:
+    db = ChatDatabase(db_path)
+    while True:
+        time.sleep(_seconds_until(hour))
+        try:
+            run_maintenance(db)
+        except Exception:
+            logger.exception("Chat database maintenance failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive and vacuum the chat database")
+    parser.add_argument("--db-path", default="data/frontend.db")
+    parser.add_argument("--archive-after-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument(
+        "--full-vacuum",
+        action="store_true",
+        help="Rebuild files created before incremental auto-vacuum was enabled",
+    )
+    args = parser.parse_args()
+
+    db = ChatDatabase(args.db_path)
+    result = run_maintenance(db, args.archive_after_days, args.full_vacuum)
+    db.close()
+    print(
+        f"Archived {result['archived']} conversations, "
+        f"freed {result['freed_pages']} pages"
+    )
+
+
+if __name__ == "__main__":
+    main()
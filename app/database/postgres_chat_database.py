@@ -0,0 +1,518 @@
+"""
+Chat storage in PostgreSQL, shared by every instance of a deployment.
+
+Requires `psycopg` and `psycopg_pool`, only imported when a
+PostgresChatDatabase is created.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+try:
+    import psycopg
+    from psycopg.rows import dict_row
+    from psycopg_pool import ConnectionPool
+except ImportError:
+    psycopg = None
+
+from common import TradingStrategyDefinition
+
+from .chat_storage import ChatStorage, Cursor, _search_terms
+from .codec import decode_json, encode_json
+from .database import Database
+
+# pg_advisory_xact_lock key held while migrating, one instance migrates
+MIGRATION_LOCK_ID = 0x63686174
+
+
+class PostgresCursor:
+    """
+    sqlite3-style cursor over psycopg, so ChatStorage's queries run
+    unchanged: `?` placeholders, rows as dicts.
+
+    Inside a write transaction it wraps the transaction's cursor. Otherwise
+    each statement borrows a pooled connection, runs in autocommit and
+    buffers its rows, so no connection is held between statements.
+    """
+
+    def __init__(
+        self,
+        pool: Optional["ConnectionPool"] = None,
+        cursor: Optional["psycopg.Cursor"] = None,
+    ):
+        self.pool = pool
+        self.cursor = cursor
+        self.rows: Iterator[Dict[str, Any]] = iter(())
+
+    def execute(self, query: str, params: Sequence[Any] = ()) -> "PostgresCursor":
+        query = _placeholders(query)
+        if self.cursor is not None:
+            self.cursor.execute(query, params)
+            return self
+        with self.pool.connection() as connection:
+            cursor = connection.execute(query, params)
+            self.rows = iter(cursor.fetchall() if cursor.description else [])
+        return self
+
+    def executemany(
+        self, query: str, params_seq: Sequence[Sequence[Any]]
+    ) -> "PostgresCursor":
+        query = _placeholders(query)
+        if self.cursor is not None:
+            self.cursor.executemany(query, params_seq)
+            return self
+        with self.pool.connection() as connection:
+            connection.cursor().executemany(query, params_seq)
+        return self
+
+    def fetchone(self) -> Optional[Dict[str, Any]]:
+        if self.cursor is not None:
+            return self.cursor.fetchone()
+        return next(self.rows, None)
+
+    def fetchall(self) -> List[Dict[str, Any]]:
+        if self.cursor is not None:
+            return self.cursor.fetchall()
+        return list(self.rows)
+
+
+def _placeholders(query: str) -> str:
+    """The query with psycopg's `%s` placeholders instead of `?`."""
+    return query.replace("%", "%%").replace("?", "%s")
+
+
+class PostgresPool:
+    """
+    Process-wide connection pool to one database, with the writer thread of
+    its write-behind queue.
+
+    Connections run in autocommit, write transactions are explicit. Every
+    statement is prepared on its first execution on a connection
+    (`prepare_threshold=0`), ChatStorage runs the same few queries all the
+    time.
+    """
+
+    def __init__(self, url: str, min_size: int = 1, max_size: int = 10):
+        if psycopg is None:
+            raise ImportError(
+                "psycopg and psycopg_pool are required to store chats in PostgreSQL"
+            )
+        self.pool = ConnectionPool(
+            url,
+            min_size=min_size,
+            max_size=max_size,
+            kwargs={
+                "autocommit": True,
+                "row_factory": dict_row,
+                "prepare_threshold": 0,
+            },
+            open=True,
+        )
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pg-writer")
+        _migrate(self.pool)
+
+    @contextmanager
+    def write(self) -> Iterator[PostgresCursor]:
+        """Write transaction on a pooled connection, committed on exit."""
+        with self.pool.connection() as connection:
+            with connection.transaction():
+                yield PostgresCursor(cursor=connection.cursor())
+
+    def write_behind(self, work: Callable[[Cursor], Any]) -> Future:
+        """Run `work` in a write transaction on the writer thread."""
+
+        def run() -> Any:
+            with self.write() as cursor:
+                return work(cursor)
+
+        return self.writer.submit(run)
+
+    def flush(self) -> None:
+        """Wait until the work queued by `write_behind()` is committed."""
+        # The writer runs its queue in order
+        self.writer.submit(lambda: None).result()
+
+
+_pools: Dict[str, PostgresPool] = {}
+_pools_lock = threading.Lock()
+
+
+def postgres_pool(url: str) -> PostgresPool:
+    """The process-wide pool of a database URL, created on first use."""
+    with _pools_lock:
+        pool = _pools.get(url)
+        if pool is None:
+            pool = PostgresPool(url)
+            _pools[url] = pool
+    return pool
+
+
+class PostgresChatDatabase(ChatStorage):
+    """
+    Chat storage in PostgreSQL, for deployments running several app
+    instances.
+
+    Conversation summary pages aren't cached: another instance may write
+    them at any time.
+    """
+
+    def __init__(self, url: str, strategy_db_path: str = "data/messages.db"):
+        """
+        Use the process-wide pool of connections to `url`, migrating the
+        database on first use.
+
+        RAG strategies of a context are copied into the database with it, so
+        every instance reads them from there. Those of contexts stored before
+        version 4 are read once from the SQLite database at
+        `strategy_db_path`, when this instance has it, and copied in.
+        """
+        self.url = url
+        self.strategy_db_path = strategy_db_path
+        self.pool = postgres_pool(url)
+
+    def _cursor(self) -> Cursor:
+        return PostgresCursor(pool=self.pool.pool)
+
+    def _write(self) -> Iterator[Cursor]:
+        return self.pool.write()
+
+    def _write_behind(self, work: Callable[[Cursor], Any]) -> Future:
+        return self.pool.write_behind(work)
+
+    def _flush(self) -> None:
+        self.pool.flush()
+
+    def search_messages(
+        self, user_id: str, query: str, offset: int = 0, limit: int = 20
+    ) -> List[Dict[str, Any]]:
+        terms = _search_terms(query)
+        if not terms:
+            return []
+        self._flush()
+        # Prefix match on the last term, like the SQLite FTS5 query
+        ts_query = " & ".join(terms) + ":*"
+        # Each table is searched on its own GIN index, matches of the
+        # message and of its strategy name add up
+        cursor = self._cursor()
+        cursor.execute(
+            """
+        WITH matches AS (
+            SELECT m.id AS message_id,
+                   ts_rank(
+                       to_tsvector('english', m.content),
+                       to_tsquery('english', ?)
+                   ) AS rank
+            FROM messages m
+            JOIN conversations c ON c.id = m.conversation_id
+            WHERE to_tsvector('english', m.content) @@ to_tsquery('english', ?)
+              AND c.user_id = ?
+            UNION ALL
+            SELECT mc.message_id,
+                   4 * ts_rank(
+                       to_tsvector('english', coalesce(usv.name, '')),
+                       to_tsquery('english', ?)
+                   ) AS rank
+            FROM user_strategy_versions usv
+            JOIN conversations c ON c.id = usv.conversation_id
+            JOIN message_contexts mc ON mc.user_strategy_id = usv.id
+            WHERE to_tsvector('english', coalesce(usv.name, ''))
+                  @@ to_tsquery('english', ?)
+              AND c.user_id = ?
+        ),
+        ranked AS (
+            SELECT message_id, sum(rank) AS rank FROM matches GROUP BY message_id
+        )
+        SELECT m.id AS message_id, m.conversation_id, c.name AS conversation_name,
+               m.role, m.created_at, usv.name AS strategy_name,
+               ts_headline(
+                   'english', m.content, to_tsquery('english', ?),
+                   'StartSel=**, StopSel=**, MaxWords=12, MinWords=6'
+               ) AS snippet
+        FROM ranked r
+        JOIN messages m ON m.id = r.message_id
+        JOIN conversations c ON c.id = m.conversation_id
+        LEFT JOIN message_contexts mc ON mc.message_id = m.id
+        LEFT JOIN user_strategy_versions usv ON usv.id = mc.user_strategy_id
+        ORDER BY r.rank DESC, m.id DESC
+        LIMIT ? OFFSET ?
+        """,
+            (
+                ts_query,
+                ts_query,
+                user_id,
+                ts_query,
+                ts_query,
+                user_id,
+                ts_query,
+                limit,
+                offset,
+            ),
+        )
+        return cursor.fetchall()
+
+    def _store_rag_strategies(
+        self, cursor: Cursor, strategies: List[TradingStrategyDefinition]
+    ) -> None:
+        cursor.executemany(
+            """
+        INSERT INTO rag_strategies (id, strategy) VALUES (?, ?)
+        ON CONFLICT DO NOTHING
+        """,
+            [
+                (strategy.id, encode_json(strategy.model_dump_json()))
+                for strategy in strategies
+                if strategy.id is not None
+            ],
+        )
+
+    def _load_rag_strategies(
+        self, ids: List[int]
+    ) -> Dict[int, TradingStrategyDefinition]:
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        cursor = self._cursor()
+        cursor.execute(
+            f"SELECT id, strategy FROM rag_strategies WHERE id IN ({placeholders})",
+            ids,
+        )
+        strategies = {}
+        for row in cursor.fetchall():
+            strategy = TradingStrategyDefinition.model_validate_json(
+                decode_json(row["strategy"])
+            )
+            strategy.id = row["id"]
+            strategies[row["id"]] = strategy
+
+        # Referenced by contexts stored before version 4
+        missing = [id for id in ids if id not in strategies]
+        if missing and os.path.exists(self.strategy_db_path):
+            legacy = []
+            for row in Database(self.strategy_db_path).list_strategies_by_ids(missing):
+                row["strategy"].id = row["id"]
+                strategies[row["id"]] = row["strategy"]
+                legacy.append(row["strategy"])
+            if legacy:
+                self._write_behind(
+                    partial(self._store_rag_strategies, strategies=legacy)
+                )
+        return strategies
+
+    def close(self) -> None:
+        """Nothing to do, pooled connections are returned after each use."""
+
+
+def _create_schema(cursor: PostgresCursor) -> None:
+    """
+    Version 1, the tables of the SQLite database at its version 4.
+
+    Timestamps are ISO strings like in SQLite, and the columns written
+    through the codec layer are BYTEA.
+    """
+    cursor.execute(
+        """
+    CREATE TABLE users (
+        id TEXT PRIMARY KEY,
+        email TEXT UNIQUE,
+        name TEXT,
+        login_type TEXT DEFAULT 'anonymous',
+        auth_provider TEXT,
+        created_at TEXT,
+        last_login TEXT
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TABLE conversations (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id TEXT REFERENCES users (id),
+        name TEXT NOT NULL,
+        context BYTEA,
+        created_at TEXT,
+        updated_at TEXT
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TABLE messages (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        conversation_id BIGINT NOT NULL
+            REFERENCES conversations (id) ON DELETE CASCADE,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        context BYTEA,
+        created_at TEXT,
+        rendered BYTEA,
+        status TEXT NOT NULL DEFAULT 'complete'
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TABLE message_traces (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        message_id BIGINT NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+        kind TEXT NOT NULL,
+        name TEXT NOT NULL,
+        model TEXT,
+        start_offset DOUBLE PRECISION NOT NULL,
+        duration DOUBLE PRECISION NOT NULL,
+        time_to_first_token DOUBLE PRECISION,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        cached BOOLEAN NOT NULL DEFAULT FALSE,
+        created_at TEXT
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TABLE qa_turns (
+        conversation_id BIGINT NOT NULL
+            REFERENCES conversations (id) ON DELETE CASCADE,
+        turn_index INTEGER NOT NULL,
+        question TEXT NOT NULL,
+        answer TEXT,
+        PRIMARY KEY (conversation_id, turn_index)
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TABLE user_strategy_versions (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        conversation_id BIGINT NOT NULL
+            REFERENCES conversations (id) ON DELETE CASCADE,
+        strategy BYTEA NOT NULL,
+        created_at TEXT
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TABLE message_contexts (
+        message_id BIGINT PRIMARY KEY REFERENCES messages (id) ON DELETE CASCADE,
+        conversation_id BIGINT NOT NULL
+            REFERENCES conversations (id) ON DELETE CASCADE,
+        user_strategy_id BIGINT
+            REFERENCES user_strategy_versions (id) ON DELETE CASCADE,
+        rag_strategy_ids TEXT NOT NULL DEFAULT '[]',
+        qa_start INTEGER NOT NULL,
+        qa_end INTEGER NOT NULL,
+        route TEXT,
+        evaluation TEXT,
+        summary TEXT
+    )
+    """
+    )
+    for index in (
+        "idx_messages_conversation_id ON messages (conversation_id, id)",
+        "idx_conversations_user_updated"
+        " ON conversations (user_id, updated_at DESC, id DESC)",
+        "idx_message_traces_message_id ON message_traces (message_id)",
+        "idx_message_traces_kind_name ON message_traces (kind, name)",
+        "idx_user_strategy_versions_conversation"
+        " ON user_strategy_versions (conversation_id, id)",
+        "idx_message_contexts_conversation"
+        " ON message_contexts (conversation_id, message_id)",
+    ):
+        cursor.execute(f"CREATE INDEX {index}")
+
+
+def _add_message_search(cursor: PostgresCursor) -> None:
+    """
+    Version 2, full-text indexes of the messages' content and of the user
+    strategy names, kept as plain text on `user_strategy_versions`.
+    """
+    cursor.execute("ALTER TABLE user_strategy_versions ADD COLUMN name TEXT")
+    versions = cursor.execute(
+        "SELECT id, strategy FROM user_strategy_versions"
+    ).fetchall()
+    cursor.executemany(
+        "UPDATE user_strategy_versions SET name = ? WHERE id = ?",
+        [
+            (json.loads(decode_json(row["strategy"])).get("strategy_name"), row["id"])
+            for row in versions
+        ],
+    )
+    cursor.execute(
+        """
+    CREATE INDEX idx_messages_search
+    ON messages USING GIN (to_tsvector('english', content))
+    """
+    )
+    cursor.execute(
+        """
+    CREATE INDEX idx_user_strategy_versions_search
+    ON user_strategy_versions USING GIN (to_tsvector('english', coalesce(name, '')))
+    """
+    )
+
+
+def _add_conversation_memory(cursor: PostgresCursor) -> None:
+    """Version 3, the running summary of a conversation's older QA turns."""
+    cursor.execute(
+        """
+    CREATE TABLE conversation_memory (
+        conversation_id BIGINT PRIMARY KEY
+            REFERENCES conversations (id) ON DELETE CASCADE,
+        summary TEXT NOT NULL,
+        qa_offset INTEGER NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    """
+    )
+
+
+def _add_rag_strategies(cursor: PostgresCursor) -> None:
+    """
+    Version 4, the `discord_strategies` rows retrieved for the contexts, so
+    instances don't need the SQLite database they were retrieved from.
+    """
+    cursor.execute(
+        """
+    CREATE TABLE rag_strategies (
+        id BIGINT PRIMARY KEY,
+        strategy BYTEA NOT NULL
+    )
+    """
+    )
+
+
+# Schema migrations in order, a database at schema_version N has run the
+# first N
+MIGRATIONS: List[Callable[[PostgresCursor], None]] = [
+    _create_schema,
+    _add_message_search,
+    _add_conversation_memory,
+    _add_rag_strategies,
+]
+
+
+def _migrate(pool: "ConnectionPool") -> None:
+    """Apply the migrations the database hasn't run yet, in one transaction."""
+    with pool.connection() as connection:
+        with connection.transaction():
+            cursor = PostgresCursor(cursor=connection.cursor())
+            # Instances starting together wait for the first one to migrate
+            cursor.execute("SELECT pg_advisory_xact_lock(?)", (MIGRATION_LOCK_ID,))
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"
+            )
+            row = cursor.execute("SELECT version FROM schema_version").fetchone()
+            current = row["version"] if row is not None else 0
+            if current >= len(MIGRATIONS):
+                return
+            for migration in MIGRATIONS[current:]:
+                migration(cursor)
+            cursor.execute("DELETE FROM schema_version")
+            cursor.execute(
+                "INSERT INTO schema_version (version) VALUES (?)", (len(MIGRATIONS),)
+            )
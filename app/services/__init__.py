@@ -1,5 +1,16 @@
 from .ai_service import AIService, StreamHandler
 from .chat import ChatService
 from .conversation import ConversationService
+from .jobs import GenerationJob, JobRegistry, shared_job_registry
+from .router import LocalRouter
 
-__all__ = ["AIService", "ChatService", "ConversationService", "StreamHandler"]
+__all__ = [
+    "AIService",
+    "ChatService",
+    "ConversationService",
+    "GenerationJob",
+    "JobRegistry",
+    "LocalRouter",
+    "StreamHandler",
+    "shared_job_registry",
+]
@@ -1,7 +1,21 @@
+import asyncio
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
 from functools import partial
 from operator import itemgetter
 import os
-from typing import Callable, List, Dict, Any, Literal, Optional, TypeGuard, cast
+from typing import (
+    Callable,
+    List,
+    Dict,
+    Any,
+    Literal,
+    Optional,
+    Tuple,
+    TypeGuard,
+    cast,
+)
 import streamlit as st
 from pydantic import BaseModel, Field, SecretStr
 
@@ -9,9 +23,15 @@ from langchain.output_parsers import PydanticOutputParser
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.callbacks.base import BaseCallbackHandler
+from langchain_core.callbacks.base import BaseCallbackHandler, BaseCallbackManager
 from langchain_core.prompts import ChatPromptTemplate, FewShotChatMessagePromptTemplate
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda, RunnableBranch
+from langchain_core.runnables import (
+    Runnable,
+    RunnableBranch,
+    RunnableConfig,
+    RunnableLambda,
+)
+from langchain_core.runnables.config import patch_config
 from shared import (
     ChatMessage,
     ContextDict,
@@ -19,7 +39,12 @@ from shared import (
     RouteContext,
     QaContext,
     EvaluationContext,
+    TurnTrace,
 )
+from .cancellation import CancelToken, CancellationCallback, GenerationCancelled
+from .json_stream import JsonFieldStream
+from .router import LocalRouter
+from .usage import UsageCallback, UsageRecorder
 from .prompts import (
     routing,
     rag_fusion,
@@ -27,22 +52,72 @@ from .prompts import (
     general_question,
     question_with_context,
     evaluation,
+    conversation_summary,
 )
 
 # Absolute imports from the root common module
 from common import TradingStrategyDefinition
-from common.utils import reciprocal_rank_fusion, take_top_k
+from common.llm_cache import shared_llm_cache
+from common.utils import (
+    num_tokens_from_string,
+    reciprocal_rank_fusion,
+    take_top_k,
+    truncate_to_tokens,
+)
 from database import VectorDB, Database
 
+DEFAULT_MODEL = "gpt-4o-mini-2024-07-18"
+
+# Prompt context token budgets per chain, filled in priority order: user
+# strategy, top-ranked RAG strategies, then the most recent QA turns.
+CONTEXT_TOKEN_BUDGETS = {
+    "routing": 1500,
+    "rag_fusion": 1500,
+    "trading_idea": 6000,
+    "question": 4000,
+    "follow_up": 5000,
+    "general": 2000,
+    "evaluation": 4000,
+}
+
+# Chains that can run on their own model, see chain_models_from_config
+CHAINS = [
+    "routing",
+    "rag_fusion",
+    "trading_idea",
+    "question",
+    "general",
+    "evaluation",
+    "summary",
+]
+
+# Conversation memory compaction: once more than MEMORY_MAX_TURNS QA turns, or
+# MEMORY_MAX_TOKENS tokens of them, are kept verbatim, all but the last
+# MEMORY_KEEP_TURNS are folded into a summary of at most MEMORY_SUMMARY_TOKENS,
+# after the turn has been stored, see AIService.summarize_memory.
+MEMORY_MAX_TURNS = 6
+MEMORY_MAX_TOKENS = 3000
+MEMORY_KEEP_TURNS = 3
+MEMORY_SUMMARY_TOKENS = 500
+
 
 class StreamHandler:
-    """Handler for streaming responses to Streamlit."""
+    """Handler for streaming responses to Streamlit.
+
+    Tokens are buffered and on_reasoning_update is called once per flush:
+    every `flush_interval` seconds or `flush_size` buffered characters, and
+    always at the end of a step. Each render sends the whole step text, so
+    rendering per token would be quadratic in the output length.
+    """
 
     def __init__(
         self,
         on_step_update: Callable[[str, List[str]], None],
         on_reasoning_update: Callable[[str, str], None],
         on_reasoning_finish: Callable[[str, str], None],
+        on_answer_update: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        flush_interval: float = 0.1,
+        flush_size: int = 2048,
     ):
         self.text = {}
         self.reasoning = {}
@@ -54,6 +129,24 @@ class StreamHandler:
         self.on_step_update = on_step_update
         self.on_reasoning_update = on_reasoning_update
         self.on_reasoning_finish = on_reasoning_finish
+        self.on_answer_update = on_answer_update
+        self.field_stream: Optional[JsonFieldStream] = None
+        self.fields: Dict[str, Any] = {}
+        self.trace = TurnTrace()
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.chunks: List[str] = []
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+
+    def watch_fields(self, fields: List[str]) -> None:
+        """Parse the current step's output as JSON and report `fields` early.
+
+        Each watched top-level field goes to on_answer_update as soon as its
+        value is complete, while the rest of the object keeps streaming.
+        """
+        self.field_stream = JsonFieldStream(fields)
+        self.fields = {}
 
     def reasoning_update(self, text_chunk: str) -> None:
         """Update the displayed text with a new chunk."""
@@ -62,26 +155,55 @@ class StreamHandler:
             self.text[self.current_step] = ""
             self.reasoning[self.current_step] = ""
 
-        self.text[self.current_step] += text_chunk
-        self.reasoning[self.current_step] = self.text[self.current_step] + "▌"
+        self.trace.token()
+        self.chunks.append(text_chunk)
+        self.buffered += len(text_chunk)
+        if (
+            self.buffered >= self.flush_size
+            or time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+        if self.field_stream is not None:
+            completed = self.field_stream.feed(text_chunk)
+            if completed:
+                self.fields.update(completed)
+                if self.on_answer_update is not None:
+                    self.on_answer_update(self.current_step, self.fields)
+
+    def flush(self, cursor: bool = True) -> None:
+        """Append the buffered chunks to the step text and render it once."""
+        self._drain()
+        self.last_flush = time.monotonic()
+        text = self.text[self.current_step]
+        self.reasoning[self.current_step] = text + "▌" if cursor else text
         self.on_reasoning_update(self.current_step, self.reasoning[self.current_step])
 
+    def _drain(self) -> None:
+        if self.chunks:
+            self.text[self.current_step] += "".join(self.chunks)
+            self.chunks = []
+            self.buffered = 0
+
     def reasoning_finish(self) -> None:
         """Finalize the displayed text."""
         # Ensure the key exists before accessing it
         if self.current_step not in self.reasoning:
             return
 
-        self.reasoning[self.current_step] = self.text[self.current_step]
-        self.on_reasoning_update(self.current_step, self.reasoning[self.current_step])
+        self.flush(cursor=False)
 
         # Call the reasoning_finish callback for the current step
         self.on_reasoning_finish(self.current_step, self.reasoning[self.current_step])
 
     def step_update(self, step: str) -> None:
         """Update important step info"""
+        if self.chunks:
+            self.flush(cursor=False)
         self.steps.append(step)
         self.current_step = step
+        self.field_stream = None
+        self.trace.stage(step)
         # Initialize the dictionaries for the new step
         self.text[self.current_step] = ""
         self.reasoning[self.current_step] = ""
@@ -93,47 +215,206 @@ class StreamHandler:
 
     def get_text(self) -> Dict[str, str]:
         """Get the full text."""
+        self._drain()
         return self.text
 
 
 class StreamingCallback(BaseCallbackHandler):
     """Callback handler for streaming tokens to a StreamHandler."""
 
+    # Keep token order and skip the executor hop when driven by the async chain
+    run_inline = True
+
     def __init__(self, stream_handler: StreamHandler):
         self.stream_handler = stream_handler
+        self.streamed_runs = set()
 
     def on_llm_new_token(self, token: str, **kwargs) -> None:
         """Run on new token."""
+        self.streamed_runs.add(kwargs.get("run_id"))
         self.stream_handler.reasoning_update(token)
 
     def on_llm_end(self, response, **kwargs) -> None:
         """Run when LLM ends running"""
+        run_id = kwargs.get("run_id")
+        if run_id in self.streamed_runs:
+            self.streamed_runs.discard(run_id)
+        else:
+            # Responses served from the LLM cache don't stream any tokens
+            for generations in response.generations:
+                for generation in generations:
+                    self.stream_handler.reasoning_update(generation.text)
         self.stream_handler.reasoning_finish()
 
 
-class AIService:
-    """Service for interacting with AI models using Langchain."""
+def step_update(step: str, watch_fields: Optional[List[str]] = None) -> Runnable:
+    """Passthrough that reports a step to the StreamHandler in the run config.
+
+    With `watch_fields`, the step's streamed JSON output is parsed as it
+    arrives and those fields are reported as soon as they are complete.
+    """
+
+    def update(value: Any, config: RunnableConfig) -> Any:
+        stream_handler = config.get("configurable", {}).get("stream_handler")
+        if stream_handler is not None:
+            stream_handler.step_update(step)
+            if watch_fields:
+                stream_handler.watch_fields(watch_fields)
+        return value
+
+    async def aupdate(value: Any, config: RunnableConfig) -> Any:
+        return update(value, config)
+
+    return RunnableLambda(update, afunc=aupdate)
 
-    def __init__(self):
-        """Initialize the AI service with a specific model."""
 
-        openai_api_key = None
+def assign(key: str, runnable: Runnable) -> Runnable:
+    """Like RunnablePassthrough.assign, but runs in the caller's thread.
 
+    RunnablePassthrough.assign goes through RunnableParallel, which moves the
+    work onto an executor thread. Streamlit updates and the SQLite connections
+    must stay on the script thread.
+    """
+
+    def run(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+        return {**state, key: runnable.invoke(state, config)}
+
+    async def arun(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+        return {**state, key: await runnable.ainvoke(state, config)}
+
+    return RunnableLambda(run, afunc=arun)
+
+
+def traced(name: str, runnable: Runnable) -> Runnable:
+    """Runs `runnable`, recording its wall time to the TurnTrace in the config."""
+
+    def record(config: RunnableConfig, start: float) -> None:
+        trace = config.get("configurable", {}).get("trace")
+        if trace is not None:
+            trace.span(name, start, time.perf_counter())
+
+    def run(value: Any, config: RunnableConfig) -> Any:
+        start = time.perf_counter()
+        try:
+            return runnable.invoke(value, config)
+        finally:
+            record(config, start)
+
+    async def arun(value: Any, config: RunnableConfig) -> Any:
+        start = time.perf_counter()
         try:
-            if "langchain" in st.secrets:
-                os.environ["LANGCHAIN_API_KEY"] = st.secrets["langchain"]["api_key"]
-                os.environ["LANGCHAIN_ENDPOINT"] = st.secrets["langchain"]["endpoint"]
-                os.environ["LANGCHAIN_TRACING_V2"] = str(
-                    st.secrets["langchain"].get("tracing_v2", "true")
-                ).lower()
+            return await runnable.ainvoke(value, config)
+        finally:
+            record(config, start)
+
+    return RunnableLambda(run, afunc=arun)
+
+
+def with_context(fn: Callable[[ContextDict], str]) -> Runnable:
+    """Build the next chain input, rendering `context` from the ContextDict."""
+    return RunnableLambda(lambda state: {**state, "context": fn(state["context_dict"])})
+
+
+def without_streaming(config: RunnableConfig) -> RunnableConfig:
+    """Copy of a run config that does not stream tokens or steps to the UI.
+
+    Used for work running off the script thread, Streamlit elements can only be
+    updated from the thread that runs the script.
+    """
+    callbacks = config.get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        for handler in list(callbacks.handlers):
+            if isinstance(handler, StreamingCallback):
+                callbacks.remove_handler(handler)
+    elif isinstance(callbacks, list):
+        callbacks = [h for h in callbacks if not isinstance(h, StreamingCallback)]
+
+    silent_config = patch_config(config, callbacks=callbacks)
+    silent_config["configurable"] = {
+        key: value
+        for key, value in config.get("configurable", {}).items()
+        if key != "stream_handler"
+    }
+    return silent_config
+
+
+def chain_models_from_config() -> Dict[str, str]:
+    """
+    Per-chain model map from the `[models]` table in Streamlit secrets and
+    MODEL_<CHAIN> environment variables, the latter take precedence.
+
+        [models]
+        routing = "gpt-4o-mini"
+        trading_idea = "gpt-4o"
+    """
+    models: Dict[str, str] = {}
+    try:
+        if "models" in st.secrets:
+            models.update(
+                {k: str(v) for k, v in st.secrets["models"].items() if k in CHAINS}
+            )
+    except Exception:
+        # No secrets file, environment variables only
+        pass
 
-            if "api_keys" in st.secrets:
-                openai_api_key = st.secrets["api_keys"]["openai"]
+    for chain in CHAINS:
+        chain_model = os.environ.get(f"MODEL_{chain.upper()}")
+        if chain_model:
+            models[chain] = chain_model
+    return models
 
-        except Exception as e:
-            raise ValueError("Secrets mechanism is not available")
 
+class AIService:
+    """Service for interacting with AI models using Langchain."""
+
+    def __init__(
+        self,
+        openai_api_key: Optional[str] = None,
+        model: str = DEFAULT_MODEL,
+        speculative_rag: bool = False,
+        local_router: Optional[LocalRouter] = None,
+        cache_responses: bool = True,
+        context_token_budgets: Optional[Dict[str, int]] = None,
+        compact_memory: bool = True,
+        chain_models: Optional[Dict[str, str]] = None,
+    ):
+        """Initialize the AI service and compile the response chain once.
+
+        Args:
+            openai_api_key: OpenAI key, read from Streamlit secrets when omitted
+            model: Model used by the chain that is compiled up front
+            speculative_rag: Start RAG-fusion retrieval together with routing
+                instead of after it. The result is used for `instruction` and
+                `question` routes and discarded for the others.
+            local_router: Classifier tried before the LLM routing prompt, the
+                prompt is only used when it is not confident
+            cache_responses: Serve repeated prompts from the persistent LLM
+                response cache, all chains run at temperature 0
+            context_token_budgets: Overrides for CONTEXT_TOKEN_BUDGETS
+            compact_memory: Let `summarize_memory` fold older QA turns into a
+                running summary once the conversation grows past
+                MEMORY_MAX_TURNS or MEMORY_MAX_TOKENS
+            chain_models: Model per chain name in CHAINS, on top of
+                chain_models_from_config. Chains without one use `model`.
+        """
+
+        if openai_api_key is None:
+            try:
+                if "langchain" in st.secrets:
+                    os.environ["LANGCHAIN_API_KEY"] = st.secrets["langchain"]["api_key"]
+                    os.environ["LANGCHAIN_ENDPOINT"] = st.secrets["langchain"][
+                        "endpoint"
+                    ]
+                    os.environ["LANGCHAIN_TRACING_V2"] = str(
+                        st.secrets["langchain"].get("tracing_v2", "true")
+                    ).lower()
+
+                if "api_keys" in st.secrets:
+                    openai_api_key = st.secrets["api_keys"]["openai"]
 
+            except Exception as e:
+                raise ValueError("Secrets mechanism is not available")
 
         if openai_api_key:
             self.vector_db = VectorDB(openai_api_key)
@@ -142,378 +423,616 @@ class AIService:
         else:
             raise ValueError("OPENAI_API_KEY environment variable is not set")
 
+        self.strategy_retriever = self.vector_db.strategy_retriever()
+        self.speculative_rag = speculative_rag
+        self.local_router = local_router
+        self.compact_memory = compact_memory
+        self.chain_models = {**chain_models_from_config(), **(chain_models or {})}
+        self.usage = UsageRecorder()
+        self.llm_cache = shared_llm_cache() if cache_responses else None
+        self.context_token_budgets = {
+            **CONTEXT_TOKEN_BUDGETS,
+            **(context_token_budgets or {}),
+        }
+        self.executor = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="speculative-rag"
+        )
+        self.models: Dict[str, ChatOpenAI] = {}
+        self.chains: Dict[str, Runnable] = {}
+        self.summary_chains: Dict[str, Runnable] = {}
+        self.get_chain(model)
+
     def load_strategies(self, ids: List[int]) -> List[TradingStrategyDefinition]:
-        return list(map(lambda x: x["strategy"], self.db.list_strategies_by_ids(ids)))
+        """Load strategies, keeping the fused rank order of `ids`."""
+        strategies = {}
+        for row in self.db.list_strategies_by_ids(ids):
+            row["strategy"].id = row["id"]
+            strategies[str(row["id"])] = row["strategy"]
+        return [strategies[str(id)] for id in ids if str(id) in strategies]
+
+    async def aload_strategies(self, ids: List[int]) -> List[TradingStrategyDefinition]:
+        """Async load_strategies, the SQLite read runs off the event loop."""
+        return await asyncio.to_thread(self.load_strategies, ids)
+
+    def chain_llm(self, chain: str, model: str = DEFAULT_MODEL) -> Runnable:
+        """Chat model configured for `chain`, tagged for usage recording."""
+        chain_model = self.chain_models.get(chain, model)
+        if chain_model not in self.models:
+            self.models[chain_model] = ChatOpenAI(
+                model=chain_model,
+                api_key=self.openai_api_key,
+                temperature=0.0,
+                streaming=True,
+                stream_usage=True,
+                timeout=60,
+                cache=self.llm_cache,
+            )
+        return self.models[chain_model].with_config(
+            metadata={"chain": chain, "model": chain_model}
+        )
+
+    def get_chain(self, model: str = DEFAULT_MODEL) -> Runnable:
+        """Return the compiled response chain for a model, building it on first use."""
+        if model not in self.chains:
+            self.chains[model] = self.build_chain(model)
+        return self.chains[model]
+
+    def build_chain(self, model: str = DEFAULT_MODEL) -> Runnable:
+        """
+        Build the routing/RAG/trading-idea/evaluation graph.
+
+        The graph holds no per-request data. Every stage consumes and returns a
+        state dict with `question`, `context_dict` and, where a prompt needs it,
+        `context`. The StreamHandler is read from the run config, streaming
+        callbacks are passed in through the config as well.
+        """
+        chain_llm = partial(self.chain_llm, model=model)
+        budgets = self.context_token_budgets
+
+        def answer_update(state: Dict[str, Any]):
+            context: ContextDict = state["context_dict"]
+            context.conversations.append(
+                QaContext(question=state["question"], answer=state["answer"])
+            )
+            return state
+
+        # -------------------------------
+        # 1. Routing Chain
+        # -------------------------------
+        routing_parser = PydanticOutputParser(pydantic_object=RouteContext)
+        routing_prompt = ChatPromptTemplate.from_template(routing).partial(
+            format_instructions=routing_parser.get_format_instructions()
+        )
+
+        def route_update(state: Dict[str, Any]):
+            state["context_dict"].route = state["route"]
+            return state
+
+        llm_router = (
+            step_update("Routing")
+            | routing_prompt
+            | chain_llm("routing")
+            | routing_parser
+        )
+
+        def local_route(state: Dict[str, Any], config: RunnableConfig):
+            route = None
+            if self.local_router is not None:
+                route = self.local_router.route(
+                    state["question"], state["context_dict"]
+                )
+            if route is None:
+                # Returned runnables are invoked with the same input and config
+                return llm_router
+
+            stream_handler = config.get("configurable", {}).get("stream_handler")
+            if stream_handler is not None:
+                stream_handler.step_update("Routing")
+                stream_handler.reasoning_update(
+                    f"{route.message_type} (local router, confidence {route.confidence:.2f})"
+                )
+                stream_handler.reasoning_finish()
+            return route
+
+        async def alocal_route(state: Dict[str, Any], config: RunnableConfig):
+            # The router is cheap, it runs and reports on the event loop
+            return local_route(state, config)
+
+        router_chain = assign(
+            "route", RunnableLambda(local_route, afunc=alocal_route)
+        ) | RunnableLambda(route_update)
+
+        # -------------------------------
+        # 2. General Message Chain
+        # -------------------------------
+        general_message_prompt = ChatPromptTemplate.from_template(general_question)
+        general_message_chain = assign(
+            "answer",
+            step_update("Answering Message")
+            | general_message_prompt
+            | chain_llm("general")
+            | StrOutputParser(),
+        ) | RunnableLambda(answer_update)
+
+        # -------------------------------
+        # 2. Answer with Context Chain
+        # -------------------------------
+        question_with_context_prompt = ChatPromptTemplate.from_template(
+            question_with_context
+        )
+        question_with_context_chain = assign(
+            "answer",
+            step_update("Answering Message with Context")
+            | question_with_context_prompt
+            | chain_llm("question")
+            | StrOutputParser(),
+        ) | RunnableLambda(answer_update)
+
+        # -------------------------------
+        # 3. Trading Idea Chain
+        # -------------------------------
+
+        def tradin_idea_update(state: Dict[str, Any]):
+            trading_idea: UserStrategy = state["trading_idea"]
+            context: ContextDict = state["context_dict"]
+            context.user_strategy = trading_idea
+            answer = trading_idea.direct_answer if trading_idea.direct_answer else ""
+            if (
+                trading_idea.followup_questions
+                and len(trading_idea.followup_questions) > 0
+            ):
+                answer += f"\nFollow-up questions:\n"
+                for i, q in enumerate(trading_idea.followup_questions):
+                    answer += f"{i+1}. {q}\n"
+
+            context.conversations.append(
+                QaContext(question=state["question"], answer=answer)
+            )
+            return state
+
+        trading_idea_parser = PydanticOutputParser(pydantic_object=UserStrategy)
+        trading_idea_template = ChatPromptTemplate.from_template(trading_idea).partial(
+            format_instructions=trading_idea_parser.get_format_instructions()
+        )
+
+        trading_idea_chain = assign(
+            "trading_idea",
+            step_update(
+                "Generating Trading Idea",
+                watch_fields=["direct_answer", "followup_questions"],
+            )
+            | trading_idea_template
+            | chain_llm("trading_idea")
+            | trading_idea_parser,
+        ) | RunnableLambda(tradin_idea_update)
+
+        # -------------------------------
+        # 4. Rag Fusion Strategy Chain
+        # -------------------------------
+
+        def strategies_update(state: Dict[str, Any]):
+            state["context_dict"].rag_strategies = state["rag_strategies"]
+            return state
+
+        rag_fusion_prompt = ChatPromptTemplate.from_template(rag_fusion)
+
+        rag_fusion_retrieval = (
+            rag_fusion_prompt
+            | step_update("Querying Rag")
+            | chain_llm("rag_fusion")
+            | StrOutputParser()
+            | (lambda x: x.split("\n"))
+            | traced("retrieval", self.strategy_retriever.map())
+            | traced("rrf", RunnableLambda(reciprocal_rank_fusion))
+            | partial(take_top_k, k=5)
+            | traced(
+                "strategy_load",
+                RunnableLambda(self.load_strategies, afunc=self.aload_strategies),
+            )
+        )
+
+        def rag_fusion_context(state: Dict[str, Any]) -> str:
+            context: ContextDict = state["context_dict"]
+            return context.strategy_with_conversation(budgets["rag_fusion"])
+
+        def speculative_config(
+            config: RunnableConfig, cancel_token: CancelToken
+        ) -> RunnableConfig:
+            # Silent, and stopped by its own token when discarded
+            silent_config = without_streaming(config)
+            callbacks = silent_config.get("callbacks")
+            if isinstance(callbacks, BaseCallbackManager):
+                callbacks = callbacks.copy()
+                callbacks.add_handler(CancellationCallback(cancel_token))
+            else:
+                callbacks = [*(callbacks or []), CancellationCallback(cancel_token)]
+            return patch_config(silent_config, callbacks=callbacks)
+
+        def start_speculative_rag(state: Dict[str, Any], config: RunnableConfig):
+            # RAG-fusion only needs the conversation context, which is known
+            # before routing, so retrieval can start before the route is.
+            rag_input = {**state, "context": rag_fusion_context(state)}
+            cancel_token = CancelToken()
+            future = self.executor.submit(
+                copy_context().run,
+                rag_fusion_retrieval.invoke,
+                rag_input,
+                speculative_config(config, cancel_token),
+            )
+            return {**state, "rag_future": future, "rag_cancel": cancel_token}
+
+        def astart_speculative_rag(state: Dict[str, Any], config: RunnableConfig):
+            rag_input = {**state, "context": rag_fusion_context(state)}
+            cancel_token = CancelToken()
+            task = asyncio.create_task(
+                rag_fusion_retrieval.ainvoke(
+                    rag_input, speculative_config(config, cancel_token)
+                )
+            )
+            return {**state, "rag_future": task, "rag_cancel": cancel_token}
+
+        def report_speculative_rag(
+            config: RunnableConfig, strategies: Optional[List] = None
+        ):
+            stream_handler = config.get("configurable", {}).get("stream_handler")
+            if stream_handler is None:
+                return
+            if strategies is None:
+                stream_handler.step_update("Querying Rag")
+            else:
+                stream_handler.reasoning_update(
+                    f"{len(strategies)} strategies retrieved while routing"
+                )
+                stream_handler.reasoning_finish()
+
+        def await_speculative_rag(state: Dict[str, Any], config: RunnableConfig):
+            report_speculative_rag(config)
+            strategies = state["rag_future"].result()
+            report_speculative_rag(config, strategies)
+            return strategies
+
+        async def aawait_speculative_rag(state: Dict[str, Any], config: RunnableConfig):
+            report_speculative_rag(config)
+            strategies = await state["rag_future"]
+            report_speculative_rag(config, strategies)
+            return strategies
+
+        def discard_speculative_rag(state: Dict[str, Any]) -> None:
+            # A running thread can't be cancelled, the token stops its LLM
+            # calls at the next token or stage
+            state["rag_cancel"].cancel()
+            future: Future = state["rag_future"]
+            future.cancel()
+
+        async def adiscard_speculative_rag(state: Dict[str, Any]) -> None:
+            state["rag_cancel"].cancel()
+            task: asyncio.Task = state["rag_future"]
+            task.cancel()
+            # Retrieves its result or error, nothing is left pending
+            await asyncio.gather(task, return_exceptions=True)
+
+        def with_speculative_rag(runnable: Runnable) -> Runnable:
+            """
+            Runs `runnable` with RAG-fusion retrieval started alongside it,
+            discarded once it returns or raises unless a branch awaited it.
+            """
+
+            def run(state: Dict[str, Any], config: RunnableConfig) -> Any:
+                state = start_speculative_rag(state, config)
+                try:
+                    return runnable.invoke(state, config)
+                finally:
+                    discard_speculative_rag(state)
+
+            async def arun(state: Dict[str, Any], config: RunnableConfig) -> Any:
+                state = astart_speculative_rag(state, config)
+                try:
+                    return await runnable.ainvoke(state, config)
+                finally:
+                    await adiscard_speculative_rag(state)
+
+            return RunnableLambda(run, afunc=arun)
+
+        rag_fusion_chain = assign(
+            "rag_strategies",
+            (
+                RunnableLambda(await_speculative_rag, afunc=aawait_speculative_rag)
+                if self.speculative_rag
+                else rag_fusion_retrieval
+            ),
+        ) | RunnableLambda(strategies_update)
+
+        # -------------------------------
+        # 5. Evaluation Chain
+        # -------------------------------
+
+        def evaluation_update(state: Dict[str, Any]):
+            state["context_dict"].evaluation = state["evaluation"]
+            return state
+
+        evaluation_parser = PydanticOutputParser(pydantic_object=EvaluationContext)
+        evaluation_prompt = ChatPromptTemplate.from_template(evaluation).partial(
+            format_instructions=evaluation_parser.get_format_instructions()
+        )
+        evaluation_chain = assign(
+            "evaluation",
+            step_update("Evaluating")
+            | evaluation_prompt
+            | chain_llm("evaluation")
+            | evaluation_parser,
+        ) | RunnableLambda(evaluation_update)
+
+        # -------------------------------
+        # 5. Route Chain
+        # -------------------------------
+
+        def route_type(
+            state: Dict[str, Any],
+        ) -> Literal[
+            "non-related", "instruction", "question", "evaluation", "follow-up"
+        ]:
+            obj = state.get("context_dict")
+            if not isinstance(obj, ContextDict):
+                return "non-related"
+            if obj.route is None:
+                return "non-related"
+            if obj.route.message_type is None:
+                return "non-related"
+            if obj.route.message_type == "follow-up":
+                return "follow-up"
+            return obj.route.message_type
+
+        # ------------------------------
+        # 5.1. Instruction Chain
+        # ------------------------------
+
+        instruction_branch = (
+            RunnableLambda(lambda s: {**s, "context": rag_fusion_context(s)})
+            | rag_fusion_chain
+            | with_context(lambda c: c.strategy_with_rag(budgets["trading_idea"]))
+            | trading_idea_chain
+        )
+
+        # ------------------------------
+        # 5.2. Question Chain
+        # ------------------------------
+
+        question_branch = (
+            RunnableLambda(lambda s: {**s, "context": rag_fusion_context(s)})
+            | rag_fusion_chain
+            | with_context(lambda c: c.rag_context(budgets["question"]))
+            | question_with_context_chain
+        )
+
+        # ------------------------------
+        # 5.3. Follow-up Chain
+        # ------------------------------
+
+        followup_branch = (
+            with_context(lambda c: c.strategy_with_conversation(budgets["follow_up"]))
+            | trading_idea_chain
+        )
+
+        # ------------------------------
+        # 5.4. Non Related Chain and Default Chain
+        # ------------------------------
+
+        general_branch = (
+            with_context(lambda c: c.to_full_strategy_context(budgets["general"]))
+            | general_message_chain
+        )
+
+        # ------------------------------
+        # 5.5. Evaluation Chain
+        # ------------------------------
+
+        evaluation_branch = (
+            with_context(lambda c: c.to_full_strategy_context(budgets["evaluation"]))
+            | evaluation_chain
+        )
+
+        answer_chain = router_chain | RunnableBranch(
+            (lambda s: route_type(s) == "non-related", general_branch),
+            (lambda s: route_type(s) == "instruction", instruction_branch),
+            (lambda s: route_type(s) == "follow-up", followup_branch),
+            (lambda s: route_type(s) == "question", question_branch),
+            (lambda s: route_type(s) == "evaluation", evaluation_branch),
+            general_branch,
+        )
+        if self.speculative_rag:
+            answer_chain = with_speculative_rag(answer_chain)
+
+        return (
+            with_context(lambda c: c.router_context(budgets["routing"]))
+            | answer_chain
+            | itemgetter("context_dict")
+        )
+
+    def get_summary_chain(self, model: str = DEFAULT_MODEL) -> Runnable:
+        """Return the memory summary chain for a model, building it on first use."""
+        if model not in self.summary_chains:
+            summary_prompt = ChatPromptTemplate.from_template(
+                conversation_summary
+            ).partial(max_words=str(MEMORY_SUMMARY_TOKENS * 2 // 3))
+            self.summary_chains[model] = (
+                summary_prompt | self.chain_llm("summary", model) | StrOutputParser()
+            )
+        return self.summary_chains[model]
+
+    def needs_compaction(self, context: ContextDict) -> bool:
+        """Whether the context keeps more QA turns verbatim than the memory
+        limits allow."""
+        if not self.compact_memory or len(context.conversations) <= MEMORY_KEEP_TURNS:
+            return False
+        if len(context.conversations) > MEMORY_MAX_TURNS:
+            return True
+        tokens = sum(
+            num_tokens_from_string(qa.context_str()) for qa in context.conversations
+        )
+        return tokens > MEMORY_MAX_TOKENS
+
+    def summarize_memory(
+        self, context: ContextDict, model: str = DEFAULT_MODEL
+    ) -> Optional[Tuple[str, int]]:
+        """
+        Fold all but the last MEMORY_KEEP_TURNS QA turns of a context into its
+        running summary, once the context needs compaction.
+
+        Called after the turn has been delivered and stored, so its LLM call
+        doesn't delay the answer. Returns the summary and the index of the
+        first turn it doesn't cover, to apply with `ContextDict.fold_summary`
+        before the next turn, or None when nothing needs folding.
+        """
+        if not self.needs_compaction(context):
+            return None
+        older = context.conversations[:-MEMORY_KEEP_TURNS]
+        summary = self.get_summary_chain(model).invoke(
+            {
+                "summary": context.summary or "No summary yet.",
+                "conversation": "".join(qa.context_str() for qa in older),
+            },
+            config={"callbacks": [UsageCallback(self.usage)]},
+        )
+        summary = truncate_to_tokens(summary.strip(), MEMORY_SUMMARY_TOKENS)
+        return summary, context.qa_offset + len(older)
+
+    def run_config(
+        self, stream_handler: StreamHandler, cancel_token: Optional[CancelToken] = None
+    ) -> RunnableConfig:
+        """Per-request config: streaming, usage and cancellation callbacks, step
+        handler and trace for one turn."""
+        callbacks: List[BaseCallbackHandler] = [
+            StreamingCallback(stream_handler),
+            UsageCallback(self.usage, stream_handler.trace),
+        ]
+        if cancel_token is not None:
+            callbacks.append(CancellationCallback(cancel_token))
+        return {
+            "callbacks": callbacks,
+            "configurable": {
+                "stream_handler": stream_handler,
+                "trace": stream_handler.trace,
+            },
+        }
 
     def generate_response_stream(
         self,
         message: str,
         stream_handler: StreamHandler,
-        model: str = "gpt-4o-mini-2024-07-18",
+        model: str = DEFAULT_MODEL,
         initial_context: Optional[ContextDict] = None,
+        cancel_token: Optional[CancelToken] = None,
     ) -> str | ContextDict:
         """
         Generate a response with streaming to a Streamlit container.
 
         Args:
-            messages: List of message dictionaries with 'role' and 'content' keys
-            container: Streamlit container to stream to
-            system_prompt: Optional system prompt to prepend
+            message: User message
+            stream_handler: Handler receiving step and token updates
+            model: Model for chains without an entry in `chain_models`, the
+                chain for it is compiled once and reused
+            initial_context: Context of the conversation so far
+            cancel_token: Stops the chain when cancelled, aborting the model
+                stream and skipping the remaining stages
 
         Returns:
-            The complete generated response as a string
-        """
-        streaming_callback = StreamingCallback(stream_handler)
+            The updated ContextDict, or an error message string
 
+        Raises:
+            GenerationCancelled: When `cancel_token` was cancelled
+        """
         if initial_context is None:
             initial_context = ContextDict.empty()
         else:
             initial_context = initial_context.new_run()
 
         try:
-            llm = ChatOpenAI(
-                model=model,
-                api_key=self.openai_api_key,  # Convert string to SecretStr
-                temperature=0.0,
-                streaming=True,
-                timeout=60,
-                callbacks=[streaming_callback],
-            )
-
-            def answer_update(answer: str, context: ContextDict):
-                context.conversations.append(QaContext(question=message, answer=answer))
-                return context
-
-            # -------------------------------
-            # 1. Routing Chain
-            # -------------------------------
-            routing_prompt = ChatPromptTemplate.from_template(routing)
-            routing_parser = PydanticOutputParser(pydantic_object=RouteContext)
-
-            def route_update(route: RouteContext, context: ContextDict):
-                context.route = route
-                return context
-
-            router_chain = RunnableLambda(
-                lambda dict: (
-                    (
-                        lambda _: {
-                            "question": dict.get("question"),
-                            "context": dict.get("context"),
-                            "format_instructions": routing_parser.get_format_instructions(),
-                        }
-                    )
-                    | RunnablePassthrough(
-                        lambda x: stream_handler.step_update("Routing")
-                    )
-                    | routing_prompt
-                    | llm
-                    | routing_parser
-                    | RunnableLambda(
-                        partial(route_update, context=dict.get("context_dict"))
-                    )
-                )
-            )
-
-            # -------------------------------
-            # 2. General Message Chain
-            # -------------------------------
-            general_message_prompt = ChatPromptTemplate.from_template(general_question)
-            general_message_chain = RunnableLambda(
-                lambda dict: (
-                    (
-                        lambda _: {
-                            "question": dict.get("question"),
-                        }
-                    )
-                    | RunnablePassthrough(
-                        lambda x: stream_handler.step_update("Answering Message")
-                    )
-                    | general_message_prompt
-                    | llm
-                    | StrOutputParser()
-                    | RunnableLambda(
-                        partial(answer_update, context=dict.get("context_dict"))
-                    )
-                )
-            )
-
-            # -------------------------------
-            # 2. Answer with Context Chain
-            # -------------------------------
-            question_with_context_prompt = ChatPromptTemplate.from_template(
-                question_with_context
-            )
-            question_with_context_chain = RunnableLambda(
-                lambda dict: (
-                    (
-                        lambda _: {
-                            "question": dict.get("question"),
-                            "context": dict.get("context"),
-                        }
-                    )
-                    | RunnablePassthrough(
-                        lambda x: stream_handler.step_update(
-                            "Answering Message with Context"
-                        )
-                    )
-                    | question_with_context_prompt
-                    | llm
-                    | StrOutputParser()
-                    | RunnableLambda(
-                        partial(answer_update, context=dict.get("context_dict"))
-                    )
-                )
-            )
-
-            # -------------------------------
-            # 3. Trading Idea Chain
-            # -------------------------------
-
-            def tradin_idea_update(trading_idea: UserStrategy, context: ContextDict):
-                context.user_strategy = trading_idea
-                answer = (
-                    trading_idea.direct_answer if trading_idea.direct_answer else ""
-                )
-                if (
-                    trading_idea.followup_questions
-                    and len(trading_idea.followup_questions) > 0
-                ):
-                    answer += f"\nFollow-up questions:\n"
-                    for i, q in enumerate(trading_idea.followup_questions):
-                        answer += f"{i+1}. {q}\n"
-
-                context.conversations.append(QaContext(question=message, answer=answer))
-                return context
-
-            trading_idea_template = ChatPromptTemplate.from_template(trading_idea)
-            trading_idea_parser = PydanticOutputParser(pydantic_object=UserStrategy)
-
-            trading_idea_chain = RunnableLambda(
-                lambda dict: (
-                    (
-                        lambda _: {
-                            "context": dict.get("context"),
-                            "question": dict.get("question"),
-                            "format_instructions": trading_idea_parser.get_format_instructions(),
-                        }
-                    )
-                    | RunnablePassthrough(
-                        lambda x: stream_handler.step_update(
-                            step="Generating Trading Idea"
-                        )
-                    )
-                    | trading_idea_template
-                    | llm
-                    | trading_idea_parser
-                    | RunnableLambda(
-                        partial(tradin_idea_update, context=dict.get("context_dict"))
-                    )
-                )
-            )
-
-            # -------------------------------
-            # 4. Rag Fusion Strategy Chain
-            # -------------------------------
-
-            def strategies_update(
-                strategies: List[TradingStrategyDefinition], context: ContextDict
-            ):
-                context.rag_strategies = strategies
-                return context
-
-            rag_fusion_prompt = ChatPromptTemplate.from_template(rag_fusion)
-
-            rag_fusion_chain = RunnableLambda(
-                lambda dict: (
-                    (
-                        lambda x: {
-                            "question": dict.get("question"),
-                            "context": dict.get("context"),
-                        }
-                    )
-                    | rag_fusion_prompt
-                    | RunnablePassthrough(
-                        lambda x: stream_handler.step_update(step="Querying Rag")
-                    )
-                    | llm
-                    | StrOutputParser()
-                    | (lambda x: x.split("\n"))
-                    | self.vector_db.strategy_retriever().map()
-                    | reciprocal_rank_fusion
-                    | partial(take_top_k, k=5)
-                    | self.load_strategies
-                    | RunnableLambda(
-                        partial(strategies_update, context=dict.get("context_dict"))
-                    )
-                )
-            )
-
-            # -------------------------------
-            # 5. Evaluation Chain
-            # -------------------------------
-
-            def evaluation_update(evaluation: EvaluationContext, context: ContextDict):
-                context.evaluation = evaluation
-                return context
-
-            evaluation_prompt = ChatPromptTemplate.from_template(evaluation)
-            evaluation_parser = PydanticOutputParser(pydantic_object=EvaluationContext)
-            evaluation_chain = RunnableLambda(
-                lambda dict: (
-                    (
-                        lambda _: {
-                            "context": dict.get("context"),
-                            "format_instructions": evaluation_parser.get_format_instructions(),
-                        }
-                    )
-                    | RunnablePassthrough(
-                        lambda x: stream_handler.step_update(step="Evaluating")
-                    )
-                    | evaluation_prompt
-                    | llm
-                    | evaluation_parser
-                    | RunnableLambda(
-                        partial(evaluation_update, context=dict.get("context_dict"))
-                    )
-                )
+            result: ContextDict = self.get_chain(model).invoke(
+                {"question": message, "context_dict": initial_context},
+                config=self.run_config(stream_handler, cancel_token),
             )
+            return result
 
-            # -------------------------------
-            # 5. Route Chain
-            # -------------------------------
-
-            def route_type(
-                obj: Any,
-            ) -> Literal[
-                "non-related", "instruction", "question", "evaluation", "follow-up"
-            ]:
-                if not isinstance(obj, ContextDict):
-                    return "non-related"
-                if obj.route is None:
-                    return "non-related"
-                if obj.route.message_type is None:
-                    return "non-related"
-                if obj.route.message_type == "follow-up":
-                    return "follow-up"
-                return obj.route.message_type
-
-            def input(context: ContextDict, fn: Callable[[ContextDict], str]):
-                return {
-                    "question": message,
-                    "context": fn(context),
-                    "context_dict": context,
-                }
-
-            # ------------------------------
-            # 5.1. Instruction Chain
-            # ------------------------------
-
-            instruction_branch = (
-                RunnableLambda(
-                    partial(input, fn=lambda c: c.strategy_with_conversation())
-                )
-                | rag_fusion_chain
-                | RunnableLambda(partial(input, fn=lambda c: c.strategy_with_rag()))
-                | trading_idea_chain
-            )
+        except GenerationCancelled:
+            raise
 
-            # ------------------------------
-            # 5.2. Question Chain
-            # ------------------------------
+        except Exception as e:
+            return self.error_message(e)
 
-            question_branch = (
-                RunnableLambda(
-                    partial(input, fn=lambda c: c.strategy_with_conversation())
-                )
-                | rag_fusion_chain
-                | RunnableLambda(
-                    partial(
-                        input,
-                        fn=lambda c: c.rag_context(),
-                    )
-                )
-                | question_with_context_chain
-            )
+        finally:
+            stream_handler.trace.finish()
 
-            # ------------------------------
-            # 5.3. Follow-up Chain
-            # ------------------------------
+    async def agenerate_response_stream(
+        self,
+        message: str,
+        stream_handler: StreamHandler,
+        model: str = DEFAULT_MODEL,
+        initial_context: Optional[ContextDict] = None,
+        cancel_token: Optional[CancelToken] = None,
+    ) -> str | ContextDict:
+        """
+        Asyncio version of generate_response_stream.
 
-            followup_branch = (
-                RunnableLambda(
-                    partial(input, fn=lambda c: c.strategy_with_conversation())
-                )
-            ) | trading_idea_chain
+        The chain runs with ainvoke end to end: the RAG-fusion queries are
+        retrieved concurrently and the strategy load runs off the event loop.
+        StreamHandler callbacks are called on the event loop thread.
 
-            # ------------------------------
-            # 5.4. Non Related Chain and Default Chain
-            # ------------------------------
+        Returns:
+            The updated ContextDict, or an error message string
+        """
+        if initial_context is None:
+            initial_context = ContextDict.empty()
+        else:
+            initial_context = initial_context.new_run()
 
-            general_branch = (
-                RunnableLambda(
-                    partial(input, fn=lambda c: c.to_full_strategy_context())
-                )
-                | general_message_chain
+        try:
+            result: ContextDict = await self.get_chain(model).ainvoke(
+                {"question": message, "context_dict": initial_context},
+                config=self.run_config(stream_handler, cancel_token),
             )
+            return result
 
-            # ------------------------------
-            # 5.5. Evaluation Chain
-            # ------------------------------
-
-            evaluation_branch = (
-                RunnableLambda(
-                    partial(input, fn=lambda c: c.to_full_strategy_context())
-                )
-                | evaluation_chain
-            )
+        except GenerationCancelled:
+            raise
 
-            chain = router_chain | RunnableBranch(
-                (lambda c: route_type(c) == "non-related", general_branch),
-                (lambda c: route_type(c) == "instruction", instruction_branch),
-                (lambda c: route_type(c) == "follow-up", followup_branch),
-                (lambda c: route_type(c) == "question", question_branch),
-                (lambda x: route_type(x) == "evaluation", evaluation_branch),
-                general_branch,
-            )
+        except Exception as e:
+            return self.error_message(e)
 
-            # Execute the branch chain and get the result
-            result: ContextDict = chain.invoke(
-                input(initial_context, lambda c: c.router_context())
-            )
-            return result
+        finally:
+            stream_handler.trace.finish()
 
-        except Exception as e:
-            import traceback
-            import sys
+    def error_message(self, e: Exception) -> str:
+        """Format a chain failure with stack trace and API key status."""
+        import traceback
+        import sys
 
-            # Get the full stack trace
-            exc_type, exc_value, exc_traceback = sys.exc_info()
-            stack_trace = traceback.format_exception(exc_type, exc_value, exc_traceback)
-            stack_trace_str = "".join(stack_trace)
+        # Get the full stack trace
+        exc_type, exc_value, exc_traceback = sys.exc_info()
+        stack_trace = traceback.format_exception(exc_type, exc_value, exc_traceback)
+        stack_trace_str = "".join(stack_trace)
 
-            # Check if OpenAI API key exists and is valid
-            api_key_info = ""
-            try:
-                # Get the first few and last few characters of the API key for debugging
-                # (avoid exposing the full key for security)
-                if hasattr(self, "openai_api_key") and self.openai_api_key:
-                    api_key_value = self.openai_api_key.get_secret_value()
-                    if api_key_value:
-                        prefix = api_key_value[:4]
-                        suffix = api_key_value[-4:] if len(api_key_value) > 8 else ""
-                        masked_key = f"{prefix}...{suffix}"
-                        api_key_info += f"✅ API Key exists (starts with {prefix}, ends with {suffix})\n"
-                        api_key_info += f"Length: {len(api_key_value)} characters\n"
-                    else:
-                        api_key_info += "❌ API Key exists but is empty\n"
+        # Check if OpenAI API key exists and is valid
+        api_key_info = ""
+        try:
+            # Get the first few and last few characters of the API key for debugging
+            # (avoid exposing the full key for security)
+            if hasattr(self, "openai_api_key") and self.openai_api_key:
+                api_key_value = self.openai_api_key.get_secret_value()
+                if api_key_value:
+                    prefix = api_key_value[:4]
+                    suffix = api_key_value[-4:] if len(api_key_value) > 8 else ""
+                    masked_key = f"{prefix}...{suffix}"
+                    api_key_info += f"✅ API Key exists (starts with {prefix}, ends with {suffix})\n"
+                    api_key_info += f"Length: {len(api_key_value)} characters\n"
                 else:
-                    api_key_info += "❌ API Key is not set\n"
-            except Exception as key_error:
-                api_key_info += f"❌ Error checking API key: {str(key_error)}\n"
-
-            # Format the error message with stack trace and API key info
-            error_message = f"""
+                    api_key_info += "❌ API Key exists but is empty\n"
+            else:
+                api_key_info += "❌ API Key is not set\n"
+        except Exception as key_error:
+            api_key_info += f"❌ Error checking API key: {str(key_error)}\n"
+
+        # Format the error message with stack trace and API key info
+        error_message = f"""
 Error Details
 
 ```
@@ -529,5 +1048,5 @@ Stack Trace:
 {stack_trace_str}
 ```
 """
-            # Return the detailed error message
-            return error_message
+        # Return the detailed error message
+        return error_message
@@ -0,0 +1,65 @@
+import logging
+import threading
+from typing import Any
+
+from langchain_core.callbacks.base import BaseCallbackHandler
+
+
+class GenerationCancelled(Exception):
+    """Raised inside the response chain once its CancelToken is cancelled."""
+
+
+class _IgnoreCancellation(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        return "GenerationCancelled" not in record.getMessage()
+
+
+# The callback manager logs every exception raised by a callback handler as a
+# warning, a cancellation is not one
+logging.getLogger("langchain_core.callbacks.manager").addFilter(_IgnoreCancellation())
+
+
+class CancelToken:
+    """Thread-safe flag telling a running generation to stop."""
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self) -> None:
+        self.event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self.event.is_set():
+            raise GenerationCancelled()
+
+
+class CancellationCallback(BaseCallbackHandler):
+    """
+    Callback handler stopping the chain cooperatively.
+
+    Checked when a runnable or chat model starts, which skips the remaining
+    stages, and on every streamed token. Raising from the token callback ends
+    the iteration over the OpenAI stream, which closes the HTTP response.
+    """
+
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, token: CancelToken):
+        self.token = token
+
+    def on_chain_start(self, *args: Any, **kwargs: Any) -> None:
+        self.token.raise_if_cancelled()
+
+    def on_chat_model_start(self, *args: Any, **kwargs: Any) -> None:
+        self.token.raise_if_cancelled()
+
+    def on_retriever_start(self, *args: Any, **kwargs: Any) -> None:
+        self.token.raise_if_cancelled()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.token.raise_if_cancelled()
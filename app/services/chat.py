@@ -1,56 +1,167 @@
 from typing import Dict, Optional
-from database.chat_database import ChatDatabase
+from database import open_chat_storage
 import streamlit as st
-from shared import ChatMessage, UserStrategy, ContextDict
+from shared import ChatMessage, UserStrategy, ContextDict, TurnTrace
+
+
+# Messages loaded when a conversation is opened and per "load earlier"
+HISTORY_PAGE_SIZE = 20
 
 
 class ChatService:
     def __init__(self, conversation_id: int):
         self.conversation_id = conversation_id
-        self.db = ChatDatabase()
+        self.db = open_chat_storage()
 
     def get_messages(self):
+        """The loaded window of messages, the newest page on first use."""
         messages: list[ChatMessage] = st.session_state.get(
             "conversation_messages", {}
         ).get(self.conversation_id, [])
 
         if not messages:
-            messages = self.db.get_messages(self.conversation_id)
+            messages = self.db.get_messages(
+                self.conversation_id, limit=HISTORY_PAGE_SIZE
+            )
             if "conversation_messages" not in st.session_state:
                 st.session_state["conversation_messages"] = {}
             st.session_state["conversation_messages"][self.conversation_id] = messages
+            self.set_has_earlier(len(messages) == HISTORY_PAGE_SIZE)
 
         return messages
 
-    def add_user_message(self, content: str):
+    def has_earlier_messages(self) -> bool:
+        return st.session_state.get("conversation_has_earlier", {}).get(
+            self.conversation_id, False
+        )
+
+    def set_has_earlier(self, value: bool):
+        if "conversation_has_earlier" not in st.session_state:
+            st.session_state["conversation_has_earlier"] = {}
+        st.session_state["conversation_has_earlier"][self.conversation_id] = value
+
+    def load_earlier_messages(self):
+        """Prepend the page of messages before the oldest loaded one."""
+        messages = self.get_messages()
+        if not messages or messages[0].id is None:
+            return
+        earlier = self.db.get_messages(
+            self.conversation_id, before_id=messages[0].id, limit=HISTORY_PAGE_SIZE
+        )
+        messages[:0] = earlier
+        self.set_has_earlier(len(earlier) == HISTORY_PAGE_SIZE)
+
+    def add_user_message(self, content: str) -> ChatMessage:
+        """Show a user message, it's stored with the turn's answer by
+        `save_turn`."""
         message = ChatMessage.new_message(self.conversation_id, "user", content, None)
-        self.db.add_message(message)
         self.append_session_state(message)
         return message
 
-    def add_assistant_message(self, content: str, context: Optional[ContextDict]):
-        message = ChatMessage.new_message(
-            self.conversation_id, "assistant", content, context
-        )
-        self.db.add_message(message)
+    def add_assistant_message(
+        self,
+        content: str,
+        context: Optional[ContextDict],
+        trace: Optional[TurnTrace] = None,
+    ):
+        message = self.save_assistant_message(content, context, trace)
         self.append_session_state(message)
         if context:
             self.update_conversation_context(context)
-            self.db.update_conversation_context(self.conversation_id, context)
 
         return message
-    
-    def add_error_msg(self, error: str):
+
+    def save_turn(
+        self,
+        user_message: Optional[ChatMessage],
+        message: Optional[ChatMessage],
+        trace: Optional[TurnTrace] = None,
+        write_behind: bool = False,
+    ):
+        """
+        Store a turn in one transaction without touching the session state,
+        so it can be called from generation worker threads.
+
+        The user message is stored unless it already has been. With
+        `write_behind` the messages are written after this returns, they get
+        their IDs then.
+        """
+        unit = self.db.unit_of_work()
+        if user_message is not None and user_message.id is None:
+            unit.add_message(user_message)
+        if message is not None:
+            unit.add_message(message, trace)
+            if message.context:
+                unit.update_conversation_context(self.conversation_id, message.context)
+        unit.commit(write_behind=write_behind)
+
+    def save_assistant_message(
+        self,
+        content: str,
+        context: Optional[ContextDict],
+        trace: Optional[TurnTrace] = None,
+        user_message: Optional[ChatMessage] = None,
+        write_behind: bool = False,
+    ) -> ChatMessage:
+        """Store an assistant message, see `save_turn`."""
         message = ChatMessage.new_message(
-            self.conversation_id, "error", error, None
+            self.conversation_id, "assistant", content, context
         )
-        self.db.add_message(message)
+        self.save_turn(user_message, message, trace, write_behind)
+        return message
+
+    def add_error_msg(self, error: str):
+        message = self.save_error_msg(error)
         self.append_session_state(message)
         return message
 
+    def save_error_msg(
+        self,
+        error: str,
+        user_message: Optional[ChatMessage] = None,
+        write_behind: bool = False,
+    ) -> ChatMessage:
+        """Store an error message, see `save_turn`."""
+        message = ChatMessage.new_message(self.conversation_id, "error", error, None)
+        self.save_turn(user_message, message, write_behind=write_behind)
+        return message
+
+    def save_cancelled_message(
+        self,
+        partial: str,
+        user_message: Optional[ChatMessage] = None,
+        write_behind: bool = False,
+    ) -> ChatMessage:
+        """Store the partial output of a cancelled turn, see `save_turn`."""
+        message = ChatMessage.new_message(
+            self.conversation_id, "assistant", partial, None, status="cancelled"
+        )
+        self.save_turn(user_message, message, write_behind=write_behind)
+        return message
+
+    def save_memory(self, summary: str, qa_offset: int):
+        """Store the running summary of the QA turns before the `qa_offset`th,
+        it's applied to the context of the conversation's next turn."""
+        self.db.save_conversation_memory(self.conversation_id, summary, qa_offset)
+
+    def receive_message(self, message: ChatMessage):
+        """Add a message stored by a generation job to the loaded history.
+
+        Nothing to do when the history isn't loaded yet, it's read from the
+        database with the message in it.
+        """
+        loaded = st.session_state.get("conversation_messages", {}).get(
+            self.conversation_id
+        )
+        if loaded and all(
+            m is not message and (message.id is None or m.id != message.id)
+            for m in loaded
+        ):
+            loaded.append(message)
+
     def add_context_message(self, context: ContextDict):
         message = ChatMessage.new_message(self.conversation_id, "ai", "", context)
-        self.db.add_message(message)
+        message.id = self.db.add_message(message)
         self.append_session_state(message)
         return message
 
@@ -1,8 +1,9 @@
-from typing import Optional
-from database import ChatDatabase
+from typing import Any, Dict, List, Optional, Tuple
+from database import ChatStorage
 import streamlit as st
 from auth import FirebaseAuth
 from shared import ContextDict
+from .jobs import shared_job_registry
 from utils import (
     load_env_vars,
     generate_conversation_name,
@@ -10,9 +11,12 @@ from utils import (
     set_page_config,
 )
 
+CONVERSATION_PAGE_SIZE = 30
+SEARCH_PAGE_SIZE = 20
+
 
 class ConversationService:
-    def __init__(self, db: ChatDatabase, auth: FirebaseAuth):
+    def __init__(self, db: ChatStorage, auth: FirebaseAuth):
         self.db = db
         self.auth = auth
 
@@ -28,19 +32,29 @@ class ConversationService:
             user_id=current_user.get("localId"), name=name
         )
 
+        self.cancel_generation()
+
         st.session_state.current_conversation_id = conv_id
 
     def handle_select_conversation(self, conversation_id: int):
         """Handle selecting a conversation."""
+        if st.session_state.current_conversation_id != conversation_id:
+            self.cancel_generation()
         st.session_state.current_conversation_id = conversation_id
 
     def handle_delete_conversation(self, conversation_id: int):
         """Handle deleting a conversation."""
+        shared_job_registry().cancel(conversation_id, timeout=10)
         self.db.delete_conversation(conversation_id)
 
         if st.session_state.current_conversation_id == conversation_id:
             st.session_state.current_conversation_id = None
 
+    def cancel_generation(self):
+        """Stop the response being generated for the conversation left."""
+        if st.session_state.current_conversation_id is not None:
+            shared_job_registry().cancel(st.session_state.current_conversation_id)
+
     def handle_rename_conversation(self, new_name: str):
         """Handle renaming a conversation."""
         if not st.session_state.current_conversation_id:
@@ -57,25 +71,9 @@ class ConversationService:
             conversation_id: The ID of the conversation to retrieve
 
         Returns:
-            The conversation data dictionary or None if not found
+            The latest context of the conversation or None if it has none
         """
-        dict = self.db.get_conversation(conversation_id)
-        if dict and dict.get("context"):
-            context = dict.get("context", {})
-            user_strategy = context.get("user_strategy", None)
-            rag_strategies = context.get("rag_strategies", [])
-            route = context.get("route", None)
-            conversations = context.get("conversations", [])
-            evaluation = context.get("evaluation", None)
-
-            return ContextDict(
-                user_strategy=user_strategy,
-                rag_strategies=rag_strategies,
-                route=route,
-                conversations=conversations,
-                evaluation=evaluation,
-            )
-        return None
+        return self.db.get_conversation_context(conversation_id)
 
     def get_conversations(self):
         """Get all conversations for the current user."""
@@ -88,3 +86,60 @@ class ConversationService:
         # Here we're assuming the database expects an integer user ID
         # You'll need to modify this based on your actual database implementation
         return self.db.get_user_conversations(user_id)
+
+    def get_conversation_summaries(
+        self, before: Optional[Tuple[str, int]] = None
+    ) -> List[Dict[str, Any]]:
+        """Get one page of the ID, name and updated_at of the current user's
+        conversations, continuing after the `(updated_at, id)` of `before`."""
+        current_user = self.auth.get_current_user()
+        if not current_user:
+            raise ValueError("Please log in to get conversations.")
+
+        return self.db.get_conversation_summaries(
+            current_user.get("localId"), before=before, limit=CONVERSATION_PAGE_SIZE
+        )
+
+    def get_sidebar_conversations(self) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        The conversation summaries of the pages shown in the sidebar, and
+        whether more pages follow.
+        """
+        conversations: List[Dict[str, Any]] = []
+        has_more = False
+        before = None
+        for _ in range(st.session_state.get("conversation_pages", 1)):
+            page = self.get_conversation_summaries(before)
+            conversations.extend(page)
+            has_more = len(page) == CONVERSATION_PAGE_SIZE
+            if not has_more:
+                break
+            before = (page[-1]["updated_at"], page[-1]["id"])
+        return conversations, has_more
+
+    def show_more_conversations(self):
+        st.session_state.conversation_pages = (
+            st.session_state.get("conversation_pages", 1) + 1
+        )
+
+    def search_messages(self, query: str) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        The results of the pages of a message search shown in the sidebar,
+        best match first, and whether more follow.
+        """
+        current_user = self.auth.get_current_user()
+        if not current_user:
+            raise ValueError("Please log in to search conversations.")
+
+        shown = st.session_state.get("search_pages", 1) * SEARCH_PAGE_SIZE
+        results = self.db.search_messages(
+            current_user.get("localId"), query, limit=shown + 1
+        )
+        return results[:shown], len(results) > shown
+
+    def show_more_search_results(self):
+        st.session_state.search_pages = st.session_state.get("search_pages", 1) + 1
+
+    def reset_search_results(self):
+        """Show the first page again, for a new query."""
+        st.session_state.search_pages = 1
@@ -0,0 +1,246 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Literal, Optional
+
+from shared import ChatMessage, ContextDict
+
+from .ai_service import AIService, StreamHandler
+from .cancellation import CancelToken, GenerationCancelled
+from .chat import ChatService
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationJob:
+    """
+    One response generation running on the JobRegistry worker pool.
+
+    The StreamHandler callbacks only record progress on the job, the UI polls
+    `snapshot()` from the script thread. Nothing here may call Streamlit, the
+    worker thread has no script run context.
+    """
+
+    def __init__(self, conversation_id: int, user_message: ChatMessage):
+        self.conversation_id = conversation_id
+        # Stored together with the result, in one transaction
+        self.user_message = user_message
+        self.message = user_message.content
+        self.lock = threading.Lock()
+        self.status: Literal["running", "done", "error", "cancelled"] = "running"
+        self.steps: List[Dict[str, str]] = []
+        self.current_step: Optional[str] = None
+        self.reasoning = ""
+        self.fields: Dict[str, Any] = {}
+        # Assistant, error or cancelled message stored for the turn
+        self.result: Optional[ChatMessage] = None
+        self.future: Optional[Future] = None
+        # time.monotonic() when the job finished
+        self.finished_at: Optional[float] = None
+        self.cancel_token = CancelToken()
+        self.handler = StreamHandler(
+            on_step_update=self._on_step_update,
+            on_reasoning_update=self._on_reasoning_update,
+            on_reasoning_finish=self._on_reasoning_finish,
+            on_answer_update=self._on_answer_update,
+        )
+
+    @property
+    def done(self) -> bool:
+        return self.status != "running"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Consistent copy of the progress for one UI render."""
+        with self.lock:
+            return {
+                "status": self.status,
+                "steps": list(self.steps),
+                "current_step": self.current_step,
+                "reasoning": self.reasoning,
+                "fields": dict(self.fields),
+            }
+
+    def cancel(self) -> None:
+        """Ask the chain to stop at the next token or stage."""
+        self.cancel_token.cancel()
+
+    def finish(
+        self,
+        status: Literal["done", "error", "cancelled"],
+        result: Optional[ChatMessage],
+    ):
+        with self.lock:
+            self.result = result
+            self.status = status
+            self.finished_at = time.monotonic()
+
+    def _on_step_update(self, step: str, steps: List[str]):
+        with self.lock:
+            self.current_step = step
+            self.reasoning = ""
+
+    def _on_reasoning_update(self, step: str, reasoning: str):
+        with self.lock:
+            self.reasoning = reasoning
+
+    def _on_reasoning_finish(self, step: str, reasoning: str):
+        with self.lock:
+            self.steps.append({"step": step, "reasoning": reasoning})
+            self.current_step = None
+            self.reasoning = ""
+
+    def _on_answer_update(self, step: str, fields: Dict[str, Any]):
+        with self.lock:
+            self.fields = dict(fields)
+
+
+class JobRegistry:
+    """
+    Process-wide worker pool running response generations, one per
+    conversation.
+
+    Jobs outlive the Streamlit script run that started them. The result is
+    stored through ChatService when the job completes, whether or not a
+    browser session is still polling it. Finished jobs nobody popped are
+    dropped `keep_finished` seconds after they finished, their turn is
+    already stored.
+    """
+
+    def __init__(self, max_workers: int = 4, keep_finished: float = 60 * 60):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="generation"
+        )
+        self.lock = threading.Lock()
+        self.jobs: Dict[int, GenerationJob] = {}
+        self.keep_finished = keep_finished
+
+    def cancel(self, conversation_id: int, timeout: Optional[float] = None) -> bool:
+        """
+        Cancel the conversation's running job.
+
+        With `timeout`, wait up to that many seconds for the job to stop, so
+        its partial turn is stored before anything that follows.
+        Returns whether a running job was cancelled.
+        """
+        job = self.get(conversation_id)
+        if job is None or job.done:
+            return False
+        job.cancel()
+        if timeout is not None and job.future is not None:
+            wait([job.future], timeout=timeout)
+        return True
+
+    def submit(
+        self,
+        ai_service: AIService,
+        conversation_id: int,
+        user_message: ChatMessage,
+        initial_context: Optional[ContextDict] = None,
+    ) -> GenerationJob:
+        """Start generating the answer to `user_message` in a conversation."""
+        job = GenerationJob(conversation_id, user_message)
+        with self.lock:
+            self._drop_stale_jobs()
+            running = self.jobs.get(conversation_id)
+            if running is not None and not running.done:
+                raise ValueError("A response is already being generated")
+            self.jobs[conversation_id] = job
+        job.future = self.executor.submit(self._run, job, ai_service, initial_context)
+        return job
+
+    def get(self, conversation_id: int) -> Optional[GenerationJob]:
+        with self.lock:
+            return self.jobs.get(conversation_id)
+
+    def pop_finished(self, conversation_id: int) -> Optional[GenerationJob]:
+        """Remove and return the conversation's job if it has completed."""
+        with self.lock:
+            job = self.jobs.get(conversation_id)
+            if job is None or not job.done:
+                return None
+            return self.jobs.pop(conversation_id)
+
+    def _drop_stale_jobs(self) -> None:
+        """Forget jobs finished over `keep_finished` seconds ago, the caller
+        holds the lock."""
+        now = time.monotonic()
+        for conversation_id, job in list(self.jobs.items()):
+            finished_at = job.finished_at
+            if finished_at is not None and now - finished_at > self.keep_finished:
+                del self.jobs[conversation_id]
+
+    def _run(
+        self,
+        job: GenerationJob,
+        ai_service: AIService,
+        initial_context: Optional[ContextDict],
+    ):
+        chat_service = ChatService(job.conversation_id)
+        # Whatever escapes below, the job is finished as an error
+        status, message = "error", None
+        try:
+            response = ai_service.generate_response_stream(
+                message=job.message,
+                initial_context=initial_context,
+                stream_handler=job.handler,
+                cancel_token=job.cancel_token,
+            )
+            if isinstance(response, ContextDict):
+                last_answer = response.last_qa_answer()
+                content = last_answer if last_answer else "No answer found"
+                message = chat_service.save_assistant_message(
+                    content,
+                    response,
+                    job.handler.trace,
+                    user_message=job.user_message,
+                    write_behind=True,
+                )
+                status = "done"
+            else:
+                message = chat_service.save_error_msg(
+                    response, user_message=job.user_message, write_behind=True
+                )
+        except GenerationCancelled:
+            step = job.handler.current_step
+            partial = job.handler.get_text().get(step, "")
+            message = chat_service.save_cancelled_message(
+                partial, user_message=job.user_message, write_behind=True
+            )
+            status = "cancelled"
+        except Exception as e:
+            chat_service.save_turn(job.user_message, None, write_behind=True)
+            raise e
+        finally:
+            job.finish(status, message)
+
+        if status == "done":
+            # The answer is out, the user doesn't wait for the summary
+            self._summarize_memory(chat_service, ai_service, response)
+
+    def _summarize_memory(
+        self,
+        chat_service: ChatService,
+        ai_service: AIService,
+        context: ContextDict,
+    ):
+        try:
+            memory = ai_service.summarize_memory(context)
+            if memory is not None:
+                chat_service.save_memory(*memory)
+        except Exception:
+            # The turn is stored, the next one summarizes again
+            logger.exception("Summarizing the conversation memory failed")
+
+
+_shared_registry: Optional[JobRegistry] = None
+_shared_registry_lock = threading.Lock()
+
+
+def shared_job_registry() -> JobRegistry:
+    """Process-wide registry, shared by all sessions and script reruns."""
+    global _shared_registry
+    with _shared_registry_lock:
+        if _shared_registry is None:
+            _shared_registry = JobRegistry()
+    return _shared_registry
@@ -0,0 +1,94 @@
+import json
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+class JsonFieldStream:
+    """
+    Incremental scanner for a JSON object streamed token by token.
+
+    Every character is looked at once. A top-level field is emitted as soon as
+    its value is complete, i.e. when the `,` or `}` after it arrives, while the
+    rest of the object is still streaming. Text before the opening `{`, like a
+    ```json fence, is skipped.
+    """
+
+    def __init__(self, fields: Optional[Iterable[str]] = None):
+        self.fields = set(fields) if fields is not None else None
+        self.started = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.expect_key = True
+        self.key: Optional[str] = None
+        self.key_chars: Optional[List[str]] = None
+        self.value_chars: Optional[List[str]] = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk, return the (field, value) pairs it completed."""
+        completed: List[Tuple[str, Any]] = []
+        for char in chunk:
+            if self.finished:
+                break
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self.depth = 1
+                continue
+            self._consume(char, completed)
+        return completed
+
+    def _consume(self, char: str, completed: List[Tuple[str, Any]]) -> None:
+        if self.in_string:
+            self._append(char)
+            if self.escape:
+                self.escape = False
+            elif char == "\\":
+                self.escape = True
+            elif char == '"':
+                self.in_string = False
+                if self.key_chars is not None:
+                    self.key = json.loads("".join(self.key_chars))
+                    self.key_chars = None
+                    self.expect_key = False
+            return
+
+        if char == '"':
+            self.in_string = True
+            if self.depth == 1 and self.expect_key:
+                self.key_chars = []
+            self._append(char)
+        elif char == ":" and self.depth == 1 and self.value_chars is None:
+            self.value_chars = []
+        elif char == "," and self.depth == 1:
+            self._complete(completed)
+        elif char in "{[":
+            self.depth += 1
+            self._append(char)
+        elif char in "}]":
+            self.depth -= 1
+            if self.depth == 0:
+                self._complete(completed)
+                self.finished = True
+            else:
+                self._append(char)
+        else:
+            self._append(char)
+
+    def _append(self, char: str) -> None:
+        if self.key_chars is not None:
+            self.key_chars.append(char)
+        elif self.value_chars is not None:
+            self.value_chars.append(char)
+
+    def _complete(self, completed: List[Tuple[str, Any]]) -> None:
+        key, value_chars = self.key, self.value_chars
+        self.key, self.value_chars, self.expect_key = None, None, True
+        if key is None or value_chars is None:
+            return
+        if self.fields is not None and key not in self.fields:
+            return
+        try:
+            completed.append((key, json.loads("".join(value_chars))))
+        except json.JSONDecodeError:
+            pass
@@ -95,4 +95,16 @@ Strategy:
 {context}
 
 {format_instructions}
-"""
\ No newline at end of file
+"""
+conversation_summary = """You are summarizing a conversation between a user and a trading strategy expert.
+Update the running summary with the new conversation turns. Keep the user's decisions, preferences, answers to follow-up questions and open points about the strategy. Drop greetings and repetition.
+Write at most {max_words} words.
+
+Current summary:
+{summary}
+
+New conversation turns:
+{conversation}
+
+Updated summary:
+"""
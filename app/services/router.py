@@ -0,0 +1,312 @@
+"""
+Local message router.
+
+A small softmax-regression model over hashed word, bigram and character
+features that predicts RouteContext.message_type without a network round
+trip. The LLM routing prompt is only used when the model is not confident
+enough.
+
+The confidence threshold is tuned on cross-validated predictions, as the
+lowest one at which the local decisions still reach TARGET_ACCURACY.
+
+The trained model ships in data/router_model.json, so the app doesn't train
+one on start. Retrain it from the seed examples plus routed turns logged in
+ChatDatabase, from the repository root:
+    PYTHONPATH=app python -m services.router
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from shared import ContextDict, RouteContext
+
+from .routing_examples import routing_examples
+
+LABELS = ["non-related", "follow-up", "instruction", "question", "evaluation"]
+DEFAULT_MODEL_PATH = "data/router_model.json"
+# Share of the local decisions that must match the labels
+TARGET_ACCURACY = 0.95
+
+# (message, message type, previous turn asked follow-up questions)
+RoutingExample = Tuple[str, str, bool]
+# (actual message type, predicted message type, confidence)
+RoutingPrediction = Tuple[str, str, float]
+
+_TOKEN_RE = re.compile(r"[a-z0-9%/.]+")
+
+# Tells trading messages from small talk, which share little else with the
+# few examples of each
+TRADING_TERMS = frozenset(
+    """
+    trade trades trading trader traders strategy strategies indicator
+    indicators rsi macd ema sma atr vwap adx bollinger stochastic ichimoku
+    fibonacci supertrend keltner heikin renko candle candles candlestick chart
+    timeframe long short buy sell entry entries exit exits stop loss profit
+    target risk reward position size sizing leverage margin order orders limit
+    market futures spot perpetual perpetuals options forex crypto btc eth
+    bitcoin stock stocks etf etfs breakout breakouts reversal trend trending
+    momentum volatility volume drawdown backtest backtesting scalping swing dip
+    pullback support resistance liquidity spread slippage pip pips funding
+    exchange portfolio sharpe expectancy bullish bearish gap divergence
+    crossover cross crosses signal oversold overbought lots equity account
+    """.split()
+)
+
+
+def has_followups(context: Optional[ContextDict]) -> bool:
+    """Whether the previous turn left follow-up questions for the user."""
+    return bool(
+        context and context.user_strategy and context.user_strategy.followup_questions
+    )
+
+
+class LocalRouter:
+    """Softmax-regression router over hashed bag-of-words features."""
+
+    def __init__(
+        self,
+        weights: Optional[Dict[str, Dict[int, float]]] = None,
+        threshold: float = 0.7,
+        dimensions: int = 2**16,
+    ):
+        self.weights: Dict[str, Dict[int, float]] = weights or {
+            label: {} for label in LABELS
+        }
+        self.threshold = threshold
+        self.dimensions = dimensions
+
+    def features(self, message: str, followups: bool) -> Dict[int, float]:
+        """
+        Hashed, L2-normalised counts of unigrams, bigrams, character 4-grams
+        of the words (for inflections and typos) and trading terms, plus
+        context flags.
+        """
+        tokens = _TOKEN_RE.findall(message.lower())
+        grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for token in tokens:
+            word = f"<{token}>"
+            grams.extend(f"#{word[i:i + 4]}" for i in range(max(1, len(word) - 3)))
+        trading_terms = sum(token in TRADING_TERMS for token in tokens)
+        grams.append("__trading__" if trading_terms else "__no_trading__")
+        grams.extend(["__trading_term__"] * min(trading_terms, 3))
+        grams.append("__bias__")
+        grams.append("__followups__" if followups else "__no_followups__")
+        if message.strip().endswith("?"):
+            grams.append("__question_mark__")
+
+        counts: Dict[int, float] = {}
+        for gram in grams:
+            index = zlib.crc32(gram.encode("utf-8")) % self.dimensions
+            counts[index] = counts.get(index, 0.0) + 1.0
+
+        norm = math.sqrt(sum(v * v for v in counts.values()))
+        return {k: v / norm for k, v in counts.items()}
+
+    def probabilities(self, features: Dict[int, float]) -> Dict[str, float]:
+        scores = {
+            label: sum(self.weights[label].get(k, 0.0) * v for k, v in features.items())
+            for label in LABELS
+        }
+        top = max(scores.values())
+        exp = {label: math.exp(score - top) for label, score in scores.items()}
+        total = sum(exp.values())
+        return {label: value / total for label, value in exp.items()}
+
+    def predict(self, message: str, followups: bool = False) -> Tuple[str, float]:
+        """Return the most likely message type and its probability."""
+        probabilities = self.probabilities(self.features(message, followups))
+        label = max(probabilities, key=lambda k: probabilities[k])
+        return label, probabilities[label]
+
+    def route(
+        self, message: str, context: Optional[ContextDict] = None
+    ) -> Optional[RouteContext]:
+        """RouteContext for a confident prediction, None to fall back to the LLM."""
+        label, confidence = self.predict(message, has_followups(context))
+        if confidence < self.threshold:
+            return None
+        return RouteContext(message_type=label, confidence=confidence)
+
+    def fit(
+        self,
+        examples: Sequence[RoutingExample],
+        epochs: int = 40,
+        learning_rate: float = 0.5,
+        l2: float = 1e-4,
+        seed: int = 7,
+    ) -> "LocalRouter":
+        """Train the weights from scratch with SGD on the cross-entropy loss."""
+        self.weights = {label: {} for label in LABELS}
+        samples = [
+            (self.features(message, followups), label)
+            for message, label, followups in examples
+            if label in LABELS
+        ]
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(samples)
+            rate = learning_rate / (1 + epoch * 0.1)
+            for features, label in samples:
+                probabilities = self.probabilities(features)
+                for candidate in LABELS:
+                    gradient = probabilities[candidate] - (candidate == label)
+                    weights = self.weights[candidate]
+                    for k, v in features.items():
+                        w = weights.get(k, 0.0)
+                        weights[k] = w - rate * (gradient * v + l2 * w)
+        return self
+
+    def confusion_matrix(
+        self, examples: Sequence[RoutingExample]
+    ) -> Dict[str, Dict[str, int]]:
+        """Counts of actual (rows) vs predicted (columns) message types."""
+        matrix = {actual: {predicted: 0 for predicted in LABELS} for actual in LABELS}
+        for message, label, followups in examples:
+            if label in LABELS:
+                predicted, _ = self.predict(message, followups)
+                matrix[label][predicted] += 1
+        return matrix
+
+    def save(self, path: str = DEFAULT_MODEL_PATH) -> None:
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "threshold": self.threshold,
+                    "dimensions": self.dimensions,
+                    "weights": {
+                        label: {str(k): round(v, 6) for k, v in weights.items() if v}
+                        for label, weights in self.weights.items()
+                    },
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH) -> "LocalRouter":
+        """Load a trained router, or train one on the seed examples."""
+        if not os.path.exists(path):
+            return cls().fit(routing_examples)
+
+        with open(path, "r") as f:
+            data = json.load(f)
+        weights = {
+            label: {int(k): v for k, v in data["weights"].get(label, {}).items()}
+            for label in LABELS
+        }
+        return cls(weights, data["threshold"], data["dimensions"])
+
+
+def cross_validated_predictions(
+    examples: Sequence[RoutingExample], folds: int = 5, seed: int = 7
+) -> List[RoutingPrediction]:
+    """Predict every example with a router trained on the other folds."""
+    shuffled = [example for example in examples if example[1] in LABELS]
+    random.Random(seed).shuffle(shuffled)
+    predictions = []
+    for fold in range(folds):
+        train = [e for i, e in enumerate(shuffled) if i % folds != fold]
+        router = LocalRouter().fit(train)
+        for message, label, followups in shuffled[fold::folds]:
+            predicted, confidence = router.predict(message, followups)
+            predictions.append((label, predicted, confidence))
+    return predictions
+
+
+def tune_threshold(
+    predictions: Sequence[RoutingPrediction],
+    target_accuracy: float = TARGET_ACCURACY,
+) -> float:
+    """
+    The lowest confidence threshold at which the predictions the router
+    decides are at least `target_accuracy` correct, 1.0 when none is.
+    """
+    ranked = sorted(predictions, key=lambda p: p[2], reverse=True)
+    threshold = 1.0
+    correct = 0
+    for decided, (label, predicted, confidence) in enumerate(ranked, start=1):
+        correct += label == predicted
+        # Ties share the threshold, only check after the last of them
+        if decided < len(ranked) and ranked[decided][2] == confidence:
+            continue
+        if correct / decided >= target_accuracy:
+            threshold = confidence
+    return threshold
+
+
+def format_confusion_matrix(matrix: Dict[str, Dict[str, int]]) -> str:
+    width = max(len(label) for label in LABELS) + 2
+    lines = [
+        "actual \\ predicted".ljust(width) + "".join(l.rjust(width) for l in LABELS)
+    ]
+    for actual in LABELS:
+        row = "".join(str(matrix[actual][p]).rjust(width) for p in LABELS)
+        lines.append(actual.ljust(width) + row)
+
+    total = sum(sum(row.values()) for row in matrix.values())
+    correct = sum(matrix[label][label] for label in LABELS)
+    if total:
+        lines.append(f"accuracy: {correct / total:.3f} ({correct}/{total})")
+    return "\n".join(lines)
+
+
+def main():
+    from database import ChatDatabase
+
+    parser = argparse.ArgumentParser(description="Retrain the local message router")
+    parser.add_argument("--db-path", default="data/frontend.db")
+    parser.add_argument("--model-path", default=DEFAULT_MODEL_PATH)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=None,
+        help="Fixed confidence threshold instead of the tuned one",
+    )
+    parser.add_argument("--target-accuracy", type=float, default=TARGET_ACCURACY)
+    parser.add_argument("--holdout", type=float, default=0.2)
+    args = parser.parse_args()
+
+    db = ChatDatabase(args.db_path)
+    logged = db.get_routing_examples()
+    db.close()
+    examples: List[RoutingExample] = list(routing_examples) + logged
+    print(f"{len(routing_examples)} seed examples, {len(logged)} logged turns")
+
+    def threshold_for(examples: Sequence[RoutingExample]) -> float:
+        if args.threshold is not None:
+            return args.threshold
+        return tune_threshold(
+            cross_validated_predictions(examples), args.target_accuracy
+        )
+
+    random.Random(7).shuffle(examples)
+    split = int(len(examples) * (1 - args.holdout))
+    train, test = examples[:split], examples[split:]
+
+    # Tuned on the training part only, the held-out examples judge it
+    router = LocalRouter(threshold=threshold_for(train)).fit(train)
+    print(f"threshold: {router.threshold:.3f}")
+    print(format_confusion_matrix(router.confusion_matrix(test)))
+    predictions = [
+        (label, *router.predict(message, followups))
+        for message, label, followups in test
+    ]
+    decided = [p for p in predictions if p[2] >= router.threshold]
+    if test:
+        print(f"LLM fallback rate: {1 - len(decided) / len(test):.3f}")
+    if decided:
+        correct = sum(label == predicted for label, predicted, _ in decided)
+        print(f"local decision accuracy: {correct / len(decided):.3f}")
+
+    router = LocalRouter(threshold=threshold_for(examples)).fit(examples)
+    router.save(args.model_path)
+    print(f"Saved router to {args.model_path}, threshold {router.threshold:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""Labelled seed examples for the local message router.
+
+Each example is (user message, message type, previous turn asked follow-up
+questions). Logged turns from ChatDatabase are added on retraining.
+"""
+
+routing_examples = [
+    # non-related
+    ("Hi, how are you?", "non-related", False),
+    ("What is the weather like in London today?", "non-related", False),
+    ("Tell me a joke", "non-related", False),
+    ("Who won the football game yesterday?", "non-related", False),
+    ("Can you write me a poem about cats?", "non-related", False),
+    ("What's the capital of France?", "non-related", False),
+    ("Recommend a good movie for tonight", "non-related", False),
+    ("hello", "non-related", False),
+    ("Thanks, bye!", "non-related", False),
+    ("How do I cook pasta?", "non-related", True),
+    ("good morning!", "non-related", False),
+    ("hey there", "non-related", False),
+    ("Who are you?", "non-related", False),
+    ("are you chatgpt?", "non-related", False),
+    ("What can you do?", "non-related", False),
+    ("Translate 'good night' into Spanish", "non-related", False),
+    ("What's 17 times 23?", "non-related", False),
+    ("Write a python function that reverses a string", "non-related", False),
+    (
+        "Can you help me with my homework on the French revolution?",
+        "non-related",
+        False,
+    ),
+    ("What time is it in Tokyo right now?", "non-related", False),
+    ("I'm bored, entertain me", "non-related", False),
+    ("Suggest a name for my dog", "non-related", False),
+    ("How tall is Mount Everest?", "non-related", False),
+    ("What should I eat for dinner?", "non-related", True),
+    ("lol", "non-related", False),
+    ("ok thanks a lot", "non-related", True),
+    ("thank you!", "non-related", True),
+    ("Never mind, forget it", "non-related", True),
+    ("Can you book me a flight to Berlin?", "non-related", False),
+    ("Write an email to my landlord about the broken heater", "non-related", False),
+    ("Who was the first person on the moon?", "non-related", False),
+    ("What's your favourite colour?", "non-related", False),
+    ("Summarize the plot of Harry Potter", "non-related", False),
+    ("How do I fix a flat bike tire?", "non-related", False),
+    ("test", "non-related", False),
+    ("asdfgh", "non-related", False),
+    ("Do you dream?", "non-related", False),
+    ("Is it going to rain this weekend?", "non-related", False),
+    ("Tell me something interesting about octopuses", "non-related", False),
+    ("What is the meaning of life?", "non-related", False),
+    ("Recommend some good podcasts about history", "non-related", False),
+    ("How many calories are in a banana?", "non-related", False),
+    ("Can you speak German?", "non-related", False),
+    ("My internet is slow, what can I do?", "non-related", False),
+    ("Give me a recipe for chocolate cake", "non-related", False),
+    ("Who is the president of the United States?", "non-related", False),
+    ("what's up", "non-related", False),
+    ("I need help writing a cover letter for a nurse job", "non-related", False),
+    ("How do I learn to play guitar?", "non-related", True),
+    ("Play a game of tic tac toe with me", "non-related", False),
+    ("bye", "non-related", True),
+    ("Explain quantum entanglement simply", "non-related", False),
+    ("What's the best laptop for programming?", "non-related", False),
+    ("sorry, wrong chat", "non-related", True),
+    ("Can you draw a picture of a horse?", "non-related", False),
+    ("How do vaccines work?", "non-related", False),
+    ("What's the latest news about the Olympics?", "non-related", False),
+    ("Help me plan a trip to Italy", "non-related", False),
+    ("Which programming language should I learn first?", "non-related", False),
+    ("Hello? Is anyone there?", "non-related", False),
+    ("Tell me a fun fact", "non-related", False),
+    ("what day is today", "non-related", False),
+    ("I feel stressed at work, any tips?", "non-related", False),
+    ("How do I change a car tyre?", "non-related", False),
+    ("Write a haiku about autumn", "non-related", False),
+    ("Who painted the Mona Lisa?", "non-related", False),
+    ("nice, cheers", "non-related", True),
+    ("How far is the moon from Earth?", "non-related", False),
+    ("Can you remind me to call my mom tomorrow?", "non-related", False),
+    ("hi, I'm new here", "non-related", False),
+    # follow-up
+    ("I want to trade BTC/USDT on the 1 hour timeframe", "follow-up", True),
+    ("Risk 1% of the account per trade", "follow-up", True),
+    ("Use a stop loss at 2 ATR below the entry", "follow-up", True),
+    ("Take profit at 3R, no trailing stop", "follow-up", True),
+    ("Only during the London and New York sessions", "follow-up", True),
+    ("RSI period 14, oversold at 30", "follow-up", True),
+    ("Market orders for entries, limit orders for take profit", "follow-up", True),
+    ("Fixed position size of 0.1 lots", "follow-up", True),
+    ("Yes, the EMA crossover should be 50 and 200", "follow-up", True),
+    ("I'm not sure, what would you suggest for the timeframe?", "follow-up", True),
+    ("Crypto, mainly ETH and SOL on the 4h chart", "follow-up", True),
+    ("Maximum daily loss should be 3%", "follow-up", True),
+    ("1h", "follow-up", True),
+    ("4 hour chart", "follow-up", True),
+    ("daily timeframe", "follow-up", True),
+    ("BTC", "follow-up", True),
+    ("ETH/USDT perpetual futures on Binance", "follow-up", True),
+    ("S&P 500 futures, ES contract", "follow-up", True),
+    ("Forex, EUR/USD and GBP/USD", "follow-up", True),
+    ("2% risk per trade", "follow-up", True),
+    ("half a percent of equity per position", "follow-up", True),
+    ("No more than 3 open positions at a time", "follow-up", True),
+    ("stop loss 1.5%", "follow-up", True),
+    ("The stop goes below the last swing low", "follow-up", True),
+    ("take profit at the upper Bollinger band", "follow-up", True),
+    ("Exit when RSI goes above 70", "follow-up", True),
+    ("I'd use a trailing stop of 2 ATR", "follow-up", True),
+    ("Limit orders only", "follow-up", True),
+    ("market orders are fine", "follow-up", True),
+    ("Both long and short", "follow-up", True),
+    ("Long only", "follow-up", True),
+    ("only shorts", "follow-up", True),
+    ("Yes", "follow-up", True),
+    ("no", "follow-up", True),
+    ("yes, 20 period", "follow-up", True),
+    ("EMA 9 and EMA 21", "follow-up", True),
+    ("Enter when price closes above the previous day high", "follow-up", True),
+    ("Entry on a pullback to the 20 EMA in an uptrend", "follow-up", True),
+    ("MACD 12 26 9, standard settings", "follow-up", True),
+    ("Bollinger 20, 2 standard deviations", "follow-up", True),
+    ("Volume should be at least 1.5x the 20 bar average", "follow-up", True),
+    ("I don't know, you decide", "follow-up", True),
+    ("whatever you think is best", "follow-up", True),
+    ("Not sure about the position sizing, maybe fixed fractional?", "follow-up", True),
+    ("Kelly criterion, but half of it", "follow-up", True),
+    (
+        "Position size based on ATR so every trade risks the same amount",
+        "follow-up",
+        True,
+    ),
+    ("US session only, 9:30 to 16:00 New York time", "follow-up", True),
+    ("Avoid trading around major news like NFP and CPI", "follow-up", True),
+    ("Hold for a maximum of 5 days", "follow-up", True),
+    ("close everything at the end of the day", "follow-up", True),
+    ("No leverage", "follow-up", True),
+    ("3x leverage max", "follow-up", True),
+    ("I have a $10,000 account", "follow-up", True),
+    ("My account is 5k and I can lose about 500", "follow-up", True),
+    ("Swing trading, holding a few days to a couple of weeks", "follow-up", True),
+    ("scalping on the 1 minute", "follow-up", True),
+    ("Large cap tech stocks like AAPL, MSFT and NVDA", "follow-up", True),
+    ("Gold and silver", "follow-up", True),
+    ("the top 10 coins by market cap", "follow-up", True),
+    ("Stop after 3 losing trades in a row", "follow-up", True),
+    ("Breakeven stop once the trade is 1R in profit", "follow-up", True),
+    ("Partial take profit: half at 1R, rest at 3R", "follow-up", True),
+    ("Exit if the trade doesn't move within 10 bars", "follow-up", True),
+    ("RSI 2 period, buy below 10", "follow-up", True),
+    ("Confirmation from the 4h trend, entries on the 15m", "follow-up", True),
+    ("The ADX must be above 25", "follow-up", True),
+    ("Weekly timeframe for the trend filter", "follow-up", True),
+    ("Stop at 1 ATR, target at 2 ATR", "follow-up", True),
+    ("Yes that's right", "follow-up", True),
+    ("correct, and also add the short side", "follow-up", True),
+    ("I think 30 and 70 are fine for RSI", "follow-up", True),
+    ("Use the close price", "follow-up", True),
+    ("Max drawdown 15%", "follow-up", True),
+    ("Stop loss: 2%. Take profit: 6%. Timeframe: 1h.", "follow-up", True),
+    ("Futures on Bybit, USDT margined", "follow-up", True),
+    # instruction
+    (
+        "I want to build a trend-following strategy with moving averages",
+        "instruction",
+        False,
+    ),
+    ("Create a mean reversion strategy using Bollinger Bands", "instruction", False),
+    ("Let's build a breakout strategy for EUR/USD", "instruction", False),
+    ("I want to buy when RSI is below 30 and MACD crosses up", "instruction", False),
+    ("Add a volume filter to the entry conditions", "instruction", True),
+    ("Change the exit to a trailing stop of 1.5 ATR", "instruction", True),
+    ("Make it a momentum strategy instead", "instruction", True),
+    ("Help me design a scalping strategy for gold", "instruction", False),
+    ("Add the VWAP as a second indicator", "instruction", True),
+    ("I want to trade reversals when a trend is exhausted", "instruction", False),
+    ("Start a new strategy based on the Ichimoku cloud", "instruction", False),
+    ("Include a time filter so it only trades in the morning", "instruction", True),
+    ("Create a strategy that buys the dip on SPY", "instruction", False),
+    ("I want a grid trading bot for ETH", "instruction", False),
+    ("Build me a DCA strategy for bitcoin", "instruction", False),
+    (
+        "Let's make a pairs trading strategy between Coke and Pepsi",
+        "instruction",
+        False,
+    ),
+    ("Design a strategy around the opening range breakout", "instruction", False),
+    ("I'd like to automate a moving average crossover system", "instruction", False),
+    ("New strategy: short when funding rates are very high", "instruction", False),
+    ("Write a strategy that trades the RSI divergence", "instruction", False),
+    (
+        "I have an idea: buy stocks that gap down more than 5% at the open",
+        "instruction",
+        False,
+    ),
+    ("Help me turn my discretionary setup into rules", "instruction", False),
+    (
+        "Make a volatility breakout strategy using Keltner channels",
+        "instruction",
+        False,
+    ),
+    ("I want to trade the London open breakout on GBP/USD", "instruction", False),
+    (
+        "Build a strategy that goes long when the VIX spikes above 30",
+        "instruction",
+        False,
+    ),
+    ("Can you create a supertrend strategy for crypto?", "instruction", False),
+    ("I want to create a carry trade strategy in forex", "instruction", False),
+    ("Let's build something with the Heikin Ashi candles", "instruction", False),
+    (
+        "Set up a strategy trading the 200 day moving average on stocks",
+        "instruction",
+        False,
+    ),
+    ("Create an arbitrage strategy between two exchanges", "instruction", False),
+    ("I want a strategy that follows whale wallet movements", "instruction", False),
+    ("Make a strategy for trading earnings announcements", "instruction", False),
+    (
+        "Build a mean reversion system on the 5 minute chart for NQ",
+        "instruction",
+        False,
+    ),
+    ("I want to short overextended altcoins", "instruction", False),
+    ("Let's do a turtle trading style breakout", "instruction", False),
+    (
+        "Give me a strategy based on the Fibonacci retracement levels",
+        "instruction",
+        False,
+    ),
+    ("Create a momentum rotation strategy across sector ETFs", "instruction", False),
+    (
+        "Build a strategy using order block and fair value gap concepts",
+        "instruction",
+        False,
+    ),
+    ("I'd like to start a strategy trading inside bars", "instruction", False),
+    ("Develop a strategy using the stochastic RSI", "instruction", False),
+    (
+        "Create a bot that buys when the price touches the lower band",
+        "instruction",
+        False,
+    ),
+    ("my idea is to buy btc every time it drops 10% in a day", "instruction", False),
+    ("Add a stop loss to the strategy", "instruction", True),
+    ("Remove the MACD condition", "instruction", True),
+    ("Change the timeframe to 15 minutes", "instruction", True),
+    ("Switch from EMA to SMA", "instruction", True),
+    ("Also add a short side to it", "instruction", True),
+    ("Replace RSI with the stochastic oscillator", "instruction", True),
+    ("Make the stop tighter, 1 ATR instead of 2", "instruction", True),
+    ("Add a filter so it only trades when ADX is above 20", "instruction", True),
+    ("Can you add a trailing take profit?", "instruction", True),
+    ("Let's use the daily trend as a filter too", "instruction", True),
+    ("Drop the volume filter, it's too restrictive", "instruction", True),
+    ("Make it trade on ETH instead of BTC", "instruction", True),
+    ("Add position sizing based on volatility", "instruction", True),
+    ("Instead of a fixed target, exit on an opposite signal", "instruction", True),
+    ("Add a rule to skip trades on Fridays", "instruction", True),
+    ("Let's make the entry require two closes above the band", "instruction", True),
+    ("I changed my mind, make it a short only strategy", "instruction", True),
+    ("Add a maximum holding period of 10 days", "instruction", True),
+    ("Lower the risk per trade", "instruction", True),
+    ("Use limit entries at the mid band instead", "instruction", True),
+    (
+        "Start over with a completely different approach using Renko",
+        "instruction",
+        True,
+    ),
+    ("Forget the previous one, I want a scalping strategy now", "instruction", True),
+    ("Rework the exits to use a chandelier stop", "instruction", True),
+    ("Also add a rule: no new trades after 3 losses in a day", "instruction", True),
+    ("Make the RSI period 7 and the thresholds 20/80", "instruction", True),
+    ("Add the 50 EMA as a trend filter for entries", "instruction", True),
+    ("Include a news filter for high impact events", "instruction", True),
+    (
+        "Go long when price breaks the 20 day high, exit on the 10 day low",
+        "instruction",
+        False,
+    ),
+    ("Short when RSI is above 80 and price is at the upper band", "instruction", False),
+    ("enter long if macd crosses signal line below zero", "instruction", False),
+    ("I want to sell covered calls on my stock portfolio", "instruction", False),
+    ("I want to use machine learning to predict the next candle", "instruction", False),
+    # question
+    ("What is the RSI indicator and how does it work?", "question", False),
+    ("How is the ATR calculated?", "question", False),
+    ("What is the difference between EMA and SMA?", "question", False),
+    ("Which indicators work best for trending markets?", "question", False),
+    ("How do Bollinger Bands measure volatility?", "question", False),
+    ("What is a good risk reward ratio for swing trading?", "question", True),
+    ("Can you explain what a stop-limit order is?", "question", False),
+    ("What are common mean reversion strategies?", "question", False),
+    ("How does the MACD histogram signal momentum?", "question", True),
+    ("Why do breakout strategies fail in ranging markets?", "question", False),
+    ("What timeframe is best for day trading?", "question", False),
+    ("Is the stochastic oscillator better than RSI?", "question", True),
+    ("What is a moving average?", "question", False),
+    ("what's the difference between spot and futures?", "question", False),
+    ("How does leverage work?", "question", False),
+    ("What is slippage?", "question", False),
+    ("Explain the Sharpe ratio", "question", False),
+    ("What does ATR stand for?", "question", False),
+    ("How do I calculate position size from my stop loss?", "question", False),
+    ("What is a good win rate for a trend following system?", "question", False),
+    ("Why do most traders lose money?", "question", False),
+    ("What is the best indicator for scalping?", "question", False),
+    ("How does a trailing stop work?", "question", True),
+    ("What is a drawdown?", "question", False),
+    ("What is the Kelly criterion?", "question", True),
+    ("Is 2% risk per trade too much?", "question", True),
+    ("What's the difference between a limit and a stop order?", "question", False),
+    ("How reliable are candlestick patterns?", "question", False),
+    ("What does overfitting mean in backtesting?", "question", False),
+    (
+        "How many trades do I need for a statistically valid backtest?",
+        "question",
+        False,
+    ),
+    ("What are funding rates in crypto perpetuals?", "question", False),
+    ("Explain what VWAP is used for", "question", False),
+    ("Is the Ichimoku cloud good for crypto?", "question", False),
+    ("How do you identify support and resistance?", "question", False),
+    ("What is a fair value gap?", "question", False),
+    ("What are the best hours to trade forex?", "question", False),
+    ("Does the RSI work on the 1 minute chart?", "question", True),
+    ("what is mean reversion", "question", False),
+    ("How do market makers make money?", "question", False),
+    ("What's a good profit factor?", "question", False),
+    ("What is the difference between trend following and momentum?", "question", False),
+    ("How do options greeks work?", "question", False),
+    ("Why would I use an SMA instead of an EMA?", "question", True),
+    ("Can you explain the MACD signal line?", "question", False),
+    ("What's a reasonable max drawdown for a trading bot?", "question", True),
+    ("How do I avoid look-ahead bias in a backtest?", "question", False),
+    ("What is the ADX and what value means a strong trend?", "question", False),
+    ("Which is better for beginners, swing trading or day trading?", "question", False),
+    ("What are the risks of using high leverage?", "question", False),
+    ("How do stop hunts work?", "question", False),
+    ("What's a divergence in RSI?", "question", False),
+    ("How do I know if a market is trending or ranging?", "question", False),
+    ("Should I use a fixed or a trailing stop?", "question", True),
+    ("What does it mean when the Bollinger Bands squeeze?", "question", False),
+    ("What is a pip in forex?", "question", False),
+    ("How are crypto exchange fees usually calculated?", "question", False),
+    ("What is the expectancy of a trading system?", "question", False),
+    ("How do you backtest a strategy properly?", "question", False),
+    ("What is walk-forward analysis?", "question", False),
+    ("Are moving average crossovers still profitable?", "question", False),
+    ("What's the typical spread on EUR/USD?", "question", False),
+    ("what timeframe do professional traders use", "question", False),
+    ("How does the stochastic oscillator differ from RSI?", "question", False),
+    ("What is market structure in trading?", "question", False),
+    ("Is it better to risk a fixed dollar amount or a percentage?", "question", True),
+    ("Why does my strategy work in backtests but not live?", "question", False),
+    ("How does compounding affect position sizing?", "question", False),
+    ("What's the difference between a hammer and a doji?", "question", False),
+    ("Can you explain what liquidity means for a stock?", "question", False),
+    ("What indicators do you recommend for a breakout strategy?", "question", True),
+    ("How do I measure volatility?", "question", False),
+    ("What is correlation between assets and why does it matter?", "question", False),
+    # evaluation
+    ("Evaluate my strategy", "evaluation", True),
+    ("Looks good, confirm the strategy", "evaluation", True),
+    ("Yes, I confirm. Please evaluate it", "evaluation", True),
+    ("Score this strategy", "evaluation", False),
+    ("Give me the pros and cons of this strategy", "evaluation", True),
+    ("The strategy is complete, let's continue to evaluation", "evaluation", True),
+    ("Confirmation", "evaluation", True),
+    ("How good is my strategy? Rate it", "evaluation", False),
+    ("I'm happy with it, evaluate", "evaluation", True),
+    ("Review the strategy and tell me its weaknesses", "evaluation", False),
+    ("evaluate", "evaluation", True),
+    ("Evaluate it please", "evaluation", True),
+    ("evaluate the strategy now", "evaluation", True),
+    ("Please run the evaluation", "evaluation", True),
+    ("ok evaluate", "evaluation", True),
+    ("confirm", "evaluation", True),
+    ("I confirm", "evaluation", True),
+    ("Confirmed, go ahead", "evaluation", True),
+    ("yes confirm the strategy", "evaluation", True),
+    ("That's everything, evaluate my strategy", "evaluation", True),
+    ("Looks complete to me, let's evaluate", "evaluation", True),
+    ("Good, now give me your evaluation", "evaluation", True),
+    ("What do you think of this strategy?", "evaluation", False),
+    ("Is my strategy any good?", "evaluation", True),
+    ("Rate my strategy from 0 to 100", "evaluation", True),
+    ("Give it a score", "evaluation", True),
+    ("How would you score this setup?", "evaluation", False),
+    ("What are the strengths and weaknesses of my strategy?", "evaluation", True),
+    ("Tell me the positives and negatives of this plan", "evaluation", True),
+    ("Critique my strategy", "evaluation", False),
+    ("Be honest, is this strategy profitable?", "evaluation", True),
+    ("I'm done, please review it", "evaluation", True),
+    ("That's all the details, review the strategy", "evaluation", True),
+    ("Review my trading plan", "evaluation", False),
+    ("Analyze the strategy we built", "evaluation", True),
+    ("Assess the risk of this strategy", "evaluation", True),
+    ("Check my strategy for problems", "evaluation", True),
+    ("Can you evaluate the strategy we just made?", "evaluation", True),
+    ("No more changes, evaluate", "evaluation", True),
+    ("Finalize and evaluate", "evaluation", True),
+    ("proceed to evaluation", "evaluation", True),
+    ("go to the evaluation step", "evaluation", True),
+    ("let's move on to the evaluation", "evaluation", True),
+    ("Ready for evaluation", "evaluation", True),
+    ("done, evaluate", "evaluation", True),
+    ("all good, confirm", "evaluation", True),
+    ("Yes, this is the final version", "evaluation", True),
+    ("It's final, give me the score", "evaluation", True),
+    ("perfect, please evaluate it now", "evaluation", True),
+    ("Would this strategy work in a bear market?", "evaluation", True),
+    ("What could go wrong with this strategy?", "evaluation", True),
+    ("Point out the weak spots of my system", "evaluation", True),
+    ("Give me feedback on my strategy", "evaluation", True),
+    ("Grade this strategy", "evaluation", False),
+    ("How robust is the strategy I described?", "evaluation", True),
+    ("evaluate my idea: buy BTC when RSI < 30, sell at RSI > 70", "evaluation", False),
+    (
+        "Score my setup: long on a 20/50 EMA cross, stop below the swing low",
+        "evaluation",
+        False,
+    ),
+    (
+        "is this a good strategy? buy on golden cross, sell on death cross",
+        "evaluation",
+        False,
+    ),
+    ("confirm and evaluate", "evaluation", True),
+    ("I approve the strategy", "evaluation", True),
+    ("Approved", "evaluation", True),
+    ("Evaluate the current version", "evaluation", True),
+    ("What's your verdict on this strategy?", "evaluation", True),
+    ("Do a final review of the strategy", "evaluation", True),
+    ("Give me an overall rating", "evaluation", True),
+    ("Is this ready to trade live? Evaluate it", "evaluation", True),
+    ("how good is it", "evaluation", True),
+    ("Evaluation please", "evaluation", True),
+    ("Thoughts on the strategy as it stands?", "evaluation", True),
+]
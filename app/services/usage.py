@@ -0,0 +1,175 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks.base import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from pydantic import BaseModel
+
+from shared.trace import TraceSpan, TurnTrace
+
+
+class LlmCall(BaseModel):
+    """One chat model call of a chain, as seen by UsageCallback."""
+
+    chain: str
+    model: str
+    latency: float
+    time_to_first_token: Optional[float]
+    prompt_tokens: int
+    completion_tokens: int
+    # Served from the LLM response cache, no tokens were streamed
+    cached: bool
+
+
+class UsageRecorder:
+    """Thread-safe per chain/model totals of latency and token use."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals: Dict[str, Dict[str, float]] = {}
+
+    def record(self, call: LlmCall) -> None:
+        with self.lock:
+            totals = self.totals.setdefault(
+                f"{call.chain}/{call.model}",
+                {
+                    "calls": 0,
+                    "cached": 0,
+                    "latency": 0.0,
+                    "time_to_first_token": 0.0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                },
+            )
+            totals["calls"] += 1
+            if call.cached:
+                # Cached responses replay the usage of the original call
+                totals["cached"] += 1
+                return
+            totals["latency"] += call.latency
+            totals["time_to_first_token"] += call.time_to_first_token or 0.0
+            totals["prompt_tokens"] += call.prompt_tokens
+            totals["completion_tokens"] += call.completion_tokens
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Averages per `chain/model` over the calls that reached the API."""
+        stats = {}
+        with self.lock:
+            for key, totals in self.totals.items():
+                api_calls = totals["calls"] - totals["cached"] or 1
+                stats[key] = {
+                    "calls": totals["calls"],
+                    "cached": totals["cached"],
+                    "avg_latency": totals["latency"] / api_calls,
+                    "avg_time_to_first_token": totals["time_to_first_token"]
+                    / api_calls,
+                    "avg_prompt_tokens": totals["prompt_tokens"] / api_calls,
+                    "avg_completion_tokens": totals["completion_tokens"] / api_calls,
+                }
+        return stats
+
+
+class UsageCallback(BaseCallbackHandler):
+    """Callback handler timing chat model calls and reading their token usage.
+
+    The chain name comes from the `chain` metadata set on each chain's model.
+    All chains stream, a call that streamed no tokens was served from the LLM
+    response cache.
+    """
+
+    run_inline = True
+
+    def __init__(
+        self,
+        recorder: Optional[UsageRecorder] = None,
+        trace: Optional[TurnTrace] = None,
+    ):
+        self.recorder = recorder
+        self.trace = trace
+        self.calls: List[LlmCall] = []
+        self.lock = threading.Lock()
+        self.runs: Dict[UUID, Dict[str, Any]] = {}
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[Any]],
+        *,
+        run_id: UUID,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        metadata = metadata or {}
+        params = kwargs.get("invocation_params") or {}
+        with self.lock:
+            self.runs[run_id] = {
+                "chain": metadata.get("chain", "unknown"),
+                "model": metadata.get("model")
+                or params.get("model_name")
+                or metadata.get("ls_model_name", "unknown"),
+                "start": time.perf_counter(),
+                "first_token": None,
+            }
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self.runs.get(run_id)
+        if run is not None and run["first_token"] is None:
+            run["first_token"] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        with self.lock:
+            run = self.runs.pop(run_id, None)
+        if run is None:
+            return
+
+        end = time.perf_counter()
+        prompt_tokens, completion_tokens = token_usage(response)
+        call = LlmCall(
+            chain=run["chain"],
+            model=run["model"],
+            latency=end - run["start"],
+            time_to_first_token=(
+                run["first_token"] - run["start"] if run["first_token"] else None
+            ),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached=run["first_token"] is None,
+        )
+        with self.lock:
+            self.calls.append(call)
+        if self.recorder is not None:
+            self.recorder.record(call)
+        if self.trace is not None:
+            self.trace.add(
+                TraceSpan(
+                    kind="llm",
+                    name=call.chain,
+                    model=call.model,
+                    start_offset=self.trace.offset(run["start"]),
+                    duration=call.latency,
+                    time_to_first_token=call.time_to_first_token,
+                    prompt_tokens=0 if call.cached else call.prompt_tokens,
+                    completion_tokens=0 if call.cached else call.completion_tokens,
+                    cached=call.cached,
+                )
+            )
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        with self.lock:
+            self.runs.pop(run_id, None)
+
+
+def token_usage(response: LLMResult) -> Tuple[int, int]:
+    """Prompt and completion tokens of a response, 0 when the API sent none."""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(
+                getattr(generation, "message", None), "usage_metadata", None
+            )
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
@@ -1,3 +1,4 @@
-from .types import ChatMessage, ContextDict, UserStrategy, RouteContext, QaContext, EvaluationContext
+from .types import ChatMessage, ContextDict, UserStrategy, RouteContext, QaContext, EvaluationContext, RenderedMessage
+from .trace import TraceSpan, TurnTrace
 
-__all__ = ["ChatMessage", "ContextDict", "UserStrategy", "RouteContext", "QaContext", "EvaluationContext"]
+__all__ = ["ChatMessage", "ContextDict", "UserStrategy", "RouteContext", "QaContext", "EvaluationContext", "RenderedMessage", "TraceSpan", "TurnTrace"]
@@ -0,0 +1,70 @@
+from typing import List, Optional, Tuple
+
+from common.utils import num_tokens_from_string, truncate_to_tokens
+
+
+class ContextPacker:
+    """
+    Assembles prompt context within a token budget.
+
+    Sections are rendered in the order they are added, but the budget is
+    filled by priority: lower `priority` sections first and, inside a section,
+    items in order (or newest first). A section header only counts, and only
+    renders, once one of its items made it in. Without a budget every item is
+    kept and no tokens are counted.
+    """
+
+    def __init__(self, token_budget: Optional[int] = None):
+        self.token_budget = token_budget
+        # (header, items, priority, newest_first, truncate)
+        self.sections: List[Tuple[str, List[str], int, bool, bool]] = []
+
+    def section(
+        self,
+        header: str,
+        items: List[str],
+        priority: int,
+        newest_first: bool = False,
+        truncate: bool = False,
+    ) -> "ContextPacker":
+        """Add a section. With `truncate`, an item that doesn't fit is cut to
+        the remaining budget instead of being dropped."""
+        if items:
+            self.sections.append((header, items, priority, newest_first, truncate))
+        return self
+
+    def render(self) -> str:
+        if self.token_budget is None:
+            return "".join(
+                header + "".join(items) for header, items, *_ in self.sections
+            )
+
+        order = sorted(range(len(self.sections)), key=lambda i: self.sections[i][2])
+        remaining = self.token_budget
+        packed: List[List[Optional[str]]] = [
+            [None] * len(items) for _, items, *_ in self.sections
+        ]
+
+        for index in order:
+            header, items, _, newest_first, truncate = self.sections[index]
+            header_tokens = num_tokens_from_string(header) if header else 0
+            ranks = range(len(items) - 1, -1, -1) if newest_first else range(len(items))
+            for rank in ranks:
+                header_cost = 0 if any(packed[index]) else header_tokens
+                cost = header_cost + num_tokens_from_string(items[rank])
+                if cost <= remaining:
+                    packed[index][rank] = items[rank]
+                    remaining -= cost
+                    continue
+                # Lower priority items never displace higher priority ones
+                if truncate and remaining > header_cost:
+                    available = remaining - header_cost
+                    packed[index][rank] = truncate_to_tokens(items[rank], available)
+                    remaining = 0
+                break
+
+        markdown = ""
+        for (header, *_), items in zip(self.sections, packed):
+            if any(items):
+                markdown += header + "".join(item for item in items if item)
+        return markdown
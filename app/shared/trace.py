@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel
+
+
+class TraceSpan(BaseModel):
+    """
+    One timed part of a turn.
+
+    - stage: a step reported to the StreamHandler, until the next step starts.
+      Its tokens are those of the LLM calls started while it was running.
+    - span: retrieval, RRF or strategy load inside a stage
+    - llm: a chat model call, `name` is the chain
+    - turn: the whole turn
+    """
+
+    kind: Literal["stage", "span", "llm", "turn"]
+    name: str
+    model: Optional[str] = None
+    # Seconds since the turn started
+    start_offset: float
+    duration: float
+    time_to_first_token: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cached: bool = False
+
+
+class TurnTrace:
+    """Thread-safe collector of the TraceSpans of one turn."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.spans: List[TraceSpan] = []
+        self.finished = False
+        self._stage: Optional[str] = None
+        self._stage_start = 0.0
+        self._stage_first_token: Optional[float] = None
+
+    def offset(self, at: Optional[float] = None) -> float:
+        return (at if at is not None else time.perf_counter()) - self.started
+
+    def stage(self, name: str) -> None:
+        """Close the running stage and start `name`."""
+        with self.lock:
+            self._close_stage()
+            self._stage = name
+            self._stage_start = time.perf_counter()
+            self._stage_first_token = None
+
+    def token(self) -> None:
+        """Mark the first streamed token of the running stage."""
+        if self._stage is not None and self._stage_first_token is None:
+            self._stage_first_token = time.perf_counter()
+
+    def add(self, span: TraceSpan) -> None:
+        with self.lock:
+            self.spans.append(span)
+
+    def span(self, name: str, start: float, end: float) -> None:
+        """Record a timed span, `start` and `end` are perf_counter values."""
+        self.add(
+            TraceSpan(
+                kind="span",
+                name=name,
+                start_offset=self.offset(start),
+                duration=end - start,
+            )
+        )
+
+    def finish(self) -> None:
+        """Close the running stage and record the whole turn."""
+        with self.lock:
+            if self.finished:
+                return
+            self._close_stage()
+            self._stage = None
+            self.finished = True
+            self._count_stage_tokens()
+            self.spans.append(
+                TraceSpan(
+                    kind="turn", name="total", start_offset=0.0, duration=self.offset()
+                )
+            )
+
+    def _count_stage_tokens(self) -> None:
+        llm_spans = [span for span in self.spans if span.kind == "llm"]
+        for stage in self.spans:
+            if stage.kind != "stage":
+                continue
+            end = stage.start_offset + stage.duration
+            calls = [s for s in llm_spans if stage.start_offset <= s.start_offset < end]
+            if calls:
+                stage.prompt_tokens = sum(s.prompt_tokens or 0 for s in calls)
+                stage.completion_tokens = sum(s.completion_tokens or 0 for s in calls)
+
+    def _close_stage(self) -> None:
+        if self._stage is None:
+            return
+        first_token = self._stage_first_token
+        self.spans.append(
+            TraceSpan(
+                kind="stage",
+                name=self._stage,
+                start_offset=self.offset(self._stage_start),
+                duration=time.perf_counter() - self._stage_start,
+                time_to_first_token=(
+                    first_token - self._stage_start if first_token else None
+                ),
+            )
+        )
@@ -1,10 +1,11 @@
 from datetime import datetime
-import json
-from typing import Any, Dict, List, Literal, Optional
-from pydantic import BaseModel, Field
+from typing import Any, Callable, Dict, List, Literal, Optional
+from pydantic import BaseModel, Field, PrivateAttr
+from pydantic.json_schema import SkipJsonSchema
 
 # Absolute import from the root common module
 from common import TradingStrategyDefinition
+from .context_packer import ContextPacker
 
 
 class UserStrategy(BaseModel):
@@ -71,7 +72,7 @@ class UserStrategy(BaseModel):
         description="Additional information about the strategy that is not covered by the other fields.",
     )
 
-    def message_str(self, short:bool=True):
+    def message_str(self, short: bool = True):
         markdown = ""
 
         if short:
@@ -229,12 +230,18 @@ class RouteContext(BaseModel):
         default="non-related",
         description="Message type based on user input",
     )
+    # Set by the local router, None when the LLM routing prompt decided.
+    # Kept out of the JSON schema so it's not part of the format instructions.
+    confidence: SkipJsonSchema[Optional[float]] = None
 
 
 class QaContext(BaseModel):
     question: str
     answer: Optional[str]
 
+    def context_str(self):
+        return f"Question: {self.question}\n\nAnswer:{self.answer}\n\n----\n"
+
 
 class EvaluationContext(BaseModel):
     positive_points: Optional[List[str]]
@@ -269,6 +276,10 @@ class ContextDict(BaseModel):
     route: Optional[RouteContext]
     conversations: List[QaContext]
     evaluation: Optional[EvaluationContext]
+    # Running summary of the turns folded out of `conversations`
+    summary: Optional[str] = None
+    # Index of `conversations[0]` among all QA turns of the conversation
+    qa_offset: int = 0
 
     @classmethod
     def empty(cls) -> "ContextDict":
@@ -279,7 +290,7 @@ class ContextDict(BaseModel):
             conversations=[],
             evaluation=None,
         )
-        
+
     def new_run(self):
         return ContextDict(
             user_strategy=self.user_strategy,
@@ -287,8 +298,30 @@ class ContextDict(BaseModel):
             route=None,
             conversations=self.conversations,
             evaluation=None,
+            summary=self.summary,
+            qa_offset=self.qa_offset,
         )
-    
+
+    def compact(self, summary: str, keep_turns: int) -> "ContextDict":
+        """Replace all but the last `keep_turns` QA turns with their summary."""
+        self.summary = summary
+        kept = self.conversations[-keep_turns:] if keep_turns else []
+        self.qa_offset += len(self.conversations) - len(kept)
+        self.conversations = kept
+        return self
+
+    def fold_summary(self, summary: str, qa_offset: int) -> "ContextDict":
+        """
+        Replace the QA turns before the `qa_offset`th turn of the conversation
+        with their summary. Nothing changes if the context already starts at
+        or after it.
+        """
+        if qa_offset > self.qa_offset:
+            self.summary = summary
+            self.conversations = self.conversations[qa_offset - self.qa_offset :]
+            self.qa_offset = qa_offset
+        return self
+
     def last_qa(self):
         return self.conversations[-1] if len(self.conversations) > 0 else None
 
@@ -296,49 +329,74 @@ class ContextDict(BaseModel):
         last_qa = self.last_qa()
         return last_qa.answer if last_qa else ""
 
-    def to_full_strategy_context(self):
-        return self.user_strategy.context_str() if self.user_strategy else ""
-
-    def conversation_context(self, number_of_questions: int = 3):
-        markdown = ""
-        if len(self.conversations) > 0:
-            markdown += "Conversation History\n\n"
-            for conversation in self.conversations[-number_of_questions:]:
-                markdown += f"Question: {conversation.question}\n\n"
-                markdown += f"Answer:{conversation.answer}\n\n"
-                markdown += "----\n"
-        return markdown
-
-    def router_context(self):
-        return self.strategy_with_conversation()
-
-    def rag_context(self):
-        markdown = ""
-        if self.rag_strategies:
-            markdown += "Strategies from RAG for ideas\n\n"
-            for strategy in self.rag_strategies:
-                markdown += strategy.context_str()
-                markdown += "----\n"
-        markdown += self.conversation_context(number_of_questions=2)
-        return markdown
+    # Context sections, packed by priority: user strategy, then RAG strategies
+    # in rank order, then the most recent QA turns, then the summary of older
+    # turns.
 
-    def strategy_with_rag(self):
-        markdown = ""
+    def _user_strategy_section(self, packer: ContextPacker, header: str, suffix=""):
         if self.user_strategy:
-            markdown += "User Generated Strategy\n\n"
-            markdown += self.user_strategy.context_str()
-        markdown += self.rag_context()
+            packer.section(
+                header, [self.user_strategy.context_str() + suffix], 0, truncate=True
+            )
+
+    def _rag_section(self, packer: ContextPacker):
+        packer.section(
+            "Strategies from RAG for ideas\n\n",
+            [strategy.context_str() + "----\n" for strategy in self.rag_strategies],
+            1,
+        )
 
-        return markdown
+    def _conversation_section(self, packer: ContextPacker, number_of_questions: int):
+        if self.summary:
+            packer.section(
+                "Conversation Summary\n\n",
+                [self.summary + "\n\n----\n"],
+                3,
+                truncate=True,
+            )
+        packer.section(
+            "Conversation History\n\n",
+            [
+                conversation.context_str()
+                for conversation in self.conversations[-number_of_questions:]
+            ],
+            2,
+            newest_first=True,
+        )
 
-    def strategy_with_conversation(self):
-        markdown = ""
-        if self.user_strategy:
-            markdown += "User Generated Strategy\n\n"
-            markdown += self.user_strategy.context_str()
-            markdown += "\n\n"
-        markdown += self.conversation_context(number_of_questions=2)
-        return markdown
+    def to_full_strategy_context(self, token_budget: Optional[int] = None):
+        packer = ContextPacker(token_budget)
+        self._user_strategy_section(packer, "")
+        return packer.render()
+
+    def conversation_context(
+        self, number_of_questions: int = 3, token_budget: Optional[int] = None
+    ):
+        packer = ContextPacker(token_budget)
+        self._conversation_section(packer, number_of_questions)
+        return packer.render()
+
+    def router_context(self, token_budget: Optional[int] = None):
+        return self.strategy_with_conversation(token_budget)
+
+    def rag_context(self, token_budget: Optional[int] = None):
+        packer = ContextPacker(token_budget)
+        self._rag_section(packer)
+        self._conversation_section(packer, number_of_questions=2)
+        return packer.render()
+
+    def strategy_with_rag(self, token_budget: Optional[int] = None):
+        packer = ContextPacker(token_budget)
+        self._user_strategy_section(packer, "User Generated Strategy\n\n")
+        self._rag_section(packer)
+        self._conversation_section(packer, number_of_questions=2)
+        return packer.render()
+
+    def strategy_with_conversation(self, token_budget: Optional[int] = None):
+        packer = ContextPacker(token_budget)
+        self._user_strategy_section(packer, "User Generated Strategy\n\n", "\n\n")
+        self._conversation_section(packer, number_of_questions=2)
+        return packer.render()
 
     def to_message_str(self):
         msg = ""
@@ -363,13 +421,28 @@ class ContextDict(BaseModel):
         return msg
 
 
+class RenderedMessage(BaseModel):
+    """Markdown of a chat message, computed once and stored with it."""
+
+    content: str
+    rag_strategies: List[str] = []
+    user_strategy: Optional[str] = None
+
+
 class ChatMessage(BaseModel):
     id: Optional[int]
     conversation_id: int
     role: str
     content: str
-    context: Optional[ContextDict] = None
     created_at: str
+    rendered: Optional[RenderedMessage] = None
+    # "cancelled" for a turn stopped mid-generation, `content` is the partial
+    # output of the interrupted step
+    status: Literal["complete", "cancelled"] = "complete"
+    _context: Optional[ContextDict] = PrivateAttr(default=None)
+    _context_loader: Optional[Callable[[], Optional[ContextDict]]] = PrivateAttr(
+        default=None
+    )
 
     def __init__(
         self,
@@ -379,33 +452,87 @@ class ChatMessage(BaseModel):
         content: str,
         context: Optional[ContextDict],
         created_at: str,
+        rendered: Optional[RenderedMessage] = None,
+        status: Literal["complete", "cancelled"] = "complete",
     ):
         super().__init__(
             id=id,
             conversation_id=conversation_id,
             role=role,
             content=content,
-            context=context,
             created_at=created_at,
+            rendered=rendered,
+            status=status,
         )
+        self._context = context
+
+    @property
+    def context(self) -> Optional[ContextDict]:
+        """The message's context, loaded on first access when it's lazy."""
+        if self._context_loader is not None:
+            self._context = self._context_loader()
+            self._context_loader = None
+        return self._context
+
+    @context.setter
+    def context(self, context: Optional[ContextDict]) -> None:
+        self._context = context
+        self._context_loader = None
+
+    def lazy_context(self, loader: Callable[[], Optional[ContextDict]]) -> None:
+        """Load the context with `loader` when it's first accessed.
+
+        Messages of a loaded page are mostly displayed from their rendered
+        markdown, their context is rarely needed.
+        """
+        self._context = None
+        self._context_loader = loader
 
     def to_message_str(self):
+        if self.status == "cancelled":
+            partial = f"\n\n```\n{self.content}\n```" if self.content else ""
+            return f"_Response cancelled_{partial}"
         if self.context:
             return self.context.to_message_str()
         return self.content
 
+    def render(self) -> RenderedMessage:
+        """Rendered markdown of the message, computed on first use."""
+        if self.rendered is None:
+            rag_strategies = []
+            user_strategy = None
+            if self.role == "assistant" and self.context is not None:
+                rag_strategies = [s.message_str() for s in self.context.rag_strategies]
+                if self.context.user_strategy is not None:
+                    user_strategy = self.context.user_strategy.message_str(short=False)
+            self.rendered = RenderedMessage(
+                content=self.to_message_str(),
+                rag_strategies=rag_strategies,
+                user_strategy=user_strategy,
+            )
+        return self.rendered
+
     @classmethod
     def from_dict(cls, message: Dict[str, Any]):
         id = message["id"]
         conversation_id = message["conversation_id"]
         role = message["role"]
         content = message["content"]
-        context = (
-            json.loads(message["context"]) if message["context"] is not None else None
-        )
+        context = message["context"]
         created_at = message["created_at"]
-        context_dict = ContextDict(**context) if context else None
-        return cls(id, conversation_id, role, content, context_dict, created_at)
+        rendered = (
+            RenderedMessage.model_validate_json(message["rendered"])
+            if "rendered" in message.keys() and message["rendered"]
+            else None
+        )
+        status = message["status"] if "status" in message.keys() else "complete"
+        chat_message = cls(
+            id, conversation_id, role, content, None, created_at, rendered, status
+        )
+        if context:
+            # Parsed on first access, straight from the JSON
+            chat_message.lazy_context(lambda: ContextDict.model_validate_json(context))
+        return chat_message
 
     @classmethod
     def new_message(
@@ -414,6 +541,9 @@ class ChatMessage(BaseModel):
         role: str,
         content: str,
         context: Optional[ContextDict],
+        status: Literal["complete", "cancelled"] = "complete",
     ):
         created_at = datetime.now().isoformat()
-        return cls(None, conversation_id, role, content, context, created_at)
+        return cls(
+            None, conversation_id, role, content, context, created_at, None, status
+        )
@@ -2,10 +2,10 @@ import time
 from typing import Optional
 import streamlit as st
 from auth import FirebaseAuth, FirebaseUserDict
-from database import ChatDatabase
+from database import ChatStorage
 
 
-def login_page(firebase_auth: FirebaseAuth, db: ChatDatabase):
+def login_page(firebase_auth: FirebaseAuth, db: ChatStorage):
     """
     Display the login page with authentication options
     """
@@ -87,7 +87,7 @@ def login_page(firebase_auth: FirebaseAuth, db: ChatDatabase):
                 st.rerun()
 
 
-def handle_login(db: ChatDatabase, user_info: Optional[FirebaseUserDict]):
+def handle_login(db: ChatStorage, user_info: Optional[FirebaseUserDict]):
     """Handle user login."""
 
     if user_info:
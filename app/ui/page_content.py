@@ -1,10 +1,17 @@
 import streamlit as st
-from shared import ChatMessage, ContextDict
+from shared import ChatMessage
 from auth import FirebaseUserDict, FirebaseAuth
-from typing import List, Optional
-from services import ConversationService, ChatService, AIService, StreamHandler
+from typing import Any, Dict, Optional
+from services import (
+    ConversationService,
+    ChatService,
+    AIService,
+    GenerationJob,
+    JobRegistry,
+    shared_job_registry,
+)
 from ui.login import login_page
-from database import ChatDatabase
+from database import ChatStorage
 
 welcome = """
 
@@ -26,7 +33,7 @@ def render_page_content(
     conversation_service: ConversationService,
     ai_service: AIService,
     firebase_auth: FirebaseAuth,
-    db: ChatDatabase,
+    db: ChatStorage,
 ):
 
     if user_info is None:
@@ -45,114 +52,119 @@ def render_conversation(
             conversation_service.handle_new_conversation()
             st.rerun()
     else:
-        context = conversation_service.get_conversation_context(current_conversation_id)
         chat_service = ChatService(current_conversation_id)
+        job_registry = shared_job_registry()
+        # A job that finished while this page wasn't polling it
+        receive_finished_job(chat_service, job_registry)
+
         render_chat_messages(chat_service)
-        chat_input(chat_service, ai_service, context)
+        job = job_registry.get(current_conversation_id)
+        if job is not None:
+            render_generation_job(job)
+        chat_input(conversation_service, chat_service, ai_service, job_registry)
 
 
 def chat_input(
-    chat_service: ChatService, ai_service: AIService, context: Optional[ContextDict]
+    conversation_service: ConversationService,
+    chat_service: ChatService,
+    ai_service: AIService,
+    job_registry: JobRegistry,
 ):
     if user_message := st.chat_input("Type your message here..."):
+        # A new message replaces the response still being generated, wait for
+        # its partial turn to be stored first
+        if job_registry.cancel(chat_service.conversation_id, timeout=10):
+            receive_finished_job(chat_service, job_registry)
+
+        context = conversation_service.get_conversation_context(
+            chat_service.conversation_id
+        )
         message = chat_service.add_user_message(user_message)
-        with st.chat_message("user"):
-            st.write(user_message)
-
-        # Create a chat message container for the assistant
-        assistant_message = st.chat_message("assistant")
-
-        # Initialize session state for storing accumulated content
-        if "steps_history" not in st.session_state:
-            st.session_state.steps_history = []
-
-        # Create empty containers for steps and reasoning
-        with assistant_message:
-            # Container for accumulated steps history
-            steps_history_container = st.container()
-
-            # Display existing steps history
-            for step_data in st.session_state.steps_history:
-                with steps_history_container:
-                    st.markdown(body=f"**{step_data['step']}**")
-                    st.code(step_data["reasoning"])
-
-            # Containers for current step and reasoning
-            steps_container = st.empty()
-            reasoning_container = st.empty()
-
-            def on_step_update(step: str, steps: List[str]):
-                steps_container.markdown(body=f"{step}...")
-
-            def on_reasoning_update(step: str, reasoning: str):
-                reasoning_container.code(reasoning)
-
-            def on_reasoning_finish(step: str, reasoning: str):
-                # Add to session state to persist between reruns
-                st.session_state.steps_history.append(
-                    {"step": step, "reasoning": reasoning}
-                )
-
-                # Clear the current step and reasoning containers
-                steps_container.empty()
-                reasoning_container.empty()
-
-                # Redisplay all steps including the new one
-                with steps_history_container:
-                    st.markdown(body=f"**{step}**")
-                    st.code(body=reasoning)
-
-            handler = StreamHandler(
-                on_step_update=on_step_update,
-                on_reasoning_update=on_reasoning_update,
-                on_reasoning_finish=on_reasoning_finish,
-            )
-
-            # No need for spinner since we have our own typing indicator
-            response = ai_service.generate_response_stream(
-                message=message.content,
-                initial_context=context,
-                stream_handler=handler,
-            )
-            if isinstance(response, ContextDict):
-                ctx: ContextDict = response
-                lastAnswer = response.last_qa_answer()
-                content = lastAnswer if lastAnswer else "No answer found"
-                message = chat_service.add_assistant_message(content, ctx)
-                # Add final message
-                st.markdown(message.to_message_str())
-
-                # Clear session state for next conversation
-                st.session_state.steps_history = []
-            else:
-                message = chat_service.add_error_msg(response)
-                st.error(response)
-
-                # Clear session state for next conversation
-            st.session_state.steps_history = []
+        # Generation runs on the worker pool and outlives this script run, the
+        # user message is stored with its answer
+        job_registry.submit(ai_service, chat_service.conversation_id, message, context)
         st.rerun()
 
 
+def receive_finished_job(chat_service: ChatService, job_registry: JobRegistry):
+    job = job_registry.pop_finished(chat_service.conversation_id)
+    if job is None:
+        return
+    # The history may have been reloaded before the turn was stored
+    chat_service.receive_message(job.user_message)
+    if job.result is not None:
+        chat_service.receive_message(job.result)
+        if job.result.context is not None:
+            chat_service.update_conversation_context(job.result.context)
+    else:
+        st.error("Generating the response failed")
+
+
+@st.fragment(run_every=0.5)
+def render_generation_job(job: GenerationJob):
+    """Poll a running job, the whole page reruns once it has finished."""
+    snapshot = job.snapshot()
+    with st.chat_message("assistant"):
+        for step_data in snapshot["steps"]:
+            st.markdown(body=f"**{step_data['step']}**")
+            st.code(step_data["reasoning"])
+
+        if snapshot["current_step"]:
+            st.markdown(body=f"{snapshot['current_step']}...")
+            if snapshot["reasoning"]:
+                st.code(snapshot["reasoning"])
+
+        # Answer fields parsed from the structured output while it streams
+        markdown = answer_markdown(snapshot["fields"])
+        if markdown:
+            st.markdown(markdown)
+
+        if not job.done and st.button("Stop generating", key="stop_generating"):
+            job.cancel()
+
+    if job.done:
+        st.rerun()
+
+
+def answer_markdown(fields: Dict[str, Any]) -> str:
+    markdown = ""
+    if fields.get("direct_answer"):
+        markdown += f"{fields['direct_answer']}\n\n"
+    followup_questions = fields.get("followup_questions")
+    if isinstance(followup_questions, list) and followup_questions:
+        markdown += "#### Follow-up Questions\n"
+        for i, question in enumerate(followup_questions, 1):
+            markdown += f"{i}. {question}\n"
+    return markdown
+
+
 def render_chat_messages(chat_service: ChatService):
-    for message in chat_service.get_messages():
+    messages = chat_service.get_messages()
+    if chat_service.has_earlier_messages():
+        if st.button("Load earlier messages", key="load_earlier_messages"):
+            chat_service.load_earlier_messages()
+            st.rerun()
+
+    for message in messages:
         render_chat_message(message)
 
 
 def render_chat_message(message: ChatMessage):
-    if message.role == "assistant" and message.context is not None:
-        if len(message.context.rag_strategies) > 0:
-            with st.chat_message(message.role):
-                for strategy in message.context.rag_strategies:
-                    with st.expander("RAG Strategies"):
-                        st.markdown(strategy.message_str())
-        if message.context.user_strategy is not None:
-            with st.chat_message(message.role):
-                with st.expander("User Strategy"):
-                    st.markdown(message.context.user_strategy.message_str(short=False))
+    # Markdown is rendered once per message and stored with it
+    rendered = message.render()
+    if rendered.rag_strategies:
+        with st.chat_message(message.role):
+            for strategy in rendered.rag_strategies:
+                with st.expander("RAG Strategies"):
+                    st.markdown(strategy)
+    if rendered.user_strategy is not None:
+        with st.chat_message(message.role):
+            with st.expander("User Strategy"):
+                st.markdown(rendered.user_strategy)
 
     with st.chat_message(message.role):
         if message.role == "error":
             print(message)
             st.error(message.content)
         else:
-            st.markdown(message.to_message_str())
+            st.markdown(rendered.content)
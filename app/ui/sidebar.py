@@ -32,8 +32,19 @@ def render_conversation_list(conversation_service: ConversationService):
         conversation_service.handle_new_conversation()
         st.rerun()
 
+    query = st.text_input(
+        "Search messages",
+        key="message_search",
+        placeholder="Search messages...",
+        label_visibility="collapsed",
+        on_change=conversation_service.reset_search_results,
+    )
+    if query.strip():
+        render_search_results(conversation_service, query)
+        return
+
     # Conversations list
-    conversations = conversation_service.get_conversations()
+    conversations, has_more = conversation_service.get_sidebar_conversations()
     if not conversations:
         st.info("No conversations yet. Start a new one!")
     else:
@@ -65,3 +76,30 @@ def render_conversation_list(conversation_service: ConversationService):
                 if st.button("🗑️", key=f"yes_{conv_id}"):
                     conversation_service.handle_delete_conversation(conv_id)
                     st.rerun()
+
+        if has_more and st.button(
+            "Show more", key="more_conversations_btn", use_container_width=True
+        ):
+            conversation_service.show_more_conversations()
+            st.rerun()
+
+
+def render_search_results(conversation_service: ConversationService, query: str):
+    results, has_more = conversation_service.search_messages(query)
+    if not results:
+        st.info("No messages match your search.")
+        return
+
+    for result in results:
+        label = f"**{result['conversation_name']}** · {result['snippet']}"
+        if st.button(
+            label, key=f"search_{result['message_id']}", use_container_width=True
+        ):
+            conversation_service.handle_select_conversation(result["conversation_id"])
+            st.rerun()
+
+    if has_more and st.button(
+        "Show more results", key="more_search_results_btn", use_container_width=True
+    ):
+        conversation_service.show_more_search_results()
+        st.rerun()
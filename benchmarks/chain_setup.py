@@ -0,0 +1,156 @@
+"""
+Setup cost of the AIService response chain, per script rerun and per message.
+
+Before: app.py built an AIService on every Streamlit rerun (VectorDB client
+and strategy database). Every `generate_response_stream` call then built the
+ChatOpenAI client, parsed the prompt templates, created the output parsers
+and wired the chain. `baseline_message_setup` repeats that construction, as
+the baseline code did it for an `instruction` turn.
+After: `get_ai_service` is an `st.cache_resource` factory, as in app.py.
+Reruns get the same AIService, with its chain compiled once, and a message
+only pays for its run config. The "uncached" row builds the AIService per
+rerun instead, as app.py did before the factory.
+
+Run from the repository root (no network calls are made):
+    python benchmarks/chain_setup.py
+"""
+
+import logging
+import os
+import sys
+import timeit
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import streamlit as st
+from langchain.output_parsers import PydanticOutputParser
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableBranch, RunnableLambda
+from langchain_openai import ChatOpenAI
+from pydantic import SecretStr
+
+from common.utils import reciprocal_rank_fusion, take_top_k
+from database import Database, VectorDB
+from services import AIService, LocalRouter, StreamHandler
+from services.ai_service import StreamingCallback
+from services.prompts import (
+    evaluation,
+    general_question,
+    question_with_context,
+    rag_fusion,
+    routing,
+    trading_idea,
+)
+from shared import ContextDict, EvaluationContext, RouteContext, UserStrategy
+
+API_KEY = "sk-benchmark"
+
+
+@st.cache_resource
+def get_ai_service() -> AIService:
+    return AIService(
+        openai_api_key=API_KEY, speculative_rag=True, local_router=LocalRouter.load()
+    )
+
+
+def baseline_rerun_setup():
+    VectorDB(API_KEY)
+    Database()
+
+
+def baseline_message_setup(vector_db: VectorDB, handler: StreamHandler):
+    llm = ChatOpenAI(
+        model="gpt-4o-mini-2024-07-18",
+        api_key=SecretStr(API_KEY),
+        temperature=0.0,
+        streaming=True,
+        timeout=60,
+        callbacks=[StreamingCallback(handler)],
+    )
+    routing_prompt = ChatPromptTemplate.from_template(routing)
+    routing_parser = PydanticOutputParser(pydantic_object=RouteContext)
+    ChatPromptTemplate.from_template(general_question)
+    ChatPromptTemplate.from_template(question_with_context)
+    trading_idea_template = ChatPromptTemplate.from_template(trading_idea)
+    trading_idea_parser = PydanticOutputParser(pydantic_object=UserStrategy)
+    rag_fusion_prompt = ChatPromptTemplate.from_template(rag_fusion)
+    ChatPromptTemplate.from_template(evaluation)
+    evaluation_parser = PydanticOutputParser(pydantic_object=EvaluationContext)
+    evaluation_parser.get_format_instructions()
+
+    branches = [RunnableLambda(lambda d: d) for _ in range(6)]
+    RunnableLambda(lambda d: d) | RunnableBranch(
+        *[(lambda c: True, branch) for branch in branches[:5]], branches[5]
+    )
+
+    # Built by the RunnableLambdas when the turn ran through them
+    (
+        RunnableLambda(
+            lambda _: {"format_instructions": routing_parser.get_format_instructions()}
+        )
+        | routing_prompt
+        | llm
+        | routing_parser
+    )
+    (
+        rag_fusion_prompt
+        | llm
+        | StrOutputParser()
+        | (lambda x: x.split("\n"))
+        | vector_db.strategy_retriever().map()
+        | reciprocal_rank_fusion
+        | partial(take_top_k, k=5)
+    )
+    (
+        RunnableLambda(
+            lambda _: {
+                "format_instructions": trading_idea_parser.get_format_instructions()
+            }
+        )
+        | trading_idea_template
+        | llm
+        | trading_idea_parser
+    )
+
+
+def main(iterations: int = 50):
+    handler = StreamHandler(
+        on_step_update=lambda step, steps: None,
+        on_reasoning_update=lambda step, reasoning: None,
+        on_reasoning_finish=lambda step, reasoning: None,
+    )
+    vector_db = VectorDB(API_KEY)
+    get_ai_service()
+    # No Streamlit runtime here, st.cache_resource warns on every call. The
+    # level is reset when the config is loaded, by the first call.
+    logging.getLogger(
+        "streamlit.runtime.scriptrunner_utils.script_run_context"
+    ).setLevel(logging.ERROR)
+
+    def after_message():
+        ai_service = get_ai_service()
+        ai_service.get_chain()
+        ai_service.run_config(handler)
+        {"question": "", "context_dict": ContextDict.empty()}
+
+    print(f"{'':28}{'per rerun':>14}{'per message':>16}")
+    for name, rerun, message in [
+        (
+            "before (baseline)",
+            baseline_rerun_setup,
+            partial(baseline_message_setup, vector_db, handler),
+        ),
+        ("after, uncached service", get_ai_service.__wrapped__, after_message),
+        ("after (cached service)", get_ai_service, after_message),
+    ]:
+        rerun_seconds = timeit.timeit(rerun, number=iterations) / iterations
+        message_seconds = timeit.timeit(message, number=iterations) / iterations
+        print(
+            f"{name:28}{rerun_seconds * 1000:>11.3f} ms{message_seconds * 1000:>13.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Size and throughput of the JSON columns with and without the codec layer.
+
+Before: JSON stored as it is, the `raw` codec stands in for the plain TEXT
+columns (same bytes plus the tag byte).
+After: JSON compressed with zlib, and zstd when `zstandard` is installed.
+
+Rows are synthetic but shaped like the real ones: Discord message payloads
+in `discord_md_raw.raw_json`, TradingStrategyDefinition JSON in
+`discord_strategies.strategy_json` and rendered assistant messages (strategy
+markdown) in `messages.rendered`. Text is drawn from a fixed vocabulary, so it
+compresses like prose rather than like repeated filler.
+
+Writes are timed through Database.insert_message/insert_strategy and
+ChatDatabase.add_message, one transaction per row as in the app. Reads are
+timed through Database.get_messages/list_strategies and
+ChatDatabase.get_messages.
+
+Run from the repository root (no network calls are made):
+    python benchmarks/json_codec.py
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from common import TradingStrategyDefinition
+from database import ChatDatabase, Database
+from database import codec
+from shared import ChatMessage, RenderedMessage
+
+ROWS = 2000
+
+rng = random.Random(0)
+VOCABULARY = [
+    "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 10)))
+    for _ in range(3000)
+]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+
+def words(count: int) -> str:
+    return " ".join(rng.choices(VOCABULARY, WEIGHTS, k=count))
+
+
+def discord_message(i: int):
+    author = {
+        "id": str(10**17 + rng.randint(0, 500)),
+        "username": words(1),
+        "global_name": words(2),
+        "avatar": "%032x" % rng.getrandbits(128),
+        "discriminator": "0",
+        "public_flags": 0,
+    }
+    return {
+        "id": str(10**18 + i),
+        "type": 0,
+        "channel_id": str(10**17 + rng.randint(0, 5)),
+        "timestamp": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T"
+        f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00.000000+00:00",
+        "content": words(rng.randint(20, 250)),
+        "author": author,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "mention_everyone": False,
+        "tts": False,
+        "edited_timestamp": None,
+        "flags": 0,
+        "components": [],
+        "reactions": [
+            {"emoji": {"id": None, "name": "👍"}, "count": rng.randint(1, 9)}
+        ],
+    }
+
+
+def strategy_definition() -> TradingStrategyDefinition:
+    return TradingStrategyDefinition(
+        is_strategy=True,
+        strategy_name=words(3),
+        strategy_type="Reversal",
+        assistant_response_summary=words(60),
+        assistant_reasoning=[words(30) for _ in range(3)],
+        trading_idea=words(120),
+        indicators_and_signals=[words(25) for _ in range(4)],
+        entry_conditions=[words(25) for _ in range(3)],
+        exit_conditions=[words(25) for _ in range(3)],
+        position_sizing=words(30),
+        risk_management_rules=[words(20) for _ in range(3)],
+        markets_and_timeframes=[words(8) for _ in range(2)],
+        order_types=[words(10) for _ in range(2)],
+        additional_info=words(40),
+        questions_about_strategy=[words(15) for _ in range(3)],
+        search_queries=[words(6) for _ in range(4)],
+        source_urls=[],
+    )
+
+
+def assistant_message(conversation_id: int) -> ChatMessage:
+    strategies = [strategy_definition() for _ in range(2)]
+    message = ChatMessage.new_message(conversation_id, "assistant", words(80), None)
+    message.rendered = RenderedMessage(
+        content=words(150),
+        rag_strategies=[s.message_str() for s in strategies],
+        user_strategy=words(400),
+    )
+    return message
+
+
+MESSAGES = [discord_message(i) for i in range(ROWS)]
+STRATEGIES = [strategy_definition() for _ in range(ROWS)]
+CHAT_MESSAGES = [assistant_message(1) for _ in range(ROWS)]
+
+
+def file_size(path: str) -> int:
+    return sum(
+        os.path.getsize(path + suffix)
+        for suffix in ("", "-wal")
+        if os.path.exists(path + suffix)
+    )
+
+
+def measure(label: str, encode_with: codec.Codec):
+    codec.default_codec = lambda: encode_with
+    if encode_with.tag == codec.RawCodec.tag:
+        codec.MIN_COMPRESS_SIZE = float("inf")
+    else:
+        codec.MIN_COMPRESS_SIZE = 256
+    directory = tempfile.mkdtemp()
+    messages_path = os.path.join(directory, "messages.db")
+    frontend_path = os.path.join(directory, "frontend.db")
+    db = Database(messages_path)
+    chat_db = ChatDatabase(frontend_path, strategy_db_path=messages_path)
+    chat_db.create_user("user")
+    conversation_id = chat_db.create_conversation("user", "benchmark")
+
+    start = time.perf_counter()
+    for message in MESSAGES:
+        db.insert_message(message)
+    for i, strategy in enumerate(STRATEGIES):
+        db.insert_strategy(
+            {
+                "id": None,
+                "message_id": str(i),
+                "timestamp": MESSAGES[i]["timestamp"],
+                "flags": 0,
+                "reactions": 1,
+                "content": "",
+                "strategy": strategy,
+            }
+        )
+    for message in CHAT_MESSAGES:
+        message.conversation_id = conversation_id
+        chat_db.add_message(message)
+    write = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assert len(db.get_messages(0)) == ROWS
+    assert len(db.list_strategies(limit=ROWS)) == ROWS
+    assert len(chat_db.get_messages(conversation_id)) == ROWS
+    read = time.perf_counter() - start
+
+    for connection in (db.conn, chat_db.connection):
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        connection.execute("VACUUM")
+    size = file_size(messages_path) + file_size(frontend_path)
+    rows = 3 * ROWS
+    print(
+        f"{label:<16}{size / 1e6:>10.2f} MB{rows / write:>12.0f} rows/s"
+        f"{rows / read:>12.0f} rows/s"
+    )
+
+
+if __name__ == "__main__":
+    print(f"{ROWS} rows each of raw_json, strategy_json and rendered")
+    print(f"{'':<16}{'size':>13}{'write':>19}{'read':>19}")
+    measure("before (plain)", codec.RawCodec())
+    measure("after (zlib)", codec.ZlibCodec())
+    if codec.zstandard is not None:
+        measure("after (zstd)", codec.ZstdCodec())
+    else:
+        print("after (zstd)    zstandard is not installed")
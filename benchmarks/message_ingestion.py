@@ -0,0 +1,86 @@
+"""
+Throughput of storing scraped Discord messages, a page at a time.
+
+Before: Database.insert_message per message, one transaction each.
+After: Database.insert_messages per page of 50, the page size the scraper
+requests, in one transaction.
+
+Each run stores the same channel backfill into a fresh file, then stores it
+again to time pages that are already stored, as when the scraper resumes.
+
+Run from the repository root (no network calls are made):
+    python benchmarks/message_ingestion.py
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from database import Database
+
+PAGES = 100
+PAGE_SIZE = 50
+
+rng = random.Random(0)
+
+
+def discord_message(i: int):
+    return {
+        "id": str(10**18 + i),
+        "type": 0,
+        "channel_id": "1",
+        "timestamp": f"2024-01-01T00:00:{i % 60:02d}.000000+00:00",
+        "content": " ".join(
+            rng.choice(["rsi", "macd", "long", "short", "btc", "eth", "stop"])
+            for _ in range(rng.randint(5, 60))
+        ),
+        "author": {"id": str(rng.randint(0, 500)), "username": "trader"},
+        "attachments": [],
+        "reactions": [{"emoji": {"id": None, "name": "👍"}, "count": 1}],
+        "flags": 0,
+    }
+
+
+PAGES_OF_MESSAGES = [
+    [discord_message(page * PAGE_SIZE + i) for i in range(PAGE_SIZE)]
+    for page in range(PAGES)
+]
+
+
+def per_message(db: Database, page) -> None:
+    for message in page:
+        db.insert_message(message)
+
+
+def per_page(db: Database, page) -> None:
+    db.insert_messages(page)
+
+
+def measure(label: str, save, synchronous: str):
+    db = Database(os.path.join(tempfile.mkdtemp(), "messages.db"))
+    db.conn.execute(f"PRAGMA synchronous = {synchronous}")
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        for page in PAGES_OF_MESSAGES:
+            save(db, page)
+        timings.append(time.perf_counter() - start)
+    assert db.message_count() == PAGES * PAGE_SIZE
+    db.close()
+    rows = PAGES * PAGE_SIZE
+    print(
+        f"{label:<14}{synchronous:<8}{rows / timings[0]:>12.0f} rows/s"
+        f"{rows / timings[1]:>12.0f} rows/s"
+    )
+
+
+if __name__ == "__main__":
+    print(f"{PAGES} pages of {PAGE_SIZE} messages")
+    print(f"{'':<14}{'sync':<8}{'new':>19}{'stored':>19}")
+    for synchronous in ("NORMAL", "FULL"):
+        measure("before", per_message, synchronous)
+        measure("after", per_page, synchronous)
@@ -0,0 +1,114 @@
+"""
+Cost of opening a long conversation with ChatDatabase.get_messages.
+
+Before: every message's ContextDict was built while loading, with its
+nested UserStrategy and TradingStrategyDefinition models. The "eager" rows
+reproduce that by reading `context` of every loaded message.
+After: contexts load on first access, a page is displayed from its rendered
+markdown alone.
+
+The conversation has 200 turns. Each assistant message has a context with a
+~600-word UserStrategy, 5 RAG strategies and the recent QA turns. Timings are
+the best of 5 runs.
+
+Run from the repository root (no network calls are made):
+    python benchmarks/message_loading.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from benchmarks.json_codec import strategy_definition, words
+from database import ChatDatabase, Database
+from shared import ChatMessage, ContextDict, QaContext, RouteContext, UserStrategy
+
+TURNS = 200
+RUNS = 5
+
+
+def user_strategy() -> UserStrategy:
+    strategy = strategy_definition().model_dump()
+    strategy.update(followup_questions=[words(12) for _ in range(3)])
+    strategy.update(direct_answer=words(80))
+    return UserStrategy(**strategy)
+
+
+def build_conversation(directory: str) -> ChatDatabase:
+    messages_path = os.path.join(directory, "messages.db")
+    strategy_db = Database(messages_path)
+    for i in range(20):
+        strategy_db.insert_strategy(
+            {
+                "id": None,
+                "message_id": str(i),
+                "timestamp": "2024-01-01T00:00:00+00:00",
+                "flags": 0,
+                "reactions": 1,
+                "content": "",
+                "strategy": strategy_definition(),
+            }
+        )
+    rag_strategies = strategy_db.list_strategies_by_ids(list(range(1, 21)))
+
+    db = ChatDatabase(os.path.join(directory, "frontend.db"), messages_path)
+    db.create_user("user")
+    conversation_id = db.create_conversation("user", "benchmark")
+
+    context = ContextDict.empty()
+    for turn in range(TURNS):
+        question = words(30)
+        db.add_message(ChatMessage.new_message(conversation_id, "user", question, None))
+        context = context.new_run()
+        context.route = RouteContext(message_type="instruction")
+        context.user_strategy = user_strategy()
+        context.rag_strategies = []
+        for row in rag_strategies[turn % 15 : turn % 15 + 5]:
+            row["strategy"].id = row["id"]
+            context.rag_strategies.append(row["strategy"])
+        context.conversations = context.conversations + [
+            QaContext(question=question, answer=words(100))
+        ]
+        if len(context.conversations) > 6:
+            context.compact(words(150), 3)
+        db.add_message(
+            ChatMessage.new_message(
+                conversation_id, "assistant", context.last_qa_answer(), context
+            )
+        )
+    return db
+
+
+def best_of(function) -> float:
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def load(db: ChatDatabase, limit, eager: bool):
+    def run():
+        messages = db.get_messages(1, limit=limit)
+        for message in messages:
+            message.render()
+            if eager:
+                message.context
+
+    return run
+
+
+if __name__ == "__main__":
+    db = build_conversation(tempfile.mkdtemp())
+    print(f"{TURNS} turns, {2 * TURNS} messages")
+    for label, limit in (("first page (20)", 20), ("all messages", None)):
+        eager = best_of(load(db, limit, eager=True))
+        lazy = best_of(load(db, limit, eager=False))
+        print(
+            f"{label:<18} eager {eager * 1000:>8.1f} ms   lazy {lazy * 1000:>8.1f} ms"
+        )
@@ -0,0 +1,117 @@
+"""
+StreamHandler cost of streaming a ~4k-token UserStrategy JSON.
+
+Before: every token was appended with `text += chunk` and re-rendered, the
+UI got the whole step text (plus cursor) once per token.
+After: tokens are buffered and the text is rendered once per flush, every
+`flush_interval` seconds or `flush_size` characters and at the step end.
+
+The render callback encodes the text it gets, standing in for the payload
+Streamlit sends over the websocket for each `st.code` update. Tokens are fed
+back to back, so only the size limit flushes. At ~100 tokens/s from the API
+the 100 ms interval flushes about every 10 tokens (40 characters), the last
+row models that.
+
+Run from the repository root (no network calls are made):
+    python benchmarks/stream_handler.py
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from services import StreamHandler
+
+
+class PerTokenStreamHandler(StreamHandler):
+    """The previous reasoning_update: concatenate and render every token."""
+
+    def reasoning_update(self, text_chunk: str) -> None:
+        self.text[self.current_step] += text_chunk
+        self.reasoning[self.current_step] = self.text[self.current_step] + "▌"
+        self.on_reasoning_update(self.current_step, self.reasoning[self.current_step])
+
+        if self.field_stream is not None:
+            completed = self.field_stream.feed(text_chunk)
+            if completed:
+                self.fields.update(completed)
+
+
+def user_strategy_json(target_chars: int = 16_000) -> str:
+    """A UserStrategy-shaped JSON of about target_chars / 4 tokens."""
+    sentence = (
+        "Enter long when the 14-period RSI crosses back above 30 while price "
+        "holds above the 200-period moving average on the 1h chart. "
+    )
+    strategy = {
+        "strategy_name": "RSI Trend Pullback",
+        "strategy_type": "Momentum-based",
+        "assistant_response_summary": sentence * 4,
+        "assistant_reasoning": [sentence * 2] * 6,
+        "followup_questions": ["Which exchange and instruments do you trade?"] * 4,
+        "direct_answer": sentence * 6,
+        "trading_idea": "",
+        "indicators_and_signals": [sentence] * 6,
+        "entry_conditions": [sentence] * 4,
+        "exit_conditions": [sentence] * 4,
+        "position_sizing": sentence,
+        "risk_management_rules": [sentence] * 4,
+        "markets_and_timeframes": ["BTC/USDT 1h", "ETH/USDT 4h"],
+        "order_types": ["Market", "Limit"],
+        "additional_info": None,
+    }
+    filler = target_chars - len(json.dumps(strategy))
+    strategy["trading_idea"] = (sentence * (filler // len(sentence) + 1))[:filler]
+    return "```json\n" + json.dumps(strategy, indent=2) + "\n```"
+
+
+def run(handler_class, chunks, **kwargs):
+    renders = 0
+    rendered_bytes = 0
+
+    def on_reasoning_update(step: str, reasoning: str):
+        nonlocal renders, rendered_bytes
+        renders += 1
+        rendered_bytes += len(reasoning.encode("utf-8"))
+
+    handler = handler_class(
+        on_step_update=lambda step, steps: None,
+        on_reasoning_update=on_reasoning_update,
+        on_reasoning_finish=lambda step, reasoning: None,
+        **kwargs,
+    )
+    start = time.perf_counter()
+    handler.step_update("Generating Trading Idea")
+    handler.watch_fields(["direct_answer", "followup_questions"])
+    for chunk in chunks:
+        handler.reasoning_update(chunk)
+    handler.reasoning_finish()
+    seconds = time.perf_counter() - start
+
+    assert handler.get_text()["Generating Trading Idea"] == "".join(chunks)
+    return seconds, renders, rendered_bytes
+
+
+def main():
+    text = user_strategy_json()
+    # OpenAI streams about 4 characters per token
+    chunks = [text[i : i + 4] for i in range(0, len(text), 4)]
+    print(f"{len(chunks)} tokens, {len(text)} characters\n")
+
+    for name, handler_class, kwargs in [
+        ("before (render per token)", PerTokenStreamHandler, {}),
+        ("after (flush 100 ms / 2 KB)", StreamHandler, {}),
+        ("after (flush every 10 tokens)", StreamHandler, {"flush_size": 40}),
+    ]:
+        seconds, renders, rendered_bytes = run(handler_class, chunks, **kwargs)
+        print(
+            f"{name:30} {seconds * 1000:8.2f} ms {renders:6} renders "
+            f"{rendered_bytes / 1_000_000:8.2f} MB rendered"
+        )
+
+
+if __name__ == "__main__":
+    main()
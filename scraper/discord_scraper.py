@@ -27,12 +27,11 @@ STATE_FILE = "last_state.json"
 
 db = Database()
 
-def save_messages(messages: List[MessageType]) -> None:
-    """Save messages to database and JSON"""
+def save_messages(messages: List[MessageType]) -> int:
+    """Save messages to database and JSON, returns the number of new ones"""
 
-    # Save to database
-    for msg in messages:
-        db.insert_message(msg)
+    # Save to database, one transaction per page
+    new_count = db.insert_messages(messages)
 
     # Keep JSON as backup
     with open(OUTPUT_JSON, "a", encoding="utf-8", errors="replace") as jsonfile:
@@ -48,6 +47,8 @@ def save_messages(messages: List[MessageType]) -> None:
             json.dump(sanitized_msg, jsonfile, ensure_ascii=False)
             jsonfile.write("\n")
 
+    return new_count
+
 
 def save_state(before: Optional[str]) -> None:
     """Save pagination state to file"""
@@ -93,11 +94,14 @@ def scrape_channel(pages: int = 50) -> None:
                 print("No more messages to scrape")
                 break
 
-            save_messages(messages)
+            new_count = save_messages(messages)
             before = messages[-1]["id"]  # Get oldest message ID for next page
             pages -= 1
 
-            print(f"Saved {len(messages)} messages. Pages remaining: {pages}")
+            print(
+                f"Saved {len(messages)} messages ({new_count} new). "
+                f"Pages remaining: {pages}"
+            )
             print(f"Total messages saved: {db.message_count()}")
             time.sleep(10)  # Basic rate limiting
 
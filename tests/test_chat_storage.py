@@ -0,0 +1,200 @@
+"""
+The chat storage queries, run against every backend.
+
+PostgreSQL runs when CHAT_TEST_DATABASE_URL points at a database the tests
+may write to, each test uses its own user. Run from the repository root:
+    CHAT_TEST_DATABASE_URL=postgresql://... python -m pytest tests
+"""
+
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from common import TradingStrategyDefinition
+from database import ChatDatabase, ChatStorage, Database, PostgresChatDatabase
+from shared import ChatMessage, ContextDict, QaContext, UserStrategy
+
+POSTGRES_URL = os.environ.get("CHAT_TEST_DATABASE_URL")
+
+
+def strategy(model, name: str, **fields):
+    """A `model` strategy named `name`, the fields the LLM fills left empty."""
+    required = {
+        field: None for field, info in model.model_fields.items() if info.is_required()
+    }
+    return model(**{**required, "strategy_name": name, **fields})
+
+
+@pytest.fixture(
+    params=[
+        "sqlite",
+        pytest.param(
+            "postgres",
+            marks=pytest.mark.skipif(
+                not POSTGRES_URL, reason="CHAT_TEST_DATABASE_URL is not set"
+            ),
+        ),
+    ]
+)
+def storage(request, tmp_path) -> ChatStorage:
+    if request.param == "sqlite":
+        return ChatDatabase(
+            str(tmp_path / "frontend.db"),
+            strategy_db_path=str(tmp_path / "messages.db"),
+        )
+    # Instances read RAG strategies from PostgreSQL, not from a local file
+    return PostgresChatDatabase(
+        POSTGRES_URL, strategy_db_path=str(tmp_path / "missing.db")
+    )
+
+
+@pytest.fixture
+def user_id(storage) -> str:
+    user_id = f"test-{uuid.uuid4().hex}"
+    storage.create_user(user_id, name="Tester")
+    return user_id
+
+
+@pytest.fixture
+def rag_strategy(tmp_path) -> TradingStrategyDefinition:
+    """A strategy retrieved from the scraped strategies database."""
+    rag_strategy = strategy(
+        TradingStrategyDefinition, "Volume Breakout", is_strategy=True
+    )
+    rag_strategy.id = Database(str(tmp_path / "messages.db")).insert_strategy(
+        {
+            "message_id": "1",
+            "timestamp": "2024-01-01T00:00:00+00:00",
+            "flags": 0,
+            "reactions": "[]",
+            "content": "Buy the volume breakout",
+            "strategy": rag_strategy,
+        }
+    )
+    return rag_strategy
+
+
+def context(*turns, user_strategy=None, rag_strategies=()) -> ContextDict:
+    return ContextDict(
+        user_strategy=user_strategy,
+        rag_strategies=list(rag_strategies),
+        route=None,
+        conversations=[QaContext(question=q, answer=a) for q, a in turns],
+        evaluation=None,
+    )
+
+
+def add_turn(storage, conversation_id, question, answer, turn_context):
+    unit = storage.unit_of_work()
+    unit.add_message(ChatMessage.new_message(conversation_id, "user", question, None))
+    unit.add_message(
+        ChatMessage.new_message(conversation_id, "assistant", answer, turn_context)
+    )
+    unit.commit()
+
+
+def test_chat_storage_is_abstract():
+    with pytest.raises(TypeError):
+        ChatStorage()
+
+
+def test_messages_keep_their_context(storage, user_id, rag_strategy):
+    conversation_id = storage.create_conversation(user_id, "Breakouts")
+    first = context(("Which volume?", "Twice the average"))
+    second = context(
+        ("Which volume?", "Twice the average"),
+        ("Stop loss?", "Below the range"),
+        user_strategy=strategy(UserStrategy, "Range Breakout"),
+        rag_strategies=[rag_strategy],
+    )
+    add_turn(storage, conversation_id, "Which volume?", "Twice the average", first)
+    add_turn(storage, conversation_id, "Stop loss?", "Below the range", second)
+
+    messages = storage.get_messages(conversation_id)
+    assert [m.role for m in messages] == ["user", "assistant"] * 2
+    assert messages[1].context == first
+    assert messages[3].context == second
+    loaded = storage.get_conversation_context(conversation_id)
+    assert loaded == second
+    assert loaded.rag_strategies[0].id == rag_strategy.id
+
+
+def test_conversations_of_a_user(storage, user_id):
+    other_user = f"test-{uuid.uuid4().hex}"
+    storage.create_user(other_user)
+    ids = [storage.create_conversation(user_id, f"Chat {i}") for i in range(3)]
+    storage.create_conversation(other_user, "Not mine")
+
+    assert {c["id"] for c in storage.get_user_conversations(user_id)} == set(ids)
+    storage.delete_conversation(ids[0])
+    assert storage.get_conversation(ids[0]) is None
+    assert {c["id"] for c in storage.get_user_conversations(user_id)} == set(ids[1:])
+
+
+def test_summaries_follow_writes_of_numeric_user_ids(storage):
+    # Stored in an INTEGER column by SQLite, read back as an int
+    user_id = str(uuid.uuid4().int % 10**15)
+    storage.create_user(user_id)
+    conversation_id = storage.create_conversation(user_id, "A")
+    assert [c["name"] for c in storage.get_conversation_summaries(user_id)] == ["A"]
+
+    storage.update_conversation(conversation_id, name="B")
+    assert [c["name"] for c in storage.get_conversation_summaries(user_id)] == ["B"]
+    storage.delete_conversation(conversation_id)
+    assert storage.get_conversation_summaries(user_id) == []
+
+
+def test_search_messages(storage, user_id):
+    conversation_id = storage.create_conversation(user_id, "Momentum")
+    add_turn(
+        storage,
+        conversation_id,
+        "How do I trade momentum?",
+        "Buy strength after a breakout",
+        context(
+            ("How do I trade momentum?", "Buy strength after a breakout"),
+            user_strategy=strategy(UserStrategy, "Turtle Channel"),
+        ),
+    )
+    other_user = f"test-{uuid.uuid4().hex}"
+    storage.create_user(other_user)
+    add_turn(
+        storage,
+        storage.create_conversation(other_user, "Momentum"),
+        "Momentum again",
+        "Not yours",
+        context(("Momentum again", "Not yours")),
+    )
+
+    results = storage.search_messages(user_id, "moment")
+    assert [r["role"] for r in results] == ["user"]
+    assert results[0]["conversation_name"] == "Momentum"
+    assert "**" in results[0]["snippet"]
+
+    # The assistant message matches through its strategy name only
+    results = storage.search_messages(user_id, "turtle")
+    assert [(r["role"], r["strategy_name"]) for r in results] == [
+        ("assistant", "Turtle Channel")
+    ]
+    assert storage.search_messages(user_id, "   ") == []
+
+
+def test_conversation_memory(storage, user_id):
+    conversation_id = storage.create_conversation(user_id, "Long chat")
+    turns = [(f"Question {i}", f"Answer {i}") for i in range(4)]
+    add_turn(storage, conversation_id, *turns[-1], context(*turns))
+
+    storage.save_conversation_memory(conversation_id, "Turns 0 to 2", 3)
+    # A summary covering fewer turns doesn't replace it
+    storage.save_conversation_memory(conversation_id, "Turns 0 and 1", 2)
+    loaded = storage.get_conversation_context(conversation_id)
+    assert loaded.summary == "Turns 0 to 2"
+    assert loaded.qa_offset == 3
+    assert [qa.question for qa in loaded.conversations] == ["Question 3"]
+
+    storage.delete_conversation(conversation_id)
+    assert storage.get_conversation_context(conversation_id) is None